@@ -3,12 +3,14 @@ from builtins import bytes
 from optparse import OptionParser
 import logging
 import select
+import signal
 import socket
 import sys
 
 import pymidi.server
 from pymidi.protocol import DataProtocol
 from pymidi.protocol import ControlProtocol
+from pymidi import trace
 from pymidi import utils
 
 try:
@@ -29,6 +31,9 @@ parser.add_option(
     default=None,
     help='<ip>:<port> for listening; may give multiple times; default {}'.format(DEFAULT_BIND_ADDR),
 )
+parser.add_option(
+    '-c', '--capture', dest='capture', default=None, help='write all datagrams to this pcap file'
+)
 parser.add_option(
     '-v', '--verbose', action='store_true', dest='verbose', default=False, help='show verbose logs'
 )
@@ -72,6 +77,11 @@ def main():
 
     server = pymidi.server.Server.from_bind_addrs(bind_addrs)
     server.add_handler(ExampleHandler())
+    if hasattr(signal, 'SIGUSR1'):
+        # `kill -USR1 <pid>` prints the most recent datagrams.
+        trace.dump_on_signal(server.trace)
+    if options.capture:
+        server.start_capture(options.capture)
 
     try:
         server.serve_forever()
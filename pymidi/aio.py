@@ -0,0 +1,443 @@
+"""asyncio support.
+
+`Server` runs the same `ControlProtocol` and `DataProtocol` logic as
+`pymidi.server.Server`, but on an asyncio event loop, so that it can share a
+thread with other asyncio services. `Client` is the asyncio counterpart of
+`pymidi.client.Client`.
+"""
+
+import asyncio
+import inspect
+import logging
+import random
+import socket
+import time
+
+from construct import ConstructError
+
+from pymidi import client
+from pymidi import clock
+from pymidi import packets
+from pymidi import protocol
+from pymidi import scheduler
+from pymidi import server
+
+logger = logging.getLogger('pymidi.aio')
+
+
+class Handler(object):
+    """Like `pymidi.server.Handler`, but with coroutine callbacks.
+
+    Plain `pymidi.server.Handler` instances are also accepted by `Server`.
+    """
+
+    async def on_peer_connected(self, peer):
+        pass
+
+    async def on_peer_disconnected(self, peer):
+        pass
+
+    async def on_midi_commands(self, peer, command_list):
+        pass
+
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """Feeds datagrams from an asyncio transport to a pymidi protocol.
+
+    Once connected, the transport replaces the protocol's `socket`; both have
+    a compatible `sendto()`. If given, `message_cb` is called after each
+    datagram is handled.
+    """
+
+    def __init__(self, protocol, message_cb=None):
+        self.protocol = protocol
+        self.message_cb = message_cb
+
+    def connection_made(self, transport):
+        self.protocol.socket = transport
+
+    def datagram_received(self, data, addr):
+        self.protocol.handle_message(data, addr)
+        if self.message_cb:
+            self.message_cb()
+
+    def error_received(self, exc):
+        logger.warning('Socket error: {}'.format(exc))
+
+
+class Server(server.Server):
+    def __init__(
+        self, bind_addrs, max_queue_size=1024, data_protocol_options=None, sync_interval=None
+    ):
+        """Creates a new asyncio Server instance.
+
+        Handler callbacks are queued, and run in order by a single dispatch
+        task. When `max_queue_size` events are waiting, the server stops
+        reading from its sockets until the queue has drained by half, leaving
+        excess datagrams to the kernel rather than buffering them in memory.
+
+        `data_protocol_options` and `sync_interval` are as for
+        `pymidi.server.Server`.
+        """
+        super(Server, self).__init__(
+            bind_addrs, data_protocol_options=data_protocol_options, sync_interval=sync_interval
+        )
+        self.max_queue_size = max_queue_size
+        self.queue = None
+        self.transports = []
+        self.reading_paused = False
+        self._dispatch_task = None
+        self._timer_handle = None
+        self._timer_when = None
+
+    def add_handler(self, handler):
+        assert isinstance(handler, (Handler, server.Handler))
+        self.handlers.add(handler)
+
+    def remove_handler(self, handler):
+        assert isinstance(handler, (Handler, server.Handler))
+        self.handlers.discard(handler)
+
+    def _peer_connected_cb(self, peer):
+        self._enqueue('on_peer_connected', peer)
+
+    def _peer_disconnected_cb(self, peer):
+        self._enqueue('on_peer_disconnected', peer)
+
+    def _midi_command_cb(self, peer, midi_packet):
+        self._enqueue('on_midi_commands', peer, midi_packet.command.midi_list)
+
+    def _enqueue(self, method_name, *args):
+        try:
+            self.queue.put_nowait((method_name, args))
+        except asyncio.QueueFull:
+            # Only reachable with transports that can't pause reading.
+            logger.warning('Dispatch queue full, dropping {}'.format(method_name))
+            return
+        if self.queue.full():
+            self._pause_reading()
+
+    def _pause_reading(self):
+        if self.reading_paused:
+            return
+        logger.debug('Dispatch queue full, pausing reads')
+        self.reading_paused = True
+        for transport in self.transports:
+            pause_reading = getattr(transport, 'pause_reading', None)
+            if pause_reading:
+                pause_reading()
+
+    def _resume_reading(self):
+        if not self.reading_paused:
+            return
+        logger.debug('Dispatch queue drained, resuming reads')
+        self.reading_paused = False
+        for transport in self.transports:
+            resume_reading = getattr(transport, 'resume_reading', None)
+            if resume_reading:
+                resume_reading()
+
+    async def _dispatch(self):
+        while True:
+            method_name, args = await self.queue.get()
+            if self.reading_paused and self.queue.qsize() <= self.queue.maxsize // 2:
+                self._resume_reading()
+            for handler in list(self.handlers):
+                try:
+                    result = getattr(handler, method_name)(*args)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logger.exception('Error in handler {}'.format(handler))
+
+    async def start(self):
+        """Binds all sockets and begins serving in the background."""
+        self._init_protocols()
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        loop = asyncio.get_running_loop()
+        for sock, proto in list(self.socket_map.items()):
+            sock.setblocking(False)
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda proto=proto: DatagramEndpoint(proto, self._reschedule_timers), sock=sock
+            )
+            self.transports.append(transport)
+        self._dispatch_task = loop.create_task(self._dispatch())
+        self._schedule_timers()
+
+    def _schedule_timers(self):
+        loop = asyncio.get_running_loop()
+        self._timer_when = loop.time() + self._timer_timeout()
+        self._timer_handle = loop.call_at(self._timer_when, self._on_timer)
+
+    def _reschedule_timers(self):
+        """Brings the timer forward, if a datagram has made work due sooner."""
+        if self._timer_handle is None:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.time() + self._timer_timeout() < self._timer_when:
+            self._timer_handle.cancel()
+            self._schedule_timers()
+
+    def _on_timer(self):
+        self._run_timers()
+        self._schedule_timers()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._dispatch_task
+        finally:
+            self.close()
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        if self._timer_handle:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        if self._dispatch_task:
+            self._dispatch_task.cancel()
+            self._dispatch_task = None
+        super(Server, self).close()
+
+
+class ClientEndpoint(asyncio.DatagramProtocol):
+    """Receives invitation replies for a `Client`.
+
+    Receiver feedback and clock sync messages are passed to `command_cb`.
+    """
+
+    def __init__(self, command_cb=None):
+        self.transport = None
+        self.waiters = {}
+        self.command_cb = command_cb
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data[0:2] != protocol.APPLEMIDI_PREAMBLE:
+            return
+        command = data[2:4]
+        if command in (
+            protocol.APPLEMIDI_COMMAND_RECEIVER_FEEDBACK,
+            protocol.APPLEMIDI_COMMAND_TIMESTAMP_SYNC,
+        ):
+            if self.command_cb:
+                self.command_cb(data)
+            return
+        if command not in (
+            protocol.APPLEMIDI_COMMAND_INVITATION_ACCEPTED,
+            protocol.APPLEMIDI_COMMAND_INVITATION_REJECTED,
+        ):
+            logger.debug('Ignoring unrecognized command: {}'.format(command))
+            return
+        try:
+            packet = packets.AppleMIDIExchangePacket.parse(data)
+        except ConstructError:
+            logger.exception('Bug or malformed packet, ignoring')
+            return
+        waiter = self.waiters.pop(packet.initiator_token, None)
+        if waiter and not waiter.done():
+            waiter.set_result(packet)
+
+    def error_received(self, exc):
+        logger.warning('Socket error: {}'.format(exc))
+
+
+class LoopScheduler(scheduler.Scheduler):
+    """A `pymidi.scheduler.Scheduler` driven by the running event loop's timers."""
+
+    def __init__(self, *args, **kwargs):
+        super(LoopScheduler, self).__init__(*args, **kwargs)
+        self._handle = None
+        self._when = None
+
+    def schedule(self, event, at):
+        super(LoopScheduler, self).schedule(event, at)
+        self._set_timer()
+
+    def cancel_all(self):
+        super(LoopScheduler, self).cancel_all()
+        self.close()
+
+    def close(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _set_timer(self):
+        deadline = self.next_deadline()
+        if deadline is None or (self._handle and self._when <= deadline):
+            return
+        if self._handle:
+            self._handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._when = deadline
+        self._handle = loop.call_at(loop.time() + deadline - time.monotonic(), self._on_timer)
+
+    def _on_timer(self):
+        self._handle = None
+        try:
+            self.run_due(time.monotonic())
+        finally:
+            self._set_timer()
+
+
+class Client(client.Client):
+    """An RTP-MIDI client for asyncio.
+
+    `connect()` is a coroutine; once connected, the `send_*()` methods of
+    `pymidi.client.Client` are available, and never block: packets are
+    handed to the data transport, which buffers them if necessary. Clock
+    synchronization runs on a timer, every `sync_interval` seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Client, self).__init__(*args, **kwargs)
+        self.control_transport = None
+        self._sync_handle = None
+        self._synced = None
+
+    async def connect(self, host, port, timeout=5.0, retry_interval=0.25):
+        """Invites `host` on its control and data ports, concurrently.
+
+        Each invitation is re-sent with exponential backoff, starting after
+        `retry_interval` seconds, until it is answered. Raises
+        `InvitationTimeout` if either port hasn't answered within `timeout`
+        seconds, or `InvitationRejected` if either declines.
+        """
+        if self.host and self.port:
+            raise client.AlreadyConnected('Already connected to {}:{}'.format(self.host, self.port))
+
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        family, _, _, _, addr = infos[0]
+        host = addr[0]
+
+        endpoints = []
+        try:
+            for _ in range(2):
+                _, endpoint = await loop.create_datagram_endpoint(
+                    lambda: ClientEndpoint(self.handle_command), family=family
+                )
+                endpoints.append(endpoint)
+            control, data = endpoints
+            tasks = [
+                loop.create_task(self._invite(control, (host, port), timeout, retry_interval)),
+                loop.create_task(self._invite(data, (host, port + 1), timeout, retry_interval)),
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        except BaseException:
+            for endpoint in endpoints:
+                endpoint.transport.close()
+            raise
+
+        self.control_transport = control.transport
+        self.socket = data.transport
+        self.host = host
+        self.port = port
+        if self.sync_interval is not None:
+            self._sync_handle = loop.call_soon(self._sync_timer)
+
+    def _sync_timer(self):
+        self._send_timestamp(0, clock.timestamp())
+        self._sync_handle = asyncio.get_running_loop().call_later(
+            self.sync_interval, self._sync_timer
+        )
+
+    async def sync_timestamps(self, timeout=1.0):
+        """Synchronizes clocks with the remote peer, with a CK exchange.
+
+        Waits up to `timeout` seconds for the exchange to complete, and
+        returns whether it did.
+        """
+        self._synced = asyncio.Event()
+        self._send_timestamp(0, clock.timestamp())
+        try:
+            await asyncio.wait_for(self._synced.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def handle_timestamp(self, data):
+        exchanges = self.clock.exchanges
+        super(Client, self).handle_timestamp(data)
+        if self._synced and self.clock.exchanges != exchanges:
+            self._synced.set()
+
+    def _maybe_poll(self):
+        """Messages are delivered by the transports, and clocks synced on a timer."""
+        pass
+
+    def _start_scheduler(self):
+        return LoopScheduler(self.send_commands, lead_cb=lambda: self.clock.latency)
+
+    async def _invite(self, endpoint, addr, timeout, retry_interval):
+        loop = asyncio.get_running_loop()
+        initiator_token = random.randint(0, 2 ** 32 - 1)
+        pkt = packets.AppleMIDIExchangePacket.create(
+            protocol_version=2,
+            command=protocol.APPLEMIDI_COMMAND_INVITATION,
+            initiator_token=initiator_token,
+            ssrc=self.ssrc,
+            name=self.name,
+        )
+        waiter = loop.create_future()
+        endpoint.waiters[initiator_token] = waiter
+        deadline = loop.time() + timeout
+        interval = retry_interval
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise client.InvitationTimeout(
+                        'No answer to invitation from {}:{}'.format(*addr)
+                    )
+                logger.info('Sending exchange packet to {}:{}...'.format(*addr))
+                endpoint.transport.sendto(pkt, addr)
+                try:
+                    reply = await asyncio.wait_for(asyncio.shield(waiter), min(interval, remaining))
+                    break
+                except asyncio.TimeoutError:
+                    interval *= 2
+        finally:
+            endpoint.waiters.pop(initiator_token, None)
+
+        if reply.command == protocol.APPLEMIDI_COMMAND_INVITATION_REJECTED:
+            raise client.InvitationRejected('Invitation rejected by {}:{}'.format(*addr))
+        logger.info('Exchange with {}:{} successful.'.format(*addr))
+        return reply
+
+    def _start_flush_timer(self, delay):
+        return asyncio.get_running_loop().call_later(delay, self.flush)
+
+    def close(self):
+        """Says goodbye to the remote peer, and closes both transports."""
+        self.flush()
+        if self.scheduler:
+            self.scheduler.close()
+            self.scheduler = None
+        if self._sync_handle:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self.control_transport:
+            pkt = packets.AppleMIDIExchangePacket.create(
+                protocol_version=2,
+                command=protocol.APPLEMIDI_COMMAND_EXIT,
+                initiator_token=0,
+                ssrc=self.ssrc,
+                name=None,
+            )
+            self.control_transport.sendto(pkt, (self.host, self.port))
+            self.control_transport.close()
+            self.socket.close()
+        self.control_transport = None
+        self.socket = None
+        self.host = None
+        self.port = None
@@ -0,0 +1,25 @@
+"""Benchmarks for pymidi.
+
+These are not run by the test suite. `python -m pymidi.bench` runs the
+encode/decode micro-benchmarks (`pymidi.bench.codec`) and the end-to-end
+loopback benchmark (`pymidi.bench.loopback`); each may also be run alone, as
+may `python -m pymidi.bench.recv`, `python -m pymidi.bench.replay`, which
+replays a packet capture, and `python -m pymidi.bench.loadgen`, which drives
+a server with many simulated peers.
+
+Each benchmark gives a list of results: dicts with a `name`, a `value` in
+some `unit`, and whether `higher_is_better`, plus any details. `--json`
+writes them out, and `--compare` checks them against an earlier run.
+"""
+
+
+def format_result(result):
+    """Returns a one-line description of a benchmark result."""
+    details = ' '.join(
+        '{}={}'.format(key, round(value, 1) if isinstance(value, float) else value)
+        for key, value in sorted(result.items())
+        if key not in ('name', 'value', 'unit', 'higher_is_better')
+    )
+    return '{:32s} {:14.1f} {:6s} {}'.format(
+        result['name'], result['value'], result['unit'], details
+    ).rstrip()
@@ -0,0 +1,97 @@
+"""Runs the pymidi benchmark suite.
+
+    $ python -m pymidi.bench --json results.json
+    $ python -m pymidi.bench --compare results.json
+
+With `--compare`, each result is checked against the same one in an earlier
+`--json` file; the exit status is 1 if any is worse by more than
+`--tolerance`.
+"""
+
+from optparse import OptionParser
+import json
+import platform
+import sys
+
+from pymidi.bench import codec, format_result, loopback
+
+parser = OptionParser()
+parser.add_option(
+    '--json', dest='json', default=None, help='write results to this file, or - for stdout'
+)
+parser.add_option(
+    '--compare', dest='compare', default=None, help='compare with results from this file'
+)
+parser.add_option(
+    '--tolerance',
+    dest='tolerance',
+    type='float',
+    default=0.2,
+    help='fraction by which a result may be worse [default: %default]',
+)
+parser.add_option(
+    '--skip-loopback', dest='skip_loopback', action='store_true', help='skip the loopback run'
+)
+parser.add_option('-r', '--repeat', dest='repeat', type='int', default=5, help='timing runs')
+parser.add_option(
+    '-n', '--packets', dest='packets', type='int', default=20000, help='loopback packets'
+)
+parser.add_option(
+    '-l', '--latency-samples', dest='samples', type='int', default=2000, help='latency samples'
+)
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of descriptions of results worse than `baseline` by over `tolerance`."""
+    previous = {result['name']: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if not before or not before['value']:
+            continue
+        change = (result['value'] - before['value']) / before['value']
+        if not result['higher_is_better']:
+            change = -change
+        if change < -tolerance:
+            regressions.append(
+                '{}: {:.1f} {} (was {:.1f}, {:+.0%})'.format(
+                    result['name'], result['value'], result['unit'], before['value'], change
+                )
+            )
+    return regressions
+
+
+def main():
+    options, args = parser.parse_args()
+    results = codec.run(options.repeat)
+    if not options.skip_loopback:
+        results += loopback.run(options.packets, options.samples)
+
+    output = dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        machine=platform.machine(),
+        results=results,
+    )
+    if options.json == '-':
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        for result in results:
+            print(format_result(result))
+        if options.json:
+            with open(options.json, 'w') as f:
+                json.dump(output, f, indent=2)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Encode and decode micro-benchmarks.
+
+Times packet parsing and building, and the cost of encoding and sending a
+single command from `Client` (to a socket which discards it).
+
+    $ python -m pymidi.bench.codec
+"""
+
+from optparse import OptionParser
+import timeit
+
+from pymidi import packets
+from pymidi.bench import format_result
+from pymidi.client import Client
+from pymidi.journal import RecoveryJournal
+
+BENCH_SSRC = 0x12345678
+
+parser = OptionParser()
+parser.add_option('-r', '--repeat', dest='repeat', type='int', default=5, help='timing runs')
+
+
+class NullSocket(object):
+    """Stands in for a client's socket, discarding everything sent."""
+
+    def sendto(self, data, addr):
+        pass
+
+
+def single_packet():
+    writer = packets.MIDIPacketWriter(BENCH_SSRC)
+    return bytes(writer.write_command(1, 1000, packets.COMMAND_NOTE_ON, 60, 100))
+
+
+def multi_packet():
+    writer = packets.MIDIPacketWriter(BENCH_SSRC)
+    events = [packets.MIDIEvent(packets.COMMAND_NOTE_ON, 60 + i, 100, 10) for i in range(8)]
+    packet, _ = writer.write_events(1, 1000, events)
+    return bytes(packet)
+
+
+def journal_packet():
+    journal = RecoveryJournal()
+    for i in range(8):
+        journal.record(i, packets.COMMAND_NOTE_ON, 60 + i, 100)
+        journal.record(i, packets.COMMAND_CONTROL_MODE_CHANGE, i, 64)
+    writer = packets.MIDIPacketWriter(BENCH_SSRC)
+    return bytes(writer.write_command(9, 1000, packets.COMMAND_NOTE_ON, 72, 100, journal.encode()))
+
+
+def exchange_packet():
+    return packets.AppleMIDIExchangePacket.create(
+        protocol_version=2,
+        command=b'IN',
+        initiator_token=1234,
+        ssrc=BENCH_SSRC,
+        name='pymidi-bench',
+    )
+
+
+def timestamp_packet():
+    return packets.AppleMIDITimestampPacket.create(
+        command=b'CK',
+        ssrc=BENCH_SSRC,
+        count=1,
+        timestamp_1=1,
+        timestamp_2=2,
+        timestamp_3=0,
+    )
+
+
+def bench_client(recovery_journal):
+    client = Client(ssrc=BENCH_SSRC, recovery_journal=recovery_journal, sync_interval=None)
+    client.socket = NullSocket()
+    client.host, client.port = '127.0.0.1', 5004
+    return lambda: client._send_rtp_command(0x90, 60, 100)
+
+
+def benchmarks():
+    """Returns a list of `(name, fn)`, each timing one call of `fn()`."""
+    single, multi, journal = single_packet(), multi_packet(), journal_packet()
+    exchange, timestamp = exchange_packet(), timestamp_packet()
+    writer = packets.MIDIPacketWriter(BENCH_SSRC)
+    events = [packets.MIDIEvent(packets.COMMAND_NOTE_ON, 60 + i, 100, 10) for i in range(8)]
+    return [
+        ('parse.single', lambda: packets.MIDIPacket.parse(single)),
+        ('parse.multi', lambda: packets.MIDIPacket.parse(multi)),
+        ('parse.journal', lambda: packets.MIDIPacket.parse(journal)),
+        ('decode.single', lambda: packets.decode_midi_packet(single)),
+        ('decode.multi', lambda: packets.decode_midi_packet(multi)),
+        ('decode.journal', lambda: packets.decode_midi_packet(journal)),
+        (
+            'exchange.build_parse',
+            lambda: packets.AppleMIDIExchangePacket.parse(exchange_packet()),
+        ),
+        ('exchange.parse', lambda: packets.AppleMIDIExchangePacket.parse(exchange)),
+        (
+            'timestamp.build_parse',
+            lambda: packets.AppleMIDITimestampPacket.parse(timestamp_packet()),
+        ),
+        ('timestamp.parse', lambda: packets.AppleMIDITimestampPacket.parse(timestamp)),
+        ('write.command', lambda: writer.write_command(1, 1000, 0x90, 60, 100)),
+        ('write.events', lambda: writer.write_events(1, 1000, events)),
+        ('client.send_command', bench_client(recovery_journal=True)),
+        ('client.send_command_no_journal', bench_client(recovery_journal=False)),
+    ]
+
+
+def time_call(fn, repeat=5):
+    """Returns the best of `repeat` timings, in seconds, of one call of `fn()`.
+
+    Each timing runs `fn()` enough times to take at least 0.2 seconds.
+    """
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    return min([elapsed] + timer.repeat(repeat - 1, number)) / number
+
+
+def run(repeat=5):
+    """Runs every benchmark, and returns a list of results (see `pymidi.bench`)."""
+    results = []
+    for name, fn in benchmarks():
+        seconds = time_call(fn, repeat)
+        results.append(
+            dict(
+                name=name,
+                value=1 / seconds,
+                unit='ops/s',
+                higher_is_better=True,
+                ns_per_op=seconds * 1e9,
+            )
+        )
+    return results
+
+
+def main():
+    options, args = parser.parse_args()
+    for result in run(options.repeat):
+        print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
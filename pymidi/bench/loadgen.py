@@ -0,0 +1,396 @@
+"""Load generator: many simulated RTP-MIDI peers driving one server.
+
+Each virtual peer is a `pymidi.aio.Client` with its own SSRC and pair of
+sockets, all on one event loop. Every peer invites the server on its
+control and data ports, synchronizes clocks (CK) on connecting and every
+`--sync-interval` seconds, then makes `--rate` sends per second for
+`--duration` seconds, following a pattern:
+
+* `notes`: bursts of `--burst` note ons, then the matching note offs;
+* `cc`: `--burst` control changes per send, sweeping up and down;
+* `sysex`: one `--sysex-size` byte SysEx message per send, in as many
+  packets as its segments need;
+* `mixed`: each of the above in turn.
+
+The achieved rate is reported alongside the target, with the packets and
+events it amounted to. With `--local`, the
+server is a `pymidi.server.Server` in a child process, which counts what
+it receives from each peer, so the events lost on the way are reported
+exactly. Against another server only its receiver feedback (RS) is
+available, so the packets sent after the last one each peer's feedback
+acknowledged are reported instead.
+
+    $ python -m pymidi.bench.loadgen --local --peers 200 --rate 50
+    $ python -m pymidi.bench.loadgen --host 10.0.0.5 --port 5051 --pattern cc
+"""
+
+from optparse import OptionParser
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import statistics
+import sys
+import threading
+
+from pymidi import aio
+from pymidi import packets
+from pymidi.bench import format_result
+from pymidi.server import Handler, Server
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PATTERNS = ('notes', 'cc', 'sysex', 'mixed')
+
+logger = logging.getLogger('pymidi.bench.loadgen')
+
+# Seconds to wait after sending, for the last packets and feedback to arrive.
+SETTLE_TIME = 2.0
+
+# Manufacturer ID reserved for non-commercial use, for generated SysEx.
+SYSEX_NON_COMMERCIAL = 0x7D
+
+parser = OptionParser()
+parser.add_option('-H', '--host', dest='host', default='127.0.0.1', help='server host')
+parser.add_option('-p', '--port', dest='port', type='int', default=5051, help='server control port')
+parser.add_option(
+    '--local', dest='local', action='store_true', help='start a server in a child process'
+)
+parser.add_option('-n', '--peers', dest='peers', type='int', default=100, help='virtual peers')
+parser.add_option(
+    '-r', '--rate', dest='rate', type='float', default=10.0, help='sends/sec for each peer'
+)
+parser.add_option(
+    '-d', '--duration', dest='duration', type='float', default=10.0, help='seconds to send for'
+)
+parser.add_option(
+    '--pattern',
+    dest='pattern',
+    type='choice',
+    choices=PATTERNS,
+    default='notes',
+    help='notes, cc, sysex or mixed',
+)
+parser.add_option(
+    '--burst', dest='burst', type='int', default=4, help='events per send, for notes and cc'
+)
+parser.add_option(
+    '--sysex-size', dest='sysex_size', type='int', default=64, help='bytes per SysEx message'
+)
+parser.add_option(
+    '--sync-interval',
+    dest='sync_interval',
+    type='float',
+    default=5.0,
+    help='seconds between CK exchanges [default: %default]',
+)
+parser.add_option(
+    '--json', dest='json', default=None, help='write results to this file, or - for stdout'
+)
+
+
+class VirtualPeer(aio.Client):
+    """An `aio.Client` which sends generated traffic, and counts what it sent."""
+
+    def __init__(self, pattern='notes', burst=4, sysex_size=64, **kwargs):
+        super(VirtualPeer, self).__init__(**kwargs)
+        self.pattern = pattern
+        self.burst = burst
+        self.sysex_size = sysex_size
+        self.sends = 0
+        self.packets_sent = 0
+        self.events_sent = 0
+        # The last sequence number acknowledged by receiver feedback, or None.
+        self.acknowledged = None
+
+    def acknowledge(self, sequence_number):
+        super(VirtualPeer, self).acknowledge(sequence_number)
+        self.acknowledged = sequence_number
+
+    @property
+    def unacknowledged(self):
+        """Packets sent after the last acknowledged one (modulo 2 ** 16)."""
+        if self.acknowledged is None:
+            return self.packets_sent
+        return min(self.packets_sent, (self.sequence_number - self.acknowledged) & 0xFFFF)
+
+    def send_step(self, step):
+        """Makes the `step`th send of the pattern."""
+        pattern = self.pattern
+        if pattern == 'mixed':
+            pattern = PATTERNS[step % 3]
+        before = self.sequence_number
+        if pattern == 'notes':
+            self.events_sent += self._send_notes(step)
+        elif pattern == 'cc':
+            self.events_sent += self._send_cc_sweep(step)
+        else:
+            self.events_sent += self._send_sysex(step)
+        self.packets_sent += (self.sequence_number - before) & 0xFFFF
+        self.sends += 1
+
+    def _send_notes(self, step):
+        status = packets.COMMAND_NOTE_ON if step % 2 == 0 else packets.COMMAND_NOTE_OFF
+        first = 36 + (step // 2 * self.burst) % 64
+        events = [packets.MIDIEvent(status, first + i, 100) for i in range(self.burst)]
+        self.send_commands(events)
+        return len(events)
+
+    def _send_cc_sweep(self, step):
+        events = []
+        for i in range(self.burst):
+            value = (step * self.burst + i) % 254
+            events.append(
+                packets.MIDIEvent(packets.COMMAND_CONTROL_MODE_CHANGE, 1, min(value, 253 - value))
+            )
+        self.send_commands(events)
+        return len(events)
+
+    def _send_sysex(self, step):
+        payload = bytes((step + i) & 0x7F for i in range(max(0, self.sysex_size - 3)))
+        self.send_sysex(
+            bytes([packets.COMMAND_SYSEX, SYSEX_NON_COMMERCIAL])
+            + payload
+            + bytes([packets.COMMAND_SYSEX_END])
+        )
+        return 1
+
+
+class CountingHandler(Handler):
+    """Counts the MIDI events received from each peer, less any repairs."""
+
+    def __init__(self):
+        self.events_by_ssrc = collections.Counter()
+
+    def on_midi_commands(self, peer, command_list):
+        self.events_by_ssrc[peer.ssrc] += sum(
+            1 for e in command_list if not isinstance(e, packets.RepairEvent)
+        )
+
+
+def serve_counting(conn):
+    """Runs a counting server on 127.0.0.1, in a child process.
+
+    Sends the control port on `conn`, then serves until anything arrives on
+    `conn`, and replies with the events received, by SSRC.
+    """
+    handler = CountingHandler()
+    server = Server([('127.0.0.1', 0)])
+    server.add_handler(handler)
+    server._init_protocols()
+    ctrl_protocol, _ = server.ipv4_protocols
+    conn.send(ctrl_protocol.socket.getsockname()[1])
+
+    def wait_for_stop():
+        conn.recv()
+        server.shutdown()
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    try:
+        while not server._shutdown_requested:
+            server._loop_once(server._timer_timeout())
+            server._run_timers()
+    finally:
+        server.close()
+    conn.send(dict(handler.events_by_ssrc))
+
+
+class LocalServer(object):
+    """A `serve_counting()` server in a child process."""
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_counting, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        self.port = self.conn.recv()
+
+    def stop(self):
+        """Stops the server, and returns the events it received, by SSRC."""
+        self.conn.send(None)
+        events_by_ssrc = self.conn.recv()
+        self.process.join()
+        return events_by_ssrc
+
+
+def raise_file_limit(count):
+    """Raises the soft limit on open files towards `count`, where possible."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < count:
+        target = count if hard == resource.RLIM_INFINITY else min(count, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+async def drive(peer, rate, start, end):
+    """Makes `rate` sends per second from `peer`, from loop time `start` until `end`."""
+    loop = asyncio.get_running_loop()
+    step = 0
+    while True:
+        at = start + step / rate
+        if at >= end:
+            return
+        delay = at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        peer.send_step(step)
+        step += 1
+
+
+async def generate(
+    host,
+    port,
+    peers=100,
+    rate=10.0,
+    duration=10.0,
+    pattern='notes',
+    burst=4,
+    sysex_size=64,
+    sync_interval=5.0,
+    settle_time=SETTLE_TIME,
+):
+    """Connects `peers` `VirtualPeer`s to `host`, and drives them.
+
+    Returns the peers which connected, and the seconds taken to send;
+    longer than `duration` if sending fell behind. Each peer's first send is
+    staggered across the first `1 / rate` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    clients = [
+        VirtualPeer(
+            pattern=pattern,
+            burst=burst,
+            sysex_size=sysex_size,
+            name='pymidi-load-{}'.format(i),
+            ssrc=0x10000000 + i,
+            sync_interval=sync_interval,
+        )
+        for i in range(peers)
+    ]
+    results = await asyncio.gather(
+        *(c.connect(host, port) for c in clients), return_exceptions=True
+    )
+    connected = [c for c, result in zip(clients, results) if not isinstance(result, BaseException)]
+    for client, result in zip(clients, results):
+        if isinstance(result, BaseException):
+            logger.warning('Peer {:08x} failed to connect: {!r}'.format(client.ssrc, result))
+    await asyncio.gather(*(c.sync_timestamps() for c in connected))
+
+    start = loop.time() + 0.1
+    end = start + duration
+    await asyncio.gather(
+        *(drive(c, rate, start + i / rate / len(connected), end) for i, c in enumerate(connected))
+    )
+    elapsed = max(duration, loop.time() - start)
+    await asyncio.sleep(settle_time)
+    for client in connected:
+        client.close()
+    return connected, elapsed
+
+
+def report(connected, elapsed, peers, rate, events_by_ssrc=None):
+    """Returns a list of results (see `pymidi.bench`) describing a run."""
+    sends = sum(c.sends for c in connected)
+    packets_sent = sum(c.packets_sent for c in connected)
+    events_sent = sum(c.events_sent for c in connected)
+    latencies = [c.clock.latency for c in connected if c.clock.latency is not None]
+    results = [
+        dict(
+            name='loadgen.sends',
+            value=sends / elapsed,
+            unit='/s',
+            higher_is_better=True,
+            target=peers * rate,
+            peers=len(connected),
+        ),
+        dict(
+            name='loadgen.packets',
+            value=packets_sent / elapsed,
+            unit='pkt/s',
+            higher_is_better=True,
+            sent=packets_sent,
+        ),
+        dict(
+            name='loadgen.events',
+            value=events_sent / elapsed,
+            unit='ev/s',
+            higher_is_better=True,
+            sent=events_sent,
+            synced=len(latencies),
+            sync_rtt_ms=2e3 * statistics.median(latencies) if latencies else 0.0,
+        ),
+    ]
+    if events_by_ssrc is not None:
+        received = sum(events_by_ssrc.get(c.ssrc, 0) for c in connected)
+        lost = events_sent - received
+        results.append(
+            dict(
+                name='loadgen.loss',
+                value=100.0 * lost / events_sent if events_sent else 0.0,
+                unit='%',
+                higher_is_better=False,
+                received=received,
+                lost=lost,
+            )
+        )
+    else:
+        unacknowledged = sum(c.unacknowledged for c in connected)
+        results.append(
+            dict(
+                name='loadgen.unacknowledged',
+                value=100.0 * unacknowledged / packets_sent if packets_sent else 0.0,
+                unit='%',
+                higher_is_better=False,
+                packets=unacknowledged,
+            )
+        )
+    return results
+
+
+def run(host='127.0.0.1', port=5051, local=False, peers=100, rate=10.0, **kwargs):
+    """Runs the load generator, and returns a list of results (see `pymidi.bench`).
+
+    With `local`, `host` and `port` are ignored, and a `LocalServer` is used.
+    Other arguments are passed to `generate()`.
+    """
+    raise_file_limit(2 * peers + 64)
+    server = LocalServer() if local else None
+    if server:
+        host, port = '127.0.0.1', server.port
+    try:
+        connected, elapsed = asyncio.run(generate(host, port, peers=peers, rate=rate, **kwargs))
+    finally:
+        events_by_ssrc = server.stop() if server else None
+    return report(connected, elapsed, peers, rate, events_by_ssrc)
+
+
+def main():
+    options, args = parser.parse_args()
+    results = run(
+        host=options.host,
+        port=options.port,
+        local=options.local,
+        peers=options.peers,
+        rate=options.rate,
+        duration=options.duration,
+        pattern=options.pattern,
+        burst=options.burst,
+        sysex_size=options.sysex_size,
+        sync_interval=options.sync_interval,
+    )
+    for result in results:
+        print(format_result(result))
+    if options.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
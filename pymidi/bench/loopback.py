@@ -0,0 +1,152 @@
+"""End-to-end loopback benchmark: a `Client` sending to a `Server`.
+
+The server runs on a thread of this process, on 127.0.0.1. The client
+connects to it, then:
+
+* sends notes as fast as it can, reporting the packets/sec the server's
+  handler received;
+* sends one note at a time, waiting for the handler to receive each before
+  sending the next, reporting the 50th and 99th percentile latency from
+  send to handler.
+
+Both sides share one interpreter, so the figures include their contention
+for the GIL.
+
+    $ python -m pymidi.bench.loopback --packets 20000
+"""
+
+from optparse import OptionParser
+import socket
+import threading
+import time
+
+from pymidi.bench import format_result
+from pymidi.client import Client
+from pymidi.server import Handler, Server
+
+IDLE_TIMEOUT = 1.0
+
+parser = OptionParser()
+parser.add_option(
+    '-n', '--packets', dest='packets', type='int', default=20000, help='packets to send'
+)
+parser.add_option(
+    '-l', '--latency-samples', dest='samples', type='int', default=2000, help='latency samples'
+)
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.count = 0
+        self.last_time = None
+        self.received = threading.Event()
+
+    def on_midi_commands(self, peer, command_list):
+        self.count += len(command_list)
+        self.last_time = time.perf_counter()
+        self.received.set()
+
+
+def percentile(values, fraction):
+    """Returns the value at `fraction` (0-1) of the way through sorted `values`."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Loopback(object):
+    """A `Server` serving from a thread, with a `Client` connected to it."""
+
+    def __init__(self):
+        self.handler = RecordingHandler()
+        self.server = Server([('127.0.0.1', 0)])
+        self.server._init_protocols()
+        self.server.add_handler(self.handler)
+        ctrl_protocol, data_protocol = self.server.ipv4_protocols
+        data_protocol.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+        self.client = Client(name='pymidi-bench', sync_interval=None)
+        self.client.connect(*ctrl_protocol.socket.getsockname())
+
+    def _serve(self):
+        while not self._stop:
+            self.server._loop_once(timeout=0.1)
+            self.server._run_timers()
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        self.server.close()
+        self.client.socket.close()
+
+    def throughput(self, count):
+        """Returns `(received, elapsed)` for a burst of `count` packets."""
+        handler = self.handler
+        handler.count = 0
+        handler.last_time = None
+        start = time.perf_counter()
+        for i in range(count):
+            self.client.send_note_on(i % 128, 100)
+        last_count = -1
+        while handler.count < count and handler.count != last_count:
+            last_count = handler.count
+            time.sleep(IDLE_TIMEOUT)
+        if handler.last_time is None:
+            return 0, 0.0
+        return handler.count, handler.last_time - start
+
+    def latency(self, samples):
+        """Returns a list of send-to-handler latencies, in seconds."""
+        handler = self.handler
+        latencies = []
+        for i in range(samples):
+            handler.received.clear()
+            start = time.perf_counter()
+            self.client.send_note_on(i % 128, 100)
+            if handler.received.wait(IDLE_TIMEOUT):
+                latencies.append(handler.last_time - start)
+        return latencies
+
+
+def run(count=20000, samples=2000):
+    """Runs both benchmarks, and returns a list of results (see `pymidi.bench`)."""
+    loopback = Loopback()
+    try:
+        received, elapsed = loopback.throughput(count)
+        latencies = loopback.latency(samples)
+    finally:
+        loopback.close()
+    results = [
+        dict(
+            name='loopback.throughput',
+            value=received / elapsed if elapsed else 0.0,
+            unit='pkt/s',
+            higher_is_better=True,
+            sent=count,
+            received=received,
+        )
+    ]
+    if latencies:
+        for name, fraction in (('p50', 0.5), ('p99', 0.99)):
+            results.append(
+                dict(
+                    name='loopback.latency.{}'.format(name),
+                    value=percentile(latencies, fraction) * 1e6,
+                    unit='us',
+                    higher_is_better=False,
+                    samples=len(latencies),
+                )
+            )
+    return results
+
+
+def main():
+    options, args = parser.parse_args()
+    for result in run(options.packets, options.samples):
+        print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
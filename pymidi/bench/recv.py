@@ -0,0 +1,95 @@
+"""Compares `Server` receive throughput with and without `batch_receive`.
+
+A separate process floods the server's data port over loopback; the server
+loop runs until the flood stops, and the achieved packets/sec is reported.
+
+    $ python -m pymidi.bench.recv --packets 200000
+"""
+
+from optparse import OptionParser
+import multiprocessing
+import socket
+import time
+
+from pymidi import packets
+from pymidi.protocol import Peer
+from pymidi.receiver import recvmmsg_available
+from pymidi.server import Handler, Server
+
+BENCH_SSRC = 0x12345678
+IDLE_TIMEOUT = 0.5
+
+parser = OptionParser()
+parser.add_option(
+    '-n', '--packets', dest='packets', type='int', default=100000, help='packets to send per run'
+)
+parser.add_option('-r', '--runs', dest='runs', type='int', default=3, help='runs per receive mode')
+
+
+class CountingHandler(Handler):
+    def __init__(self):
+        self.count = 0
+
+    def on_midi_commands(self, peer, command_list):
+        self.count += len(command_list)
+
+
+def flood(addr, count):
+    writer = packets.MIDIPacketWriter(BENCH_SSRC)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i in range(count):
+        sock.sendto(writer.write_command(i, i, packets.COMMAND_NOTE_ON, 60, 100), addr)
+    sock.close()
+
+
+def run_once(batch_receive, count):
+    """Returns `(received, elapsed)` for one flood of `count` packets."""
+    server = Server([('127.0.0.1', 0)], batch_receive=batch_receive)
+    server._init_protocols()
+    handler = CountingHandler()
+    server.add_handler(handler)
+    _, data_protocol = server.ipv4_protocols
+    data_protocol.peers_by_ssrc[BENCH_SSRC] = Peer('bench', None, BENCH_SSRC)
+    data_socket = data_protocol.socket
+    data_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    sender = multiprocessing.Process(target=flood, args=(data_socket.getsockname(), count))
+    sender.start()
+    try:
+        first = last = None
+        last_count = 0
+        while handler.count < count:
+            server._loop_once(timeout=IDLE_TIMEOUT)
+            if handler.count == last_count:
+                break
+            last_count = handler.count
+            last = time.perf_counter()
+            if first is None:
+                first = last
+    finally:
+        sender.join()
+        for sock in server.socket_map:
+            sock.close()
+
+    if first is None:
+        return 0, 0.0
+    return handler.count, last - first
+
+
+def main():
+    options, args = parser.parse_args()
+    modes = [('recvfrom', False), ('batch', True)]
+    print('recvmmsg available: {}'.format(recvmmsg_available()))
+    for name, batch_receive in modes:
+        for run in range(options.runs):
+            received, elapsed = run_once(batch_receive, options.packets)
+            rate = received / elapsed if elapsed else 0.0
+            print(
+                '{:10s} run={} received={}/{} elapsed={:.3f}s rate={:.0f} pkt/s'.format(
+                    name, run, received, options.packets, elapsed, rate
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
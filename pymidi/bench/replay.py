@@ -0,0 +1,162 @@
+"""Replays a packet capture through a server's protocols.
+
+Each datagram a capture shows sent to the server is fed to a
+`ControlProtocol` or `DataProtocol`, as if received; what they send back is
+discarded. By default datagrams are fed as fast as possible, reporting the
+datagrams and MIDI events per second handled, which makes real traffic a
+reproducible benchmark; `--realtime` keeps the capture's timing instead.
+
+The server is whatever received the first invitation in the capture,
+unless its control port is given with `--port`; its data port is the next.
+Captures may be pcap or pcapng, from Wireshark, tcpdump or
+`Server.start_capture()`.
+
+    $ python -m pymidi.bench.replay session.pcapng
+"""
+
+from optparse import OptionParser
+import json
+import sys
+import time
+
+from pymidi import capture
+from pymidi import metrics
+from pymidi.bench import format_result
+from pymidi.protocol import (
+    APPLEMIDI_COMMAND_INVITATION,
+    APPLEMIDI_PREAMBLE,
+    ControlProtocol,
+    DataProtocol,
+)
+from pymidi.server import TIMER_INTERVAL
+
+parser = OptionParser(usage='%prog [options] CAPTURE')
+parser.add_option(
+    '-p', '--port', dest='port', type='int', default=None, help='control port of the server'
+)
+parser.add_option(
+    '--realtime', dest='realtime', action='store_true', help="keep the capture's timing"
+)
+parser.add_option(
+    '--json', dest='json', default=None, help='write results to this file, or - for stdout'
+)
+
+
+class NullSocket(object):
+    """Stands in for a protocol's socket, discarding everything sent."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def sendto(self, data, addr):
+        pass
+
+    def get_extra_info(self, name):
+        return ('0.0.0.0', self.port) if name == 'sockname' else None
+
+
+class Replay(object):
+    """A `ControlProtocol` and `DataProtocol`, fed datagrams from a capture."""
+
+    def __init__(self, port=None):
+        self.port = port
+        self.metrics = metrics.Registry()
+        self.data_protocol = DataProtocol(
+            NullSocket(port), midi_command_cb=self._midi_command_cb, metrics_registry=self.metrics
+        )
+        self.control_protocol = ControlProtocol(
+            data_protocol=self.data_protocol, socket=NullSocket(port), metrics_registry=self.metrics
+        )
+        self.datagrams = 0
+        self.events = 0
+        self._next_timer = None
+
+    def _midi_command_cb(self, peer, midi_packet):
+        self.events += len(midi_packet.command.midi_list)
+
+    def _protocol_for(self, datagram):
+        data = datagram.data
+        if self.port is None:
+            if data[0:2] != APPLEMIDI_PREAMBLE or data[2:4] != APPLEMIDI_COMMAND_INVITATION:
+                return None
+            self.port = datagram.dst[1]
+        port = datagram.dst[1]
+        if port == self.port:
+            return self.control_protocol
+        if port == self.port + 1:
+            return self.data_protocol
+        return None
+
+    def feed(self, datagram):
+        """Passes `datagram`, a `pymidi.capture.Datagram`, to its protocol, if sent to one."""
+        proto = self._protocol_for(datagram)
+        if proto is not None:
+            self.datagrams += 1
+            proto.handle_message(datagram.data, datagram.src[:2])
+        self.run_timers()
+
+    def run_timers(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self._next_timer is None or now >= self._next_timer:
+            self._next_timer = now + TIMER_INTERVAL
+            self.control_protocol.on_timer(now)
+            self.data_protocol.on_timer(now)
+
+    def run(self, datagrams, realtime=False):
+        """Feeds every datagram, and returns the seconds taken."""
+        start = time.perf_counter()
+        first_time_ns = None
+        for datagram in datagrams:
+            if realtime:
+                if first_time_ns is None:
+                    first_time_ns = datagram.time_ns
+                delay = (datagram.time_ns - first_time_ns) / 1e9 - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            self.feed(datagram)
+        return time.perf_counter() - start
+
+
+def run(path, port=None, realtime=False):
+    """Replays capture `path`, and returns a list of results (see `pymidi.bench`)."""
+    datagrams = list(capture.read_datagrams(path))
+    replay = Replay(port)
+    elapsed = replay.run(datagrams, realtime)
+    dropped = replay.metrics.snapshot()['pymidi_dropped_packets_total']
+    return [
+        dict(
+            name='replay.datagrams',
+            value=replay.datagrams / elapsed if elapsed else 0.0,
+            unit='pkt/s',
+            higher_is_better=True,
+            datagrams=replay.datagrams,
+            dropped=sum(dropped.values()),
+            elapsed_ms=elapsed * 1e3,
+        ),
+        dict(
+            name='replay.events',
+            value=replay.events / elapsed if elapsed else 0.0,
+            unit='ev/s',
+            higher_is_better=True,
+            events=replay.events,
+        ),
+    ]
+
+
+def main():
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Expected one capture file')
+    results = run(args[0], options.port, options.realtime)
+    for result in results:
+        print(format_result(result))
+    if options.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Reading and writing packet captures.
+
+`PcapWriter` writes datagrams to a pcap file, which Wireshark and tcpdump
+open; each is wrapped in synthesized IPv4 or IPv6 and UDP headers, so that
+they are shown between their real addresses and ports. A `Server` writes
+one with `start_capture()`.
+
+`read_datagrams()` reads the UDP datagrams back from a pcap or pcapng file,
+whether written by `PcapWriter` or captured by Wireshark or tcpdump; see
+`pymidi.bench.replay` to feed them back through a server's protocols.
+"""
+
+import collections
+import socket
+import struct
+import threading
+import time
+
+# Bytes of each datagram written by default.
+DEFAULT_SNAP_LENGTH = 65535
+
+# Link types: BSD loopback, Ethernet, raw IP, Linux cooked (v1 and v2),
+# raw IPv4 and raw IPv6.
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+PCAP_MAGIC = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPTION_TSRESOL = 9
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = 0x8100
+
+IPPROTO_UDP = 17
+
+Datagram = collections.namedtuple('Datagram', 'time_ns src dst data')
+
+_PCAP_HEADER = struct.Struct('<IHHiIII')
+_PCAP_RECORD = struct.Struct('<IIII')
+_IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+_IPV6_HEADER = struct.Struct('!IHBB16s16s')
+_UDP_HEADER = struct.Struct('!HHHH')
+
+
+def _address_family(host):
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+class PcapWriter(object):
+    def __init__(self, file, snap_length=DEFAULT_SNAP_LENGTH):
+        """Creates a new PcapWriter, writing to `file`, a path or binary file.
+
+        A file opened from a path is closed by `close()`. Of each datagram,
+        the first `snap_length` bytes are written. Safe to use from several
+        threads.
+        """
+        if isinstance(file, str):
+            self.file = open(file, 'wb')
+            self._owns_file = True
+        else:
+            self.file = file
+            self._owns_file = False
+        self.snap_length = snap_length
+        self.count = 0
+        self._lock = threading.Lock()
+        # Packed addresses, by host.
+        self._packed_hosts = {}
+        # IPv4 header checksums, less the total length, by address pair.
+        self._partial_checksums = {}
+        self.file.write(
+            _PCAP_HEADER.pack(PCAP_MAGIC_NS, 2, 4, 0, 0, snap_length + 48, LINKTYPE_RAW)
+        )
+
+    def _pack_host(self, host, family):
+        packed = self._packed_hosts.get(host)
+        if packed is None:
+            packed = self._packed_hosts[host] = socket.inet_pton(family, host)
+        return packed
+
+    def _ipv4_header(self, src, dst, length):
+        key = (src, dst)
+        partial = self._partial_checksums.get(key)
+        if partial is None:
+            header = _IPV4_HEADER.pack(0x45, 0, 0, 0, 0x4000, 64, IPPROTO_UDP, 0, src, dst)
+            partial = self._partial_checksums[key] = sum(struct.unpack('!10H', header))
+        checksum = partial + length
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        return _IPV4_HEADER.pack(
+            0x45, 0, length, 0, 0x4000, 64, IPPROTO_UDP, ~checksum & 0xFFFF, src, dst
+        )
+
+    def write(self, src, dst, data, time_ns=None):
+        """Writes datagram `data`, sent from address `src` to `dst`, at `time_ns`.
+
+        Addresses are `(host, port)` tuples; `time_ns` defaults to now, from
+        `time.time_ns()`. UDP checksums are left unset.
+        """
+        if time_ns is None:
+            time_ns = time.time_ns()
+        family = _address_family(src[0])
+        src_host = self._pack_host(src[0], family)
+        dst_host = self._pack_host(dst[0], _address_family(dst[0]))
+        if len(src_host) != len(dst_host):
+            # Such as an IPv4 peer of a dual-stack IPv6 socket.
+            family = socket.AF_INET6
+            src_host = self._pack_host(_to_ipv6(src[0]), family)
+            dst_host = self._pack_host(_to_ipv6(dst[0]), family)
+        udp = _UDP_HEADER.pack(src[1], dst[1], len(data) + 8, 0)
+        if family == socket.AF_INET:
+            ip = self._ipv4_header(src_host, dst_host, len(data) + 28)
+        else:
+            ip = _IPV6_HEADER.pack(6 << 28, len(data) + 8, IPPROTO_UDP, 64, src_host, dst_host)
+        length = len(ip) + len(udp) + len(data)
+        kept = bytes(data[: self.snap_length])
+        seconds, nanoseconds = divmod(time_ns, 10 ** 9)
+        with self._lock:
+            self.file.write(
+                b''.join(
+                    (
+                        _PCAP_RECORD.pack(
+                            seconds, nanoseconds, length - len(data) + len(kept), length
+                        ),
+                        ip,
+                        udp,
+                        kept,
+                    )
+                )
+            )
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._owns_file:
+                self.file.close()
+            else:
+                self.file.flush()
+
+
+def _to_ipv6(host):
+    return host if ':' in host else '::ffff:{}'.format(host)
+
+
+def read_datagrams(file):
+    """Yields each UDP datagram, as a `Datagram`, in pcap or pcapng file `file`.
+
+    `file` is a path or binary file. `time_ns` is the capture time in
+    nanoseconds since the epoch; `src` and `dst` are `(host, port)` tuples.
+    Fragmented datagrams, IPv6 extension headers and link types other than
+    Ethernet, loopback, raw IP and Linux cooked capture are skipped.
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            for datagram in read_datagrams(f):
+                yield datagram
+        return
+
+    magic = file.read(4)
+    if len(magic) < 4:
+        return
+    if struct.unpack('<I', magic)[0] == PCAPNG_SECTION_HEADER:
+        records = _read_pcapng(file, magic)
+    else:
+        records = _read_pcap(file, magic)
+    for time_ns, linktype, frame in records:
+        datagram = _decode_frame(linktype, frame)
+        if datagram is not None:
+            src, dst, data = datagram
+            yield Datagram(time_ns, src, dst, data)
+
+
+def _read_pcap(file, magic):
+    for order in '<>':
+        value = struct.unpack(order + 'I', magic)[0]
+        if value in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            break
+    else:
+        raise ValueError('Not a pcap or pcapng file')
+    scale = 1 if value == PCAP_MAGIC_NS else 1000
+    header = file.read(_PCAP_HEADER.size - 4)
+    linktype = struct.unpack(order + 'HHiIII', header)[5] & 0xFFFF
+    record = struct.Struct(order + 'IIII')
+    while True:
+        data = file.read(record.size)
+        if len(data) < record.size:
+            return
+        seconds, fraction, captured, length = record.unpack(data)
+        frame = file.read(captured)
+        if len(frame) < captured:
+            return
+        yield seconds * 10 ** 9 + fraction * scale, linktype, frame
+
+
+def _read_pcapng(file, magic):
+    order = '<'
+    # Link type and timestamp units per second, by interface.
+    interfaces = []
+    data = magic + file.read(8)
+    while len(data) == 12:
+        block_type = struct.unpack(order + 'I', data[:4])[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            byte_order = data[8:12]
+            order = '<' if struct.unpack('<I', byte_order)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_length = struct.unpack(order + 'I', data[4:8])[0]
+        if block_length < 12:
+            raise ValueError('Malformed pcapng block')
+        body = data[8:] + file.read(block_length - 12)
+        if len(body) < block_length - 8:
+            return
+        body = body[:-4]
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype = struct.unpack_from(order + 'H', body, 0)[0]
+            interfaces.append((linktype, _pcapng_tsresol(order, body[8:])))
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            interface, high, low, captured = struct.unpack_from(order + 'IIII', body, 0)
+            if interface < len(interfaces):
+                linktype, resolution = interfaces[interface]
+                timestamp = (high << 32) | low
+                yield timestamp * 10 ** 9 // resolution, linktype, body[20 : 20 + captured]
+        elif block_type == PCAPNG_SIMPLE_PACKET and interfaces:
+            length = struct.unpack_from(order + 'I', body, 0)[0]
+            yield 0, interfaces[0][0], body[4 : 4 + length]
+        data = file.read(12)
+
+
+def _pcapng_tsresol(order, options):
+    """Returns timestamp units per second, from interface description block `options`."""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(order + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+            value = options[offset + 4]
+            if value & 0x80:
+                return 2 ** (value & 0x7F)
+            return 10 ** value
+        offset += 4 + (length + 3) // 4 * 4
+    return 10 ** 6
+
+
+def _decode_frame(linktype, frame):
+    """Returns `(src, dst, data)` for a UDP datagram in `frame`, or None."""
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = struct.unpack_from('!H', frame, 12)[0] if len(frame) >= 14 else None
+        offset = 14
+        while ethertype == ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = struct.unpack_from('!H', frame, offset + 2)[0]
+            offset += 4
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        packet = frame[offset:]
+    elif linktype == LINKTYPE_NULL:
+        packet = frame[4:]
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        packet = frame
+    elif linktype == LINKTYPE_LINUX_SLL:
+        packet = frame[16:]
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        packet = frame[20:]
+    else:
+        return None
+    if not packet:
+        return None
+
+    version = packet[0] >> 4
+    if version == 4 and len(packet) >= 20:
+        header_length = (packet[0] & 0x0F) * 4
+        total_length, fragment, protocol = struct.unpack_from('!2xH2xHxB', packet, 0)
+        if protocol != IPPROTO_UDP or fragment & 0x3FFF:
+            return None
+        src = socket.inet_ntop(socket.AF_INET, packet[12:16])
+        dst = socket.inet_ntop(socket.AF_INET, packet[16:20])
+        udp = packet[header_length:total_length]
+    elif version == 6 and len(packet) >= 40:
+        payload_length, next_header = struct.unpack_from('!4xHB', packet, 0)
+        if next_header != IPPROTO_UDP:
+            return None
+        src = socket.inet_ntop(socket.AF_INET6, packet[8:24])
+        dst = socket.inet_ntop(socket.AF_INET6, packet[24:40])
+        udp = packet[40 : 40 + payload_length]
+    else:
+        return None
+    if len(udp) < 8:
+        return None
+    src_port, dst_port, length = struct.unpack_from('!HHH', udp, 0)
+    return (src, src_port), (dst, dst_port), udp[8:length]
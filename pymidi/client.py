@@ -1,15 +1,21 @@
 from builtins import bytes
 
 from optparse import OptionParser
+import contextlib
 import logging
 import select
 import socket
 import sys
 import random
+import threading
 import time
 
+from pymidi import clock
 from pymidi import packets
 from pymidi import protocol
+from pymidi.clock import ClockEstimator
+from pymidi.journal import RecoveryJournal
+from pymidi.scheduler import ThreadScheduler
 from pymidi import utils
 from pymidi.utils import b2h
 from construct import ConstructError
@@ -21,6 +27,14 @@ except ImportError:
 
 logger = logging.getLogger('pymidi.client')
 
+RTP_TIMESTAMP_RATE = packets.RTP_TIMESTAMP_RATE
+
+# Minimum interval, in seconds, between checks for messages from the peer.
+POLL_INTERVAL = 0.1
+
+# Default interval, in seconds, between clock synchronizations.
+DEFAULT_SYNC_INTERVAL = 10.0
+
 
 class ClientError(Exception):
     """General client error."""
@@ -30,13 +44,64 @@ class AlreadyConnected(ClientError):
     """Client is already connected."""
 
 
-class Client(object):
-    def __init__(self, name='PyMidi', ssrc=None):
-        """Creates a new Client instance."""
+class InvitationRejected(ClientError):
+    """The remote peer declined our invitation."""
+
+
+class InvitationTimeout(ClientError):
+    """The remote peer did not answer our invitation in time."""
+
+
+class Client(protocol.CommandSender):
+    def __init__(
+        self,
+        name='PyMidi',
+        ssrc=None,
+        batch_window=None,
+        recovery_journal=True,
+        sync_interval=DEFAULT_SYNC_INTERVAL,
+    ):
+        """Creates a new Client instance.
+
+        If `batch_window` is given, commands are buffered rather than sent
+        immediately, and all commands issued within `batch_window` seconds of
+        the first buffered one are sent together in a single packet. A timer
+        sends whatever is buffered once the window expires; see also
+        `batch()`.
+
+        Unless `recovery_journal` is False, every packet carries an RFC 6295
+        recovery journal, letting the receiver recover from lost packets.
+
+        Once connected, the client begins a clock synchronization (CK)
+        exchange every `sync_interval` seconds, unless it is None; `clock`
+        holds the resulting estimate of the remote peer's clock.
+        """
+        self.name = name
         self.ssrc = ssrc or random.randint(0, 2 ** 32 - 1)
+        self.sequence_number = random.randint(0, 2 ** 16 - 1)
+        self.writer = packets.MIDIPacketWriter(self.ssrc)
+        self.journal = RecoveryJournal() if recovery_journal else None
+        self.clock = ClockEstimator()
+        self.sync_interval = sync_interval
+        self.batch_window = batch_window
+        self._batch_depth = 0
+        self._pending = []
+        self._pending_start = None
+        self._pending_last = None
+        self._flush_timer = None
+        # Guards the buffer and the packet writer, which the flush timer and
+        # the scheduler use from their own threads.
+        self._lock = threading.RLock()
+        # Held while reading from the socket, so that one thread does so at once.
+        self._poll_lock = threading.Lock()
+        # Created by the first call to `schedule()`.
+        self.scheduler = None
         self.socket = None
         self.host = None
         self.port = None
+        # When to next check for messages and sync clocks; None until `connect()`.
+        self._next_poll = None
+        self._next_sync = None
 
     def connect(self, host, port):
         if self.host and self.port:
@@ -61,89 +126,226 @@ class Client(object):
 
         self.host = host
         self.port = port
+        self._next_poll = 0
+        self._next_sync = 0
+
+    def sync_timestamps(self, timeout=1.0):
+        """Synchronizes clocks with the remote peer, with a CK exchange.
+
+        Waits up to `timeout` seconds for the exchange to complete, and
+        returns whether it did.
+        """
+        exchanges = self.clock.exchanges
+        self._send_timestamp(0, clock.timestamp())
+        deadline = time.monotonic() + timeout
+        while self.clock.exchanges == exchanges:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.socket], [], [], remaining)[0]:
+                self.poll()
+        return True
 
-    def sync_timestamps(self, port):
-        ts1 = int(time.time() * 1000)
+    def _send_timestamp(self, count, timestamp_1, timestamp_2=0, timestamp_3=0):
         packet = packets.AppleMIDITimestampPacket.create(
             command=protocol.APPLEMIDI_COMMAND_TIMESTAMP_SYNC,
             ssrc=self.ssrc,
             count=count,
-            padding=0,
-            timestamp_1=ts1,
-            timestamp_2=0,
-            timestamp_3=0,
+            timestamp_1=timestamp_1,
+            timestamp_2=timestamp_2,
+            timestamp_3=timestamp_3,
         )
+        self.socket.sendto(packet, (self.host, self.port + 1))
 
-    def send_note_on(self, notestr, velocity=80, channel=1):
-        self._send_note(notestr, packets.COMMAND_NOTE_ON, velocity, channel)
-
-    def send_note_off(self, notestr, velocity=80, channel=1):
-        self._send_note(notestr, packets.COMMAND_NOTE_OFF, velocity, channel)
-
-    def _send_note(self, notestr, command, velocity=80, channel=1):
-        # key = packets.MIDINote.build(notestr)
-        command = {
-            'flags': {
-                'b': 0,
-                'j': 0,
-                'z': 0,
-                'p': 0,
-                'len': 3,
-            },
-            'midi_list': [
-                {
-                    'delta_time': 0,
-                    '__next': 0x80,  # TODO(mikey): This shouldn't be needed.
-                    'command': 'note_on' if command == packets.COMMAND_NOTE_ON else 'note_off',
-                    'command_byte': command | (channel & 0xF),
-                    'channel': channel,
-                    'params': {
-                        'key': notestr,
-                        'velocity': velocity,
-                    },
-                }
-            ],
-        }
-        self._send_rtp_command(command)
-
-    def _send_rtp_command(self, command):
-        header = packets.MIDIPacketHeader.create(
-            rtp_header={
-                'flags': {
-                    'v': 0x2,
-                    'p': 0,
-                    'x': 0,
-                    'cc': 0,
-                    'm': 0x1,
-                    'pt': 0x61,
-                },
-                'sequence_number': ord('K'),
-            },
-            timestamp=int(time.time()),
-            ssrc=self.ssrc,
-        )
+    def _next_sequence_number(self):
+        self.sequence_number = (self.sequence_number + 1) & 0xFFFF
+        return self.sequence_number
 
-        packet = packets.MIDIPacket.create(
-            header={
-                'rtp_header': {
-                    'flags': {
-                        'v': 0x2,
-                        'p': 0,
-                        'x': 0,
-                        'cc': 0,
-                        'm': 0x1,
-                        'pt': 0x61,
-                    },
-                    'sequence_number': ord('K'),
-                },
-                'timestamp': int(time.time()),
-                'ssrc': self.ssrc,
-            },
-            command=command,
-            journal='',
-        )
+    def _journal(self):
+        return self.journal.encode() if self.journal is not None else None
 
-        self.socket.sendto(packet, (self.host, self.port + 1))
+    def acknowledge(self, sequence_number):
+        """Trims the recovery journal once the receiver has `sequence_number`."""
+        if self.journal is not None:
+            self.journal.acknowledge(sequence_number)
+
+    def handle_feedback(self, data):
+        """Handles a receiver feedback (RS) message from the remote peer."""
+        try:
+            packet = packets.AppleMIDIReceiverFeedbackPacket.parse(bytes(data))
+        except ConstructError:
+            logger.exception('Bug or malformed packet, ignoring')
+            return
+        logger.debug('Peer has received up to {}'.format(packet.sequence_number))
+        self.acknowledge(packet.sequence_number)
+
+    def handle_timestamp(self, data):
+        """Takes part in a CK exchange with the remote peer."""
+        try:
+            packet = packets.AppleMIDITimestampPacket.parse(bytes(data))
+        except ConstructError:
+            logger.exception('Bug or malformed packet, ignoring')
+            return
+        now = clock.timestamp()
+        if packet.count == 0:
+            self._send_timestamp(1, packet.timestamp_1, now)
+        elif packet.count == 1:
+            self._send_timestamp(2, packet.timestamp_1, packet.timestamp_2, now)
+            self.clock.add_exchange(packet.timestamp_1, packet.timestamp_2, now, True)
+        elif packet.count == 2:
+            self.clock.add_exchange(
+                packet.timestamp_1, packet.timestamp_2, packet.timestamp_3, False
+            )
+
+    def handle_command(self, data):
+        """Handles a command message received once connected."""
+        if data[0:2] != protocol.APPLEMIDI_PREAMBLE:
+            return
+        command = bytes(data[2:4])
+        if command == protocol.APPLEMIDI_COMMAND_RECEIVER_FEEDBACK:
+            self.handle_feedback(data)
+        elif command == protocol.APPLEMIDI_COMMAND_TIMESTAMP_SYNC:
+            self.handle_timestamp(data)
+        else:
+            logger.debug('Ignoring unrecognized command: {}'.format(command))
+
+    def poll(self):
+        """Handles any messages waiting on the socket, without blocking.
+
+        Called from time to time while sending, to take receiver feedback
+        and clock sync replies, which arrive on the same socket as the
+        invitation replies.
+        """
+        with self._poll_lock:
+            self._poll()
+
+    def _poll(self):
+        while select.select([self.socket], [], [], 0)[0]:
+            data, addr = self.socket.recvfrom(1024)
+            self.handle_command(data)
+
+    def _maybe_poll(self):
+        if self._next_poll is None:
+            return
+        # Another thread sending at the same moment is already polling.
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if self.sync_interval is not None and now >= self._next_sync:
+                self._next_sync = now + self.sync_interval
+                self._send_timestamp(0, clock.timestamp())
+            if now >= self._next_poll:
+                self._next_poll = now + POLL_INTERVAL
+                self._poll()
+        finally:
+            self._poll_lock.release()
+
+    def _timestamp(self):
+        return clock.timestamp()
+
+    def _send_rtp_command(self, status, data1, data2=None):
+        if self.batch_window is None and not self._batch_depth:
+            with self._lock:
+                sequence_number = self._next_sequence_number()
+                packet = self.writer.write_command(
+                    sequence_number, self._timestamp(), status, data1, data2, self._journal()
+                )
+                self.socket.sendto(packet, (self.host, self.port + 1))
+                if self.journal is not None:
+                    self.journal.record(sequence_number, status, data1, data2 or 0)
+            self._maybe_poll()
+            return
+
+        with self._lock:
+            now = self._timestamp()
+            if self._pending:
+                delta_time = min(now - self._pending_last, packets.MAX_DELTA_TIME)
+            else:
+                delta_time = None
+                self._pending_start = now
+            self._pending.append(packets.MIDIEvent(status, data1, data2 or 0, delta_time))
+            self._pending_last = now
+
+            if self._batch_depth:
+                return
+            if now - self._pending_start >= self.batch_window * RTP_TIMESTAMP_RATE:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = self._start_flush_timer(self.batch_window)
+
+    def _start_flush_timer(self, delay):
+        """Arranges for `flush()` to be called in `delay` seconds.
+
+        Returns an object with a `cancel()` method.
+        """
+        timer = threading.Timer(delay, self.flush)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def send_commands(self, events, timestamp=None):
+        """Sends a list of `packets.MIDIEvent`s in as few packets as possible.
+
+        The `delta_time` of each event is relative to the previous one, in
+        RTP timestamp units (`RTP_TIMESTAMP_RATE` per second); the first
+        event is stamped with `timestamp`, or the current time. Safe to call
+        from any thread.
+        """
+        addr = (self.host, self.port + 1)
+        with self._lock:
+            if timestamp is None:
+                timestamp = self._timestamp()
+            start = 0
+            while start < len(events):
+                sequence_number = self._next_sequence_number()
+                packet, count = self.writer.write_events(
+                    sequence_number, timestamp, events, start, self._journal()
+                )
+                self.socket.sendto(packet, addr)
+                if self.journal is not None:
+                    self.journal.record_events(sequence_number, events[start : start + count])
+                start += count
+                timestamp += sum(e.delta_time or 0 for e in events[start - count + 1 : start + 1])
+        self._maybe_poll()
+
+    def schedule(self, event, at=None):
+        """Sends `event`, a `packets.MIDIEvent`, at `time.monotonic()` time `at`.
+
+        The packet is stamped with `at`, and sent early by the estimated
+        one-way latency to the peer, once clocks are synced, so that it
+        arrives on time. Events due within the same millisecond are sent in
+        one packet. Sending happens in the background, independent of the
+        caller's timing.
+        """
+        if self.scheduler is None:
+            self.scheduler = self._start_scheduler()
+        self.scheduler.schedule(event, time.monotonic() if at is None else at)
+
+    def _start_scheduler(self):
+        return ThreadScheduler(self.send_commands, lead_cb=lambda: self.clock.latency)
+
+    def flush(self):
+        """Sends any commands buffered by `batch_window` or `batch()`."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return
+            events, self._pending = self._pending, []
+            self.send_commands(events, timestamp=self._pending_start)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Buffers all commands sent within the block, then sends them together."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
 
     def get_next_packet(self):
         data, addr = self.socket.recvfrom(1024)
@@ -0,0 +1,76 @@
+"""Session clocks and AppleMIDI clock synchronization.
+
+Timestamps sent by pymidi, in RTP-MIDI packets and in clock synchronization
+(CK) exchanges, are read from `timestamp()`: the monotonic clock, in units
+of 100 microseconds. The clock does not jump when the system time is set;
+only differences between its readings are meaningful.
+
+A CK exchange has three messages. The initiator sends its time (count 0);
+the responder adds its own (count 1); the initiator adds the time it got
+that reply, and sends all three back (count 2). Either side may then
+estimate the offset between the two clocks, assuming the reply took as long
+as the request. `ClockEstimator` keeps a window of such estimates, and
+trusts the one from the exchange with the smallest round-trip time, which
+was least delayed by queueing along the way.
+"""
+
+import collections
+import time
+
+from pymidi import packets
+
+# Number of recent exchanges from which the estimate is chosen.
+DEFAULT_WINDOW = 8
+
+
+def timestamp():
+    """Returns the current time of the session clock, in RTP timestamp units."""
+    return int(time.monotonic() * packets.RTP_TIMESTAMP_RATE)
+
+
+class ClockEstimator(object):
+    """Estimates a remote peer's clock from CK exchanges.
+
+    `offset` is the remote clock minus the local one, and `rtt` the round
+    trip time, both in RTP timestamp units; None until the first exchange.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.samples = collections.deque(maxlen=window)
+        self.offset = None
+        self.rtt = None
+        self.exchanges = 0
+
+    def add_exchange(self, timestamp_1, timestamp_2, timestamp_3, initiator):
+        """Adds the three timestamps of a completed exchange.
+
+        `initiator` tells whether the local clock is the one which read
+        `timestamp_1` and `timestamp_3`, rather than `timestamp_2`.
+        """
+        rtt = timestamp_3 - timestamp_1
+        if rtt < 0:
+            return
+        offset = timestamp_2 - (timestamp_1 + timestamp_3) / 2
+        if not initiator:
+            offset = -offset
+        self.add_sample(offset, rtt)
+
+    def add_sample(self, offset, rtt):
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+        self.exchanges += 1
+
+    @property
+    def latency(self):
+        """The estimated one-way latency in seconds, or None."""
+        if self.rtt is None:
+            return None
+        return self.rtt / 2 / packets.RTP_TIMESTAMP_RATE
+
+    def to_local(self, remote_timestamp):
+        """Converts a timestamp of the remote clock to the local clock."""
+        return remote_timestamp - self.offset
+
+    def to_remote(self, local_timestamp):
+        """Converts a timestamp of the local clock to the remote clock."""
+        return local_timestamp + self.offset
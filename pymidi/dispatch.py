@@ -0,0 +1,163 @@
+"""Handler dispatch on a thread pool.
+
+By default `Server` runs handlers synchronously, on the thread reading from
+its sockets, so one slow handler delays every peer. A `ThreadPoolDispatcher`
+instead queues handler calls per peer, and runs them on a pool of threads:
+calls for the same peer still run one at a time and in order, while
+different peers proceed in parallel.
+"""
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger('pymidi.dispatch')
+
+# What to do when a peer's queue is full.
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class _PeerQueue(object):
+    __slots__ = ('items', 'scheduled')
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.scheduled = False
+
+
+class ThreadPoolDispatcher(object):
+    def __init__(self, num_threads=4, max_queue_size=1024, overflow=OVERFLOW_BLOCK):
+        """Creates a new dispatcher, and starts its threads.
+
+        Each peer may have up to `max_queue_size` calls waiting. Beyond that,
+        `overflow` decides whether `submit()` blocks until there is room,
+        discards the peer's oldest waiting call, or discards the new one.
+        Calls submitted with `droppable=False` are never discarded, and never
+        wait for room.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(overflow))
+        self.max_queue_size = max_queue_size
+        self.overflow = overflow
+
+        self.queues = {}
+        self.ready = collections.deque()
+        self.closed = False
+        self._lock = threading.Lock()
+        self._work_available = threading.Condition(self._lock)
+        self._space_available = threading.Condition(self._lock)
+
+        # Counters; see `stats()`.
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+        self.threads = []
+        for i in range(num_threads):
+            thread = threading.Thread(
+                target=self._worker, name='pymidi-dispatch-{}'.format(i), daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, fn, *args, droppable=True):
+        """Queues `fn(*args)` to run after all earlier calls for `key`.
+
+        Returns False if the call was discarded by the overflow policy.
+        """
+        with self._lock:
+            if self.closed:
+                raise RuntimeError('Dispatcher is closed')
+            while True:
+                queue = self.queues.get(key)
+                if queue is None:
+                    queue = self.queues[key] = _PeerQueue()
+                if not droppable or len(queue.items) < self.max_queue_size:
+                    break
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    if self._drop_oldest(queue):
+                        self.dropped += 1
+                    break
+                # Wait for room. The peer's queue may be retired meanwhile, so
+                # look it up again afterwards.
+                self._space_available.wait()
+                if self.closed:
+                    raise RuntimeError('Dispatcher is closed')
+
+            queue.items.append((fn, args, droppable))
+            self.submitted += 1
+            self.queue_depth += 1
+            if self.queue_depth > self.max_queue_depth:
+                self.max_queue_depth = self.queue_depth
+            if not queue.scheduled:
+                queue.scheduled = True
+                self.ready.append(key)
+                self._work_available.notify()
+        return True
+
+    def _drop_oldest(self, queue):
+        for i, item in enumerate(queue.items):
+            if item[2]:
+                del queue.items[i]
+                self.queue_depth -= 1
+                return True
+        return False
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self.ready and not self.closed:
+                    self._work_available.wait()
+                if not self.ready:
+                    return
+                key = self.ready.popleft()
+                queue = self.queues[key]
+                fn, args, _ = queue.items.popleft()
+                self.queue_depth -= 1
+                self._space_available.notify_all()
+
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception('Error dispatching to {}'.format(fn))
+
+            with self._lock:
+                self.processed += 1
+                if queue.items:
+                    # Back of the line, so busy peers can't starve the rest.
+                    self.ready.append(key)
+                    self._work_available.notify()
+                else:
+                    queue.scheduled = False
+                    del self.queues[key]
+
+    def stats(self):
+        """Returns a dict of counters, and the current total queue depth."""
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'peers': len(self.queues),
+            }
+
+    def close(self, wait=True):
+        """Stops accepting calls; threads exit once all queued calls have run."""
+        with self._lock:
+            self.closed = True
+            self._work_available.notify_all()
+            self._space_available.notify_all()
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
@@ -0,0 +1,166 @@
+"""Per-peer jitter buffer.
+
+`JitterBuffer` holds incoming RTP-MIDI packets for a short, fixed playout
+delay, so that packets which arrive out of order can be put back in order,
+and so that packets are released at a steady pace set by their RTP
+timestamps rather than by the network.
+
+A packet's playout time is its RTP timestamp, mapped to the local
+`time.monotonic()` clock by a clock offset, plus the playout delay. The
+offset may be given (for example, from clock synchronization); otherwise it
+is estimated as the smallest difference between arrival time and RTP time
+over the last few packets, i.e. as if the fastest of them had taken no time
+to arrive.
+
+Packets are released in sequence order once their playout time has passed.
+A missing packet is waited for only until the packet after it is due; it is
+then counted as lost. Packets arriving after a later one has been released
+are counted as late and dropped, as are duplicates.
+"""
+
+import collections
+import heapq
+
+from pymidi import packets
+
+# Default playout delay, in seconds.
+DEFAULT_PLAYOUT_DELAY = 0.01
+
+# Most packets held at once; beyond this, the oldest is released early.
+DEFAULT_MAX_PACKETS = 256
+
+# Number of recent arrivals over which the clock offset is estimated.
+OFFSET_WINDOW = 64
+
+# Number of released sequence numbers remembered, to tell duplicates from
+# late packets.
+RECENT_WINDOW = 128
+
+
+def _signed(value, bits):
+    """Interprets the low `bits` bits of `value` as a two's complement int."""
+    half = 1 << (bits - 1)
+    return ((value + half) & ((1 << bits) - 1)) - half
+
+
+class JitterBuffer(object):
+    def __init__(
+        self,
+        playout_delay=DEFAULT_PLAYOUT_DELAY,
+        clock_offset=None,
+        max_packets=DEFAULT_MAX_PACKETS,
+    ):
+        """Creates a new JitterBuffer.
+
+        `clock_offset`, if given, is the number of seconds to add to a
+        packet's RTP time (its timestamp divided by the RTP timestamp rate)
+        to give the local `time.monotonic()` time it was sent; it may be
+        updated at any time. When None, it is estimated from arrival times.
+        """
+        self.playout_delay = playout_delay
+        self.clock_offset = clock_offset
+        self.max_packets = max_packets
+
+        # Heap of (extended seqnum, playout time, packet).
+        self._heap = []
+        self._buffered = set()
+        self._recent = collections.deque(maxlen=RECENT_WINDOW)
+        self._offsets = collections.deque(maxlen=OFFSET_WINDOW)
+
+        # Extended (unwrapped) sequence number of the last packet released,
+        # or of the one before the first packet seen.
+        self._last_released = None
+        # Extended sequence number of the latest packet seen.
+        self._highest = None
+        # Extended (unwrapped) RTP timestamp of the latest packet seen.
+        self._last_timestamp = None
+
+        # Counters.
+        self.received = 0
+        self.reordered = 0
+        self.duplicate = 0
+        self.late = 0
+        self.lost = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def estimated_offset(self):
+        """Returns the clock offset in use, in seconds, or None if unknown."""
+        if self.clock_offset is not None:
+            return self.clock_offset
+        if not self._offsets:
+            return None
+        return min(self._offsets)
+
+    def _extend_seqnum(self, seqnum):
+        return self._last_released + _signed(seqnum - self._last_released, 16)
+
+    def _extend_timestamp(self, timestamp, now):
+        if self.clock_offset is not None:
+            # The sender's clock is known; take the nearest time to now.
+            expected = int((now - self.clock_offset) * packets.RTP_TIMESTAMP_RATE)
+            return expected + _signed(timestamp - expected, 32)
+        if self._last_timestamp is None:
+            extended = timestamp
+        else:
+            extended = self._last_timestamp + _signed(timestamp - self._last_timestamp, 32)
+        if self._last_timestamp is None or extended > self._last_timestamp:
+            self._last_timestamp = extended
+        return extended
+
+    def push(self, packet, now):
+        """Adds `packet`, a decoded `MIDIPacket`, which arrived at `now`.
+
+        Returns False if the packet was dropped, as a duplicate or too late.
+        """
+        self.received += 1
+        sequence_number = packet.header.rtp_header.sequence_number
+        if self._last_released is None:
+            self._last_released = sequence_number - 1
+        seqnum = self._extend_seqnum(sequence_number)
+
+        if seqnum in self._buffered or seqnum in self._recent:
+            self.duplicate += 1
+            return False
+        if seqnum <= self._last_released:
+            if self._recent:
+                self.late += 1
+                return False
+            # Nothing has been released yet, so wait for this one too.
+            self._last_released = seqnum - 1
+        if self._highest is not None and seqnum < self._highest:
+            self.reordered += 1
+        else:
+            self._highest = seqnum
+
+        timestamp = self._extend_timestamp(packet.header.timestamp, now)
+        remote_time = timestamp / packets.RTP_TIMESTAMP_RATE
+        self._offsets.append(now - remote_time)
+        playout = remote_time + self.estimated_offset() + self.playout_delay
+        heapq.heappush(self._heap, (seqnum, playout, packet))
+        self._buffered.add(seqnum)
+        return True
+
+    def next_deadline(self):
+        """Returns the `time.monotonic()` time the next packet is due, or None."""
+        if not self._heap:
+            return None
+        if len(self._heap) > self.max_packets:
+            return float('-inf')
+        return self._heap[0][1]
+
+    def pop(self, now):
+        """Removes and returns the packets due at `now`, in sequence order."""
+        released = []
+        while self._heap:
+            seqnum, playout, packet = self._heap[0]
+            if playout > now and len(self._heap) <= self.max_packets:
+                break
+            heapq.heappop(self._heap)
+            self._buffered.discard(seqnum)
+            self.lost += seqnum - self._last_released - 1
+            self._last_released = seqnum
+            self._recent.append(seqnum)
+            released.append(packet)
+        return released
@@ -0,0 +1,778 @@
+"""RTP-MIDI recovery journal (RFC 6295).
+
+Each outgoing RTP-MIDI packet may carry a recovery journal: a summary of the
+MIDI state changed by earlier packets, starting at a *checkpoint* packet.
+A receiver which notices a gap in sequence numbers uses the journal of the
+next packet to repair its state, rather than leaving notes stuck on.
+
+`RecoveryJournal` keeps that state for a sender. Only state changed since
+the checkpoint is held; when the receiver acknowledges a sequence number
+(with an RS command), `acknowledge()` moves the checkpoint forward and
+forgets everything the receiver is known to have.
+
+`RecoveryState` is the receiving side: it follows the MIDI state of an
+incoming stream and, when packets go missing, uses the chapters parsed by
+`parse_channel_chapters()` to synthesize the commands that were lost.
+"""
+
+import logging
+import struct
+
+from construct import ConstructError, Container, StreamError
+
+from pymidi import packets
+
+logger = logging.getLogger('pymidi.journal')
+
+# Controllers which select the bank for Chapter P.
+CONTROLLER_BANK_MSB = 0
+CONTROLLER_BANK_LSB = 32
+
+# Chapter flags, in the table of contents octet of a channel journal.
+CHAPTER_P = 0x80
+CHAPTER_C = 0x40
+CHAPTER_M = 0x20
+CHAPTER_W = 0x10
+CHAPTER_N = 0x08
+CHAPTER_E = 0x04
+CHAPTER_T = 0x02
+CHAPTER_A = 0x01
+
+# Default limit on the size of an encoded journal, leaving room for MIDI
+# commands in a packet.
+DEFAULT_MAX_SIZE = 512
+
+_UINT16 = struct.Struct('>H')
+
+
+def seq_after(a, b):
+    """Returns True if 16-bit sequence number `a` comes after `b`."""
+    return a != b and ((a - b) & 0xFFFF) < 0x8000
+
+
+class _ChannelState(object):
+    """State of one MIDI channel changed since the checkpoint.
+
+    Each entry is tagged with the sequence number of the packet which last
+    changed it. Each chapter's encoding is cached in `chapters` until the
+    chapter next changes, so a new note re-encodes chapter N alone.
+    """
+
+    __slots__ = (
+        'channel',
+        'notes_on',
+        'notes_off',
+        'controllers',
+        'program',
+        'pitch_wheel',
+        'bank_msb',
+        'bank_lsb',
+        'chapters',
+        'encoded',
+    )
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.notes_on = {}  # note -> (velocity, seqnum)
+        self.notes_off = {}  # note -> seqnum
+        self.controllers = {}  # controller -> (value, seqnum)
+        self.program = None  # (program, bank_msb, bank_lsb, seqnum)
+        self.pitch_wheel = None  # (lsb, msb, seqnum)
+        self.bank_msb = None
+        self.bank_lsb = None
+        self.chapters = {}  # chapter flag -> encoded chapter
+        self.encoded = None
+
+    def __bool__(self):
+        return bool(
+            self.notes_on
+            or self.notes_off
+            or self.controllers
+            or self.program is not None
+            or self.pitch_wheel is not None
+        )
+
+    def _changed(self, chapter):
+        self.chapters.pop(chapter, None)
+        self.encoded = None
+
+    def record(self, seqnum, status, data1, data2):
+        """Applies a channel message sent in packet `seqnum`."""
+        command = status & 0xF0
+        if command == packets.COMMAND_NOTE_ON and data2:
+            self.notes_on[data1] = (data2, seqnum)
+            self.notes_off.pop(data1, None)
+            self._changed(CHAPTER_N)
+        elif command in (packets.COMMAND_NOTE_ON, packets.COMMAND_NOTE_OFF):
+            self.notes_on.pop(data1, None)
+            self.notes_off[data1] = seqnum
+            self._changed(CHAPTER_N)
+        elif command == packets.COMMAND_CONTROL_MODE_CHANGE:
+            self.controllers[data1] = (data2, seqnum)
+            if data1 == CONTROLLER_BANK_MSB:
+                self.bank_msb = data2
+            elif data1 == CONTROLLER_BANK_LSB:
+                self.bank_lsb = data2
+            self._changed(CHAPTER_C)
+        elif command == packets.COMMAND_PROGRAM_CHANGE:
+            self.program = (data1, self.bank_msb, self.bank_lsb, seqnum)
+            self._changed(CHAPTER_P)
+        elif command == packets.COMMAND_PITCH_BEND:
+            self.pitch_wheel = (data1, data2, seqnum)
+            self._changed(CHAPTER_W)
+
+    def seqnums(self):
+        """Yields the sequence number of every entry."""
+        for _, seqnum in self.notes_on.values():
+            yield seqnum
+        for seqnum in self.notes_off.values():
+            yield seqnum
+        for _, seqnum in self.controllers.values():
+            yield seqnum
+        if self.program is not None:
+            yield self.program[3]
+        if self.pitch_wheel is not None:
+            yield self.pitch_wheel[2]
+
+    def trim(self, seqnum):
+        """Forgets entries last changed in or before packet `seqnum`."""
+        for chapter, entries in ((CHAPTER_N, self.notes_on), (CHAPTER_C, self.controllers)):
+            for key in [k for k, v in entries.items() if not seq_after(v[1], seqnum)]:
+                del entries[key]
+                self._changed(chapter)
+        for key in [k for k, v in self.notes_off.items() if not seq_after(v, seqnum)]:
+            del self.notes_off[key]
+            self._changed(CHAPTER_N)
+        if self.program is not None and not seq_after(self.program[3], seqnum):
+            self.program = None
+            self._changed(CHAPTER_P)
+        if self.pitch_wheel is not None and not seq_after(self.pitch_wheel[2], seqnum):
+            self.pitch_wheel = None
+            self._changed(CHAPTER_W)
+
+    def encode(self):
+        """Returns the channel journal (RFC 6295 appendix A) for this state."""
+        if self.encoded is not None:
+            return self.encoded
+
+        toc = 0
+        out = bytearray(3)
+        for chapter, present, encoder in (
+            (CHAPTER_P, self.program is not None, self._encode_chapter_p),
+            (CHAPTER_C, self.controllers, self._encode_chapter_c),
+            (CHAPTER_W, self.pitch_wheel is not None, self._encode_chapter_w),
+            (CHAPTER_N, self.notes_on or self.notes_off, self._encode_chapter_n),
+        ):
+            if not present:
+                continue
+            encoded = self.chapters.get(chapter)
+            if encoded is None:
+                encoded = self.chapters[chapter] = encoder()
+            toc |= chapter
+            out += encoded
+
+        length = len(out)
+        out[0] = (self.channel << 3) | (length >> 8)
+        out[1] = length & 0xFF
+        out[2] = toc
+        self.encoded = bytes(out)
+        return self.encoded
+
+    def _encode_chapter_p(self):
+        program, bank_msb, bank_lsb, _ = self.program
+        if bank_msb is None and bank_lsb is None:
+            return bytes([program, 0, 0])
+        return bytes([program, 0x80 | (bank_msb or 0), bank_lsb or 0])
+
+    def _encode_chapter_c(self):
+        out = bytearray([len(self.controllers) - 1])
+        for controller in sorted(self.controllers):
+            out += bytes([controller, self.controllers[controller][0]])
+        return bytes(out)
+
+    def _encode_chapter_w(self):
+        return bytes([self.pitch_wheel[0], self.pitch_wheel[1]])
+
+    def _encode_chapter_n(self):
+        logs = bytearray()
+        for note in sorted(self.notes_on):
+            # Y=1: the note is recent enough to be worth playing on recovery.
+            logs += bytes([note, 0x80 | self.notes_on[note][0]])
+        count = len(self.notes_on)
+
+        if count == 128:
+            # With all 128 notes on there can be no note-offs; LOW=15 and
+            # HIGH=0 signals the 128-log encoding.
+            return bytes([127, 0xF0]) + logs
+
+        if self.notes_off:
+            low = min(self.notes_off) >> 3
+            high = max(self.notes_off) >> 3
+            offbits = bytearray(high - low + 1)
+            for note in self.notes_off:
+                offbits[(note >> 3) - low] |= 0x80 >> (note & 0x7)
+        else:
+            # LOW > HIGH: no OFFBITS octets.
+            low, high = 1, 0
+            offbits = b''
+        return bytes([count, (low << 4) | high]) + logs + offbits
+
+
+class RecoveryJournal(object):
+    """Recovery journal state for one outgoing RTP-MIDI stream.
+
+    Call `encode()` for the journal to send with the next packet, then
+    `record()` for each MIDI command in that packet. Chapters N (notes),
+    C (controllers), P (program change) and W (pitch wheel) are kept.
+
+    The encoded journal never exceeds `max_size` bytes: when it would, the
+    checkpoint is moved forward, dropping the oldest entries, as if the
+    receiver had acknowledged them. A receiver which lost those packets
+    can then only partly recover, but every packet still fits the MTU.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.channels = {}
+        self.checkpoint_seqnum = None
+        self._encoded = None
+
+        # Number of times the checkpoint was moved to keep within `max_size`.
+        self.overflows = 0
+
+    def __bool__(self):
+        return bool(self.channels)
+
+    def record(self, seqnum, status, data1, data2=0):
+        """Records a MIDI command sent in packet `seqnum`."""
+        if status >= 0xF0:
+            return
+        if self.checkpoint_seqnum is None:
+            self.checkpoint_seqnum = seqnum
+        channel = status & 0x0F
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = _ChannelState(channel)
+        state.record(seqnum, status, data1, data2)
+        if not state:
+            del self.channels[channel]
+        self._encoded = None
+
+    def record_events(self, seqnum, events):
+        """Records every `packets.MIDIEvent` sent in packet `seqnum`."""
+        for event in events:
+            if event.unknown is None:
+                self.record(seqnum, event.status, event.data1, event.data2)
+
+    def acknowledge(self, seqnum):
+        """Trims state the receiver has confirmed, up to packet `seqnum`."""
+        if self.checkpoint_seqnum is None or seq_after(self.checkpoint_seqnum, seqnum):
+            return
+        for channel, state in list(self.channels.items()):
+            state.trim(seqnum)
+            if not state:
+                del self.channels[channel]
+        self.checkpoint_seqnum = (seqnum + 1) & 0xFFFF if self.channels else None
+        self._encoded = None
+
+    def encode(self):
+        """Returns the journal to send with the next packet, or None if empty.
+
+        Only the chapters changed since the last call are re-encoded; the
+        rest are reused as they are.
+        """
+        if not self.channels:
+            return None
+        if self._encoded is not None:
+            return self._encoded
+        encoded = self._encode()
+        while len(encoded) > self.max_size:
+            self._drop_oldest()
+            if not self.channels:
+                return None
+            encoded = self._encode()
+        self._encoded = encoded
+        return encoded
+
+    def _encode(self):
+        out = bytearray(3)
+        out[0] = 0x20 | (len(self.channels) - 1)  # A=1, TOTCHAN
+        _UINT16.pack_into(out, 1, self.checkpoint_seqnum)
+        for channel in sorted(self.channels):
+            out += self.channels[channel].encode()
+        return bytes(out)
+
+    def _drop_oldest(self):
+        """Moves the checkpoint past the older half of the recorded packets."""
+        checkpoint = self.checkpoint_seqnum
+        offsets = sorted(
+            set(
+                (seqnum - checkpoint) & 0xFFFF
+                for state in self.channels.values()
+                for seqnum in state.seqnums()
+            )
+        )
+        self.overflows += 1
+        self.acknowledge((checkpoint + offsets[(len(offsets) - 1) // 2]) & 0xFFFF)
+
+
+# Journal parsing
+#
+# Chapter layouts are from RFC 6295 appendices A (channel chapters) and B
+# (system chapters). Every field is decoded, including the S bits; the
+# parsers are only used after a loss, so they favor clarity over speed.
+
+
+def _check_length(data, pos, count, chapter):
+    if pos + count > len(data):
+        raise StreamError('Truncated chapter {} at offset {}'.format(chapter, pos))
+
+
+def _parse_log_list(data, pos, chapter, names):
+    """Parses a chapter made of a `S LEN` header octet and LEN+1 2-octet logs.
+
+    This is the layout of chapters C, E and A; `names` gives the names of
+    the 7-bit fields and flag in each log.
+    """
+    _check_length(data, pos, 1, chapter)
+    count = (data[pos] & 0x7F) + 1
+    s = bool(data[pos] & 0x80)
+    pos += 1
+    _check_length(data, pos, 2 * count, chapter)
+    number_name, flag_name, value_name = names
+    logs = []
+    for i in range(pos, pos + 2 * count, 2):
+        log = Container(s=bool(data[i] & 0x80))
+        log[number_name] = data[i] & 0x7F
+        log[flag_name] = bool(data[i + 1] & 0x80)
+        log[value_name] = data[i + 1] & 0x7F
+        logs.append(log)
+    return Container(s=s, logs=logs), pos + 2 * count
+
+
+def _parse_chapter_m(data, pos):
+    _check_length(data, pos, 2, 'M')
+    (word,) = _UINT16.unpack_from(data, pos)
+    length = word & 0x3FF
+    _check_length(data, pos, length, 'M')
+    end = pos + length
+    chapter = Container(
+        s=bool(word & 0x8000),
+        p=bool(word & 0x4000),
+        e=bool(word & 0x2000),
+        u=bool(word & 0x1000),
+        w=bool(word & 0x0800),
+        z=bool(word & 0x0400),
+        length=length,
+        pending=None,
+        logs=[],
+    )
+    pos += 2
+    if chapter.p:
+        _check_length(data, pos, 1, 'M')
+        chapter.pending = Container(q=bool(data[pos] & 0x80), pending=data[pos] & 0x7F)
+        pos += 1
+
+    # With Z=1, logs omit the Q / PNUM-MSB octet.
+    fixed_size = 2 if chapter.z else 3
+    while pos < end:
+        if pos + fixed_size > end:
+            raise StreamError('Truncated chapter M log at offset {}'.format(pos))
+        log = Container(s=bool(data[pos] & 0x80), pnum_lsb=data[pos] & 0x7F)
+        pos += 1
+        if chapter.z:
+            log.q, log.pnum_msb = chapter.w, 0
+        else:
+            log.q, log.pnum_msb = bool(data[pos] & 0x80), data[pos] & 0x7F
+            pos += 1
+        toc = data[pos]
+        pos += 1
+        sizes = (
+            ('entry_msb', 0x80, 1),
+            ('entry_lsb', 0x40, 1),
+            ('a_button', 0x20, 2),
+            ('c_button', 0x10, 2),
+            ('count', 0x08, 1),
+        )
+        for name, flag, size in sizes:
+            if not toc & flag:
+                log[name] = None
+                continue
+            if pos + size > end:
+                raise StreamError('Truncated chapter M log at offset {}'.format(pos))
+            if size == 1:
+                log[name] = data[pos] & 0x7F
+            else:
+                (value,) = _UINT16.unpack_from(data, pos)
+                log[name] = Container(g=bool(value & 0x8000), value=value & 0x3FFF)
+            pos += size
+        chapter.logs.append(log)
+    return chapter, end
+
+
+def _parse_chapter_n(data, pos):
+    _check_length(data, pos, 2, 'N')
+    count = data[pos] & 0x7F
+    low = data[pos + 1] >> 4
+    high = data[pos + 1] & 0x0F
+    b = bool(data[pos] & 0x80)
+    if count == 127 and low == 15 and high == 0:
+        count = 128
+    pos += 2
+
+    _check_length(data, pos, 2 * count, 'N')
+    logs = []
+    for i in range(pos, pos + 2 * count, 2):
+        logs.append(
+            Container(
+                s=bool(data[i] & 0x80),
+                notenum=data[i] & 0x7F,
+                y=bool(data[i + 1] & 0x80),
+                velocity=data[i + 1] & 0x7F,
+            )
+        )
+    pos += 2 * count
+
+    # OFFBITS: one octet per 8 notes from LOW to HIGH, lowest note first.
+    note_offs = []
+    offbits = b''
+    if low <= high:
+        size = high - low + 1
+        _check_length(data, pos, size, 'N')
+        offbits = bytes(data[pos : pos + size])
+        for i, octet in enumerate(offbits):
+            for bit in range(8):
+                if octet & (0x80 >> bit):
+                    note_offs.append(8 * (low + i) + bit)
+        pos += size
+    chapter = Container(
+        b=b, len=count, low=low, high=high, logs=logs, offbits=offbits, note_offs=note_offs
+    )
+    return chapter, pos
+
+
+def parse_channel_chapters(journal):
+    """Parses the chapters of `journal`, a `MIDIChapterJournal`.
+
+    Returns a `Container` with an entry for each of chapters `p`, `c`, `m`,
+    `w`, `n`, `e`, `t` and `a`, or None where the chapter is absent. Raises
+    `StreamError` if the journal is truncated.
+    """
+    header = journal.header
+    data = journal.journal
+    chapters = Container(p=None, c=None, m=None, w=None, n=None, e=None, t=None, a=None)
+    pos = 0
+    if header.p:
+        _check_length(data, pos, 3, 'P')
+        chapters.p = Container(
+            s=bool(data[pos] & 0x80),
+            program=data[pos] & 0x7F,
+            b=bool(data[pos + 1] & 0x80),
+            bank_msb=data[pos + 1] & 0x7F,
+            x=bool(data[pos + 2] & 0x80),
+            bank_lsb=data[pos + 2] & 0x7F,
+        )
+        pos += 3
+    if header.c:
+        chapters.c, pos = _parse_log_list(data, pos, 'C', ('number', 'a', 'value'))
+    if header.m:
+        chapters.m, pos = _parse_chapter_m(data, pos)
+    if header.w:
+        _check_length(data, pos, 2, 'W')
+        chapters.w = Container(
+            s=bool(data[pos] & 0x80),
+            first=data[pos] & 0x7F,
+            r=bool(data[pos + 1] & 0x80),
+            second=data[pos + 1] & 0x7F,
+        )
+        pos += 2
+    if header.n:
+        chapters.n, pos = _parse_chapter_n(data, pos)
+    if header.e:
+        chapters.e, pos = _parse_log_list(data, pos, 'E', ('notenum', 'v', 'count_vel'))
+    if header.t:
+        _check_length(data, pos, 1, 'T')
+        chapters.t = Container(s=bool(data[pos] & 0x80), pressure=data[pos] & 0x7F)
+        pos += 1
+    if header.a:
+        chapters.a, pos = _parse_log_list(data, pos, 'A', ('notenum', 'x', 'pressure'))
+    return chapters
+
+
+def _parse_chapter_d(data, pos):
+    _check_length(data, pos, 1, 'D')
+    flags = data[pos]
+    chapter = Container(s=bool(flags & 0x80))
+    pos += 1
+    # Reset, tune request and song select logs are a single octet each.
+    for name, flag in (('reset', 0x40), ('tune_request', 0x20), ('song_select', 0x10)):
+        if flags & flag:
+            _check_length(data, pos, 1, 'D')
+            chapter[name] = Container(s=bool(data[pos] & 0x80), value=data[pos] & 0x7F)
+            pos += 1
+        else:
+            chapter[name] = None
+    # Undefined commands; their logs start with a LENGTH covering the whole
+    # log. Kept as raw bytes.
+    for name, flag in (('undefined_f4', 0x08), ('undefined_f5', 0x04)):
+        if flags & flag:
+            _check_length(data, pos, 2, 'D')
+            length = max(_UINT16.unpack_from(data, pos)[0] & 0x3FF, 2)
+            _check_length(data, pos, length, 'D')
+            chapter[name] = bytes(data[pos : pos + length])
+            pos += length
+        else:
+            chapter[name] = None
+    for name, flag in (('undefined_f9', 0x02), ('undefined_fd', 0x01)):
+        if flags & flag:
+            _check_length(data, pos, 1, 'D')
+            length = max(data[pos] & 0x1F, 1)
+            _check_length(data, pos, length, 'D')
+            chapter[name] = bytes(data[pos : pos + length])
+            pos += length
+        else:
+            chapter[name] = None
+    return chapter, pos
+
+
+def parse_system_chapters(journal):
+    """Parses the chapters of `journal`, a `MIDISystemJournal`.
+
+    Returns a `Container` with an entry for each of chapters `d`, `v`, `q`,
+    `f` and `x`, or None where the chapter is absent. Variable-length logs
+    of undefined commands, and the contents of chapter X (System Exclusive),
+    are returned as bytes.
+    """
+    header = journal.header
+    data = journal.journal
+    chapters = Container(d=None, v=None, q=None, f=None, x=None)
+    pos = 0
+    if header.d:
+        chapters.d, pos = _parse_chapter_d(data, pos)
+    if header.v:
+        _check_length(data, pos, 1, 'V')
+        chapters.v = Container(s=bool(data[pos] & 0x80), count=data[pos] & 0x7F)
+        pos += 1
+    if header.q:
+        _check_length(data, pos, 1, 'Q')
+        flags = data[pos]
+        chapter = Container(
+            s=bool(flags & 0x80),
+            n=bool(flags & 0x40),
+            d=bool(flags & 0x20),
+            c=bool(flags & 0x10),
+            t=bool(flags & 0x08),
+            top=flags & 0x07,
+            clock=None,
+            timetools=None,
+        )
+        pos += 1
+        if chapter.c:
+            _check_length(data, pos, 2, 'Q')
+            chapter.clock = (chapter.top << 16) | _UINT16.unpack_from(data, pos)[0]
+            pos += 2
+        if chapter.t:
+            _check_length(data, pos, 3, 'Q')
+            chapter.timetools = int.from_bytes(data[pos : pos + 3], 'big')
+            pos += 3
+        chapters.q = chapter
+    if header.f:
+        _check_length(data, pos, 1, 'F')
+        flags = data[pos]
+        chapter = Container(
+            s=bool(flags & 0x80),
+            c=bool(flags & 0x40),
+            p=bool(flags & 0x20),
+            q=bool(flags & 0x10),
+            d=bool(flags & 0x08),
+            point=flags & 0x07,
+            complete=None,
+            partial=None,
+        )
+        pos += 1
+        for name in ('complete', 'partial'):
+            if chapter[name[0]]:
+                _check_length(data, pos, 4, 'F')
+                chapter[name] = int.from_bytes(data[pos : pos + 4], 'big')
+                pos += 4
+        chapters.f = chapter
+    if header.x:
+        _check_length(data, pos, 1, 'X')
+        flags = data[pos]
+        chapters.x = Container(
+            s=bool(flags & 0x80),
+            t=bool(flags & 0x40),
+            c=bool(flags & 0x20),
+            f=bool(flags & 0x10),
+            d=bool(flags & 0x08),
+            l=bool(flags & 0x04),
+            sta=flags & 0x03,
+            data=bytes(data[pos + 1 :]),
+        )
+    return chapters
+
+
+# Loss repair
+
+
+class _ReceivedChannel(object):
+    """The last known MIDI state of one channel of an incoming stream."""
+
+    __slots__ = ('notes', 'controllers', 'program', 'pitch_wheel', 'pressure', 'poly_pressure')
+
+    def __init__(self):
+        self.notes = {}  # note -> velocity
+        self.controllers = {}
+        self.program = None
+        self.pitch_wheel = None  # (lsb, msb)
+        self.pressure = None
+        self.poly_pressure = {}
+
+    def apply(self, status, data1, data2):
+        command = status & 0xF0
+        if command == packets.COMMAND_NOTE_ON and data2:
+            self.notes[data1] = data2
+        elif command in (packets.COMMAND_NOTE_ON, packets.COMMAND_NOTE_OFF):
+            self.notes.pop(data1, None)
+        elif command == packets.COMMAND_AFTERTOUCH:
+            self.poly_pressure[data1] = data2
+        elif command == packets.COMMAND_CONTROL_MODE_CHANGE:
+            self.controllers[data1] = data2
+        elif command == packets.COMMAND_PROGRAM_CHANGE:
+            self.program = data1
+        elif command == packets.COMMAND_CHANNEL_PRESSURE:
+            self.pressure = data1
+        elif command == packets.COMMAND_PITCH_BEND:
+            self.pitch_wheel = (data1, data2)
+
+    def repair(self, channel, chapters):
+        """Returns the `RepairEvent`s which bring this state in line with
+        `chapters`, and applies them.
+        """
+        events = []
+
+        def emit(command, data1, data2=0):
+            events.append(packets.RepairEvent(command | channel, data1, data2))
+            self.apply(command | channel, data1, data2)
+
+        cc = packets.COMMAND_CONTROL_MODE_CHANGE
+        p = chapters.p
+        if p is not None:
+            if p.b:
+                if self.controllers.get(CONTROLLER_BANK_MSB) != p.bank_msb:
+                    emit(cc, CONTROLLER_BANK_MSB, p.bank_msb)
+                if self.controllers.get(CONTROLLER_BANK_LSB) != p.bank_lsb:
+                    emit(cc, CONTROLLER_BANK_LSB, p.bank_lsb)
+            if self.program != p.program:
+                emit(packets.COMMAND_PROGRAM_CHANGE, p.program)
+
+        if chapters.c is not None:
+            for log in chapters.c.logs:
+                # Logs using the toggle and count tools (A=1), and channel
+                # mode messages, record history rather than a value to
+                # restore; they are not replayed.
+                if log.a or log.number >= 120:
+                    continue
+                if self.controllers.get(log.number) != log.value:
+                    emit(cc, log.number, log.value)
+
+        w = chapters.w
+        if w is not None and self.pitch_wheel != (w.first, w.second):
+            emit(packets.COMMAND_PITCH_BEND, w.first, w.second)
+
+        n = chapters.n
+        if n is not None:
+            for note in n.note_offs:
+                if note in self.notes:
+                    emit(packets.COMMAND_NOTE_OFF, note, 0)
+            for log in n.logs:
+                # Y=0 marks notes too old to be worth starting late.
+                if log.y and log.velocity and log.notenum not in self.notes:
+                    emit(packets.COMMAND_NOTE_ON, log.notenum, log.velocity)
+
+        t = chapters.t
+        if t is not None and self.pressure != t.pressure:
+            emit(packets.COMMAND_CHANNEL_PRESSURE, t.pressure)
+
+        if chapters.a is not None:
+            for log in chapters.a.logs:
+                if self.poly_pressure.get(log.notenum) != log.pressure:
+                    emit(packets.COMMAND_AFTERTOUCH, log.notenum, log.pressure)
+
+        return events
+
+
+class RecoveryState(object):
+    """Follows the MIDI state of an incoming stream, and repairs it after loss.
+
+    Pass each decoded packet to `process()`, in arrival order. When the
+    sequence number reveals lost packets, the packet's recovery journal is
+    compared with the state seen so far, and the commands needed to catch up
+    are returned as `packets.RepairEvent`s. Chapters P, C, W, N, T and A are
+    repaired; the rest are parsed but have no state to restore here.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.last_seqnum = None
+
+        # Counters.
+        self.lost = 0
+        self.late = 0
+        self.repaired = 0
+
+    def process(self, packet):
+        """Updates state from `packet`, a decoded `MIDIPacket`.
+
+        Returns the list of `RepairEvent`s to deliver ahead of the packet's
+        own commands; empty unless packets were lost. Duplicate and late
+        packets (older than one already seen) are counted in `late`, but
+        trigger no repair; their commands are still applied, since the
+        caller still delivers them.
+        """
+        seqnum = packet.header.rtp_header.sequence_number
+        repairs = []
+        if self.last_seqnum is None:
+            self.last_seqnum = seqnum
+        elif not seq_after(seqnum, self.last_seqnum):
+            self.late += 1
+        else:
+            lost = (seqnum - self.last_seqnum - 1) & 0xFFFF
+            if lost:
+                self.lost += lost
+                repairs = self._repair(packet.journal, seqnum, lost)
+            self.last_seqnum = seqnum
+
+        for event in packet.command.midi_list:
+            if event.unknown is None and event.status < 0xF0:
+                self._channel(event.status & 0x0F).apply(event.status, event.data1, event.data2)
+        return repairs
+
+    def _channel(self, channel):
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = _ReceivedChannel()
+        return state
+
+    def _repair(self, journal, seqnum, lost):
+        if journal is None:
+            logger.warning('Lost {} packet(s) before {}, with no journal'.format(lost, seqnum))
+            return []
+        first_lost = (self.last_seqnum + 1) & 0xFFFF
+        if seq_after(journal.checkpoint_seqnum, first_lost):
+            logger.warning(
+                'Journal checkpoint {} is after lost packet {}; repair may be incomplete'.format(
+                    journal.checkpoint_seqnum, first_lost
+                )
+            )
+
+        repairs = []
+        try:
+            for channel_journal in journal.channel_journals or ():
+                chapters = parse_channel_chapters(channel_journal)
+                channel = channel_journal.header.chan
+                repairs.extend(self._channel(channel).repair(channel, chapters))
+        except ConstructError:
+            logger.exception('Malformed recovery journal, not repairing')
+        self.repaired += len(repairs)
+        return repairs
@@ -0,0 +1,308 @@
+"""Counters, gauges and latency histograms.
+
+A `Registry` holds named metrics, each with a set of label names; values
+are kept per combination of label values. It can be exported as a dict
+(`snapshot()`) or in the Prometheus text format (`to_prometheus()`).
+
+Metrics are built to stay on in production: recording is a dict update, or
+for a `Histogram` a few integer operations, and takes no lock. Updates from
+threads other than the serving one may, rarely, be lost.
+
+`Histogram` buckets values HDR-style: exactly below `2 ** (precision + 1)`,
+and above that in `2 ** precision` linear steps per power of two, for a
+relative error under `2 ** -precision`, in constant memory.
+"""
+
+import collections
+import time
+
+# Histograms keep this many bits of each value; see `Histogram`.
+DEFAULT_PRECISION = 5
+
+# Upper bounds, in seconds, of the buckets of exported latency histograms.
+PROMETHEUS_BUCKETS = (
+    1e-6,
+    2.5e-6,
+    5e-6,
+    10e-6,
+    25e-6,
+    50e-6,
+    100e-6,
+    250e-6,
+    500e-6,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    10e-3,
+    25e-3,
+    50e-3,
+    100e-3,
+    250e-3,
+    500e-3,
+    1.0,
+)
+
+# Percentiles given for histograms in `Registry.snapshot()`.
+SNAPSHOT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def now_ns():
+    """Returns the time, in nanoseconds, on the clock histograms are timed by."""
+    return time.perf_counter_ns()
+
+
+def _label_value(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii', 'backslashreplace')
+    return str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [(name, _label_value(value)) for name, value in zip(names, values)]
+    pairs.extend(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(
+        ','.join(
+            '{}="{}"'.format(
+                name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            )
+            for name, value in pairs
+        )
+    )
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+    def items(self):
+        """Returns a list of `(label values, value)`."""
+        raise NotImplementedError
+
+    def snapshot(self):
+        return {','.join(_label_value(v) for v in labels): value for labels, value in self.items()}
+
+    def prometheus_lines(self):
+        for labels, value in self.items():
+            yield '{}{} {}'.format(self.name, _format_labels(self.label_names, labels), value)
+
+
+class Counter(Metric):
+    """A count which only goes up."""
+
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self.values = collections.defaultdict(int)
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] += amount
+
+    def get(self, labels=()):
+        return self.values.get(labels, 0)
+
+    def items(self):
+        return sorted(self.values.items(), key=lambda item: tuple(map(_label_value, item[0])))
+
+
+class Gauge(Metric):
+    """A value read, when exported, from callbacks.
+
+    Several callbacks may be added for the same labels; their values are
+    summed.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super(Gauge, self).__init__(*args, **kwargs)
+        self.callbacks = collections.defaultdict(list)
+
+    def add_callback(self, fn, labels=()):
+        self.callbacks[labels].append(fn)
+
+    def remove_callback(self, fn, labels=()):
+        self.callbacks[labels].remove(fn)
+
+    def get(self, labels=()):
+        return sum(fn() for fn in self.callbacks.get(labels, ()))
+
+    def items(self):
+        return [(labels, self.get(labels)) for labels in sorted(self.callbacks)]
+
+
+class Histogram(object):
+    """Counts of non-negative integer values, such as durations in nanoseconds."""
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self._sub_buckets = 1 << precision
+        self.counts = collections.defaultdict(int)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision - 1
+        if shift <= 0:
+            return value
+        return shift * self._sub_buckets + (value >> shift)
+
+    def _upper_bound(self, index):
+        """Returns the largest value counted in bucket `index`."""
+        if index < 2 * self._sub_buckets:
+            return index
+        shift = index // self._sub_buckets - 1
+        top = index - shift * self._sub_buckets
+        return ((top + 1) << shift) - 1
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percent):
+        """Returns the value below which `percent` of values fall, or None if empty."""
+        if not self.count:
+            return None
+        target = max(1, percent / 100.0 * self.count)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def cumulative_counts(self, bounds):
+        """Returns, for each of ascending `bounds`, the number of values at most it."""
+        result = []
+        items = sorted((self._upper_bound(i), c) for i, c in self.counts.items())
+        seen = pos = 0
+        for bound in bounds:
+            while pos < len(items) and items[pos][0] <= bound:
+                seen += items[pos][1]
+                pos += 1
+            result.append(seen)
+        return result
+
+
+class LatencyHistogram(Metric):
+    """A `Histogram` of durations per set of labels, recorded in nanoseconds."""
+
+    type = 'histogram'
+
+    def __init__(self, *args, **kwargs):
+        self.precision = kwargs.pop('precision', DEFAULT_PRECISION)
+        super(LatencyHistogram, self).__init__(*args, **kwargs)
+        self.histograms = {}
+
+    def histogram(self, labels=()):
+        histogram = self.histograms.get(labels)
+        if histogram is None:
+            histogram = self.histograms[labels] = Histogram(self.precision)
+        return histogram
+
+    def record(self, nanoseconds, labels=()):
+        self.histogram(labels).record(nanoseconds)
+
+    def items(self):
+        return sorted(self.histograms.items())
+
+    def snapshot(self):
+        result = {}
+        for labels, histogram in self.items():
+            summary = dict(
+                count=histogram.count,
+                sum=histogram.sum / 1e9,
+                min=histogram.min / 1e9 if histogram.count else None,
+                max=histogram.max / 1e9 if histogram.count else None,
+            )
+            for percent in SNAPSHOT_PERCENTILES:
+                value = histogram.percentile(percent)
+                summary['p{:g}'.format(percent)] = value / 1e9 if value is not None else None
+            result[','.join(_label_value(v) for v in labels)] = summary
+        return result
+
+    def prometheus_lines(self):
+        bounds_ns = [int(bound * 1e9) for bound in PROMETHEUS_BUCKETS]
+        for labels, histogram in self.items():
+            counts = histogram.cumulative_counts(bounds_ns)
+            for bound, count in zip(PROMETHEUS_BUCKETS, counts):
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(self.label_names, labels, [('le', '{:g}'.format(bound))]),
+                    count,
+                )
+            label_str = _format_labels(self.label_names, labels)
+            yield '{}_bucket{} {}'.format(
+                self.name,
+                _format_labels(self.label_names, labels, [('le', '+Inf')]),
+                histogram.count,
+            )
+            yield '{}_sum{} {}'.format(self.name, label_str, histogram.sum / 1e9)
+            yield '{}_count{} {}'.format(self.name, label_str, histogram.count)
+
+
+class Registry(object):
+    """A set of metrics, by name.
+
+    `counter()`, `gauge()` and `histogram()` return the metric with the given
+    name, creating it on first use.
+    """
+
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+
+    def _get(self, cls, name, help, label_names, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, help, label_names, **kwargs)
+        elif not isinstance(metric, cls) or metric.label_names != tuple(label_names):
+            raise ValueError('Metric {} already registered differently'.format(name))
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        return self._get(Counter, name, help, label_names)
+
+    def gauge(self, name, help, label_names=()):
+        return self._get(Gauge, name, help, label_names)
+
+    def histogram(self, name, help, label_names=(), precision=DEFAULT_PRECISION):
+        return self._get(LatencyHistogram, name, help, label_names, precision=precision)
+
+    def snapshot(self):
+        """Returns every metric's values, as a dict by name, then by comma-separated labels.
+
+        Histograms give their count, sum, min, max and percentiles, in seconds.
+        """
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def to_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            lines.extend(metric.prometheus_lines())
+        return '\n'.join(lines) + '\n'
@@ -1,15 +1,83 @@
 from construct import Struct as BaseStruct
 from construct import Const, CString, Padding, Int8ub, Int16ub, Int32ub
 from construct import Int64ub, Bitwise, BitStruct, BitsInteger, Nibble, Flag, Optional, Bytes
-from construct import If, IfThenElse, GreedyBytes, GreedyRange, VarInt, FixedSized, Byte, Computed
-from construct import Switch, Enum, Peek
+from construct import If, IfThenElse, GreedyRange, FixedSized, Byte, Computed
+from construct import Switch, Enum, Peek, Array
+from construct import Container, ListContainer, EnumInteger, EnumIntegerString, StreamError
+from construct import ConstructError
 from construct import this as _this
+from construct.core import Construct, IntegerError, stream_read, stream_write
+import struct
 
 
 COMMAND_NOTE_OFF = 0x80
 COMMAND_NOTE_ON = 0x90
 COMMAND_AFTERTOUCH = 0xA0
 COMMAND_CONTROL_MODE_CHANGE = 0xB0
+COMMAND_PROGRAM_CHANGE = 0xC0
+COMMAND_CHANNEL_PRESSURE = 0xD0
+COMMAND_PITCH_BEND = 0xE0
+
+COMMAND_SYSEX = 0xF0
+COMMAND_TIME_CODE = 0xF1
+COMMAND_SONG_POSITION = 0xF2
+COMMAND_SONG_SELECT = 0xF3
+COMMAND_TUNE_REQUEST = 0xF6
+COMMAND_SYSEX_END = 0xF7
+COMMAND_TIMING_CLOCK = 0xF8
+COMMAND_START = 0xFA
+COMMAND_CONTINUE = 0xFB
+COMMAND_STOP = 0xFC
+COMMAND_ACTIVE_SENSING = 0xFE
+COMMAND_RESET = 0xFF
+
+# Ends a system exclusive segment which is cancelled (RFC 6295 section 3.2).
+SYSEX_CANCEL = 0xF4
+
+# Number of data bytes following each channel message status.
+CHANNEL_DATA_LENGTHS = {
+    COMMAND_NOTE_OFF: 2,
+    COMMAND_NOTE_ON: 2,
+    COMMAND_AFTERTOUCH: 2,
+    COMMAND_CONTROL_MODE_CHANGE: 2,
+    COMMAND_PROGRAM_CHANGE: 1,
+    COMMAND_CHANNEL_PRESSURE: 1,
+    COMMAND_PITCH_BEND: 2,
+}
+
+# Number of data bytes following each system message status. System
+# exclusive (`None`) runs up to and including its end byte: 0xF7, or, in a
+# segmented command (RFC 6295 section 3.2), 0xF0 or 0xF4. A segment after the
+# first begins with 0xF7.
+SYSTEM_DATA_LENGTHS = {
+    COMMAND_SYSEX: None,
+    COMMAND_TIME_CODE: 1,
+    COMMAND_SONG_POSITION: 2,
+    COMMAND_SONG_SELECT: 1,
+    0xF4: 0,
+    0xF5: 0,
+    COMMAND_TUNE_REQUEST: 0,
+    COMMAND_SYSEX_END: None,
+}
+SYSTEM_DATA_LENGTHS.update((status, 0) for status in range(0xF8, 0x100))
+
+SYSEX_END_BYTES = (COMMAND_SYSEX, COMMAND_SYSEX_END, SYSEX_CANCEL)
+
+# Largest MIDI list length, using the long (B=1) command section header.
+MAX_MIDI_LIST_SIZE = 0xFFF
+
+# Largest value encodable in a 4-octet delta time.
+MAX_DELTA_TIME = 0x0FFFFFFF
+
+# RTP timestamps are in units of 100 microseconds.
+RTP_TIMESTAMP_RATE = 10000
+
+
+def data_length(status):
+    """Returns the number of data bytes after `status`, or None for system exclusive."""
+    if status < 0xF0:
+        return CHANNEL_DATA_LENGTHS[status & 0xF0]
+    return SYSTEM_DATA_LENGTHS[status]
 
 
 def to_string(pkt):
@@ -24,6 +92,8 @@ def to_string(pkt):
     elif name == 'MIDIPacket':
         items = []
         for entry in pkt.command.midi_list:
+            for status in getattr(entry, 'realtime', None) or ():
+                items.append(MIDIEvent(status).command)
             command = entry.command
             if command in ('note_on', 'note_off'):
                 items.append('{} {} {}'.format(command, entry.params.key, entry.params.velocity))
@@ -39,11 +109,119 @@ def to_string(pkt):
 
 
 def remember_last(obj, ctx):
-    """Stores the last-seen command byte in the parsing context.
+    """Stores the running status in the parsing context.
 
-    Bit of a hack to make running status support work.
+    Bit of a hack to make running status support work. Channel messages set
+    the running status, system common messages clear it, and real-time
+    messages leave it be.
     """
-    setattr(ctx._root, '_last_command_byte', obj)
+    if obj < 0xF0:
+        setattr(ctx._root, '_last_command_byte', obj)
+    elif obj < 0xF8:
+        setattr(ctx._root, '_last_command_byte', None)
+
+
+def _command_value(status):
+    """Returns the command of `status`: the high nibble for channel messages."""
+    return status & 0xF0 if status < 0xF0 else status
+
+
+def _running_status(ctx):
+    status = getattr(ctx._root, '_last_command_byte', None)
+    if status is None:
+        raise ConstructError('Data byte without running status')
+    return status
+
+
+def _set_aside_realtime(ctx, status):
+    """Stores a real-time command found among another command's data bytes."""
+    pending = getattr(ctx._root, '_realtime', None)
+    if pending is None:
+        pending = ctx._root._realtime = ListContainer()
+    pending.append(status)
+
+
+def _take_realtime(ctx):
+    pending = getattr(ctx._root, '_realtime', None)
+    ctx._root._realtime = None
+    return pending
+
+
+def encode_delta_time(value):
+    """Encodes an RFC 6295 delta time: 1-4 octets, most significant first."""
+    if not 0 <= value <= MAX_DELTA_TIME:
+        raise ValueError('Delta time {} out of range'.format(value))
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(out)
+
+
+class MIDIDeltaTime(Construct):
+    """An RFC 6295 delta time.
+
+    Like a MIDI file delta time (and unlike construct's `VarInt`), the most
+    significant 7-bit group comes first.
+    """
+
+    def _parse(self, stream, context, path):
+        value = 0
+        for _ in range(4):
+            b = stream_read(stream, 1, path)[0]
+            value = (value << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return value
+        raise IntegerError('Delta time longer than 4 octets', path=path)
+
+    def _build(self, obj, stream, context, path):
+        data = encode_delta_time(obj)
+        stream_write(stream, data, len(data), path)
+        return obj
+
+
+class MIDIDataByte(Construct):
+    """A MIDI data byte (0-127).
+
+    Real-time commands may appear anywhere, even among another command's
+    data bytes; any found first are set aside for the command's `realtime`
+    field. Any other status byte is an error.
+    """
+
+    def _parse(self, stream, context, path):
+        while True:
+            b = stream_read(stream, 1, path)[0]
+            if b < 0x80:
+                return b
+            elif b < 0xF8:
+                raise ConstructError('Unexpected status byte 0x{:02x}'.format(b), path=path)
+            _set_aside_realtime(context, b)
+
+    def _build(self, obj, stream, context, path):
+        stream_write(stream, bytes([obj]), 1, path)
+        return obj
+
+
+class MIDISysExData(Construct):
+    """System exclusive data, up to and including its end byte (see `SYSEX_END_BYTES`)."""
+
+    def _parse(self, stream, context, path):
+        data = bytearray()
+        while True:
+            b = stream_read(stream, 1, path)[0]
+            if b >= 0xF8:
+                _set_aside_realtime(context, b)
+                continue
+            elif b & 0x80 and b not in SYSEX_END_BYTES:
+                raise ConstructError('Unexpected status byte 0x{:02x}'.format(b), path=path)
+            data.append(b)
+            if b & 0x80:
+                return bytes(data)
+
+    def _build(self, obj, stream, context, path):
+        stream_write(stream, obj, len(obj), path)
+        return obj
 
 
 class Struct(BaseStruct):
@@ -75,6 +253,15 @@ AppleMIDITimestampPacket = Struct(
     'timestamp_3' / Int64ub,
 )
 
+AppleMIDIReceiverFeedbackPacket = Struct(
+    '_name' / Computed('AppleMIDIReceiverFeedbackPacket'),
+    'preamble' / Const(b'\xff\xff'),
+    'command' / Bytes(2),
+    'ssrc' / Int32ub,
+    'sequence_number' / Int16ub,
+    'padding' / Padding(2),
+)
+
 MIDIPacketHeaderFlags = Bitwise(
     Struct(
         'v' / BitsInteger(2),  # always 0x2
@@ -230,6 +417,32 @@ MIDINote = Enum(
     G9=127,
 )
 
+# A `MIDINote` in a MIDI list.
+_MIDIKey = Enum(MIDIDataByte(), **MIDINote.encmapping)
+
+# Names of MIDI commands, by `_command_value()`.
+_MIDI_COMMANDS = {
+    'note_on': COMMAND_NOTE_ON,
+    'note_off': COMMAND_NOTE_OFF,
+    'aftertouch': COMMAND_AFTERTOUCH,
+    'control_mode_change': COMMAND_CONTROL_MODE_CHANGE,
+    'program_change': COMMAND_PROGRAM_CHANGE,
+    'channel_pressure': COMMAND_CHANNEL_PRESSURE,
+    'pitch_bend': COMMAND_PITCH_BEND,
+    'sysex': COMMAND_SYSEX,
+    'time_code': COMMAND_TIME_CODE,
+    'song_position': COMMAND_SONG_POSITION,
+    'song_select': COMMAND_SONG_SELECT,
+    'tune_request': COMMAND_TUNE_REQUEST,
+    'sysex_continue': COMMAND_SYSEX_END,
+    'timing_clock': COMMAND_TIMING_CLOCK,
+    'start': COMMAND_START,
+    'continue': COMMAND_CONTINUE,
+    'stop': COMMAND_STOP,
+    'active_sensing': COMMAND_ACTIVE_SENSING,
+    'reset': COMMAND_RESET,
+}
+
 MIDIPacketCommand = Struct(
     '_name' / Computed('MIDIPacketCommand'),
     'flags'
@@ -246,58 +459,78 @@ MIDIPacketCommand = Struct(
         _this.flags.len,
         GreedyRange(
             Struct(
-                'delta_time' / If(_this._index > 0, VarInt),
+                'delta_time' / If(_this._index > 0, MIDIDeltaTime()),
                 # The "running status" technique means multiple commands may be sent under
                 # the same status. This condition occurs when, after parsing the current
                 # commands, we see the next byte is NOT a status byte (MSB is low).
                 #
-                # Below, this is accomplished by storing the most recent status byte
-                # on the global context with the `* remember_last` macro; then using it
-                # on the `else` branch of the `command_byte` selection.
+                # Below, this is accomplished by storing the most recent channel status
+                # byte on the global context with the `* remember_last` macro; then using
+                # it on the `else` branch of the `command_byte` selection.
                 '__next' / Peek(Int8ub),
                 'command_byte'
                 / IfThenElse(
                     _this.__next & 0x80,
                     Byte * remember_last,
-                    Computed(lambda ctx: ctx._root._last_command_byte),
+                    Computed(_running_status),
                 ),
                 'command'
-                / If(
-                    _this.command_byte,
-                    Enum(
-                        Computed(_this.command_byte & 0xF0),
-                        note_on=COMMAND_NOTE_ON,
-                        note_off=COMMAND_NOTE_OFF,
-                        aftertouch=COMMAND_AFTERTOUCH,
-                        control_mode_change=COMMAND_CONTROL_MODE_CHANGE,
-                    ),
-                ),
-                'channel' / If(_this.command_byte, Computed(_this.command_byte & 0x0F)),
+                / Enum(Computed(lambda ctx: _command_value(ctx.command_byte)), **_MIDI_COMMANDS),
+                'channel' / If(_this.command_byte < 0xF0, Computed(_this.command_byte & 0x0F)),
                 'params'
                 / Switch(
                     _this.command,
                     {
                         'note_on': Struct(
-                            'key' / MIDINote,
-                            'velocity' / Int8ub,
+                            'key' / _MIDIKey,
+                            'velocity' / MIDIDataByte(),
                         ),
                         'note_off': Struct(
-                            'key' / MIDINote,
-                            'velocity' / Int8ub,
+                            'key' / _MIDIKey,
+                            'velocity' / MIDIDataByte(),
                         ),
                         'aftertouch': Struct(
-                            'key' / MIDINote,
-                            'touch' / Int8ub,
+                            'key' / _MIDIKey,
+                            'touch' / MIDIDataByte(),
                         ),
                         'control_mode_change': Struct(
-                            'controller' / Int8ub,
-                            'value' / Int8ub,
+                            'controller' / MIDIDataByte(),
+                            'value' / MIDIDataByte(),
+                        ),
+                        'program_change': Struct(
+                            'program' / MIDIDataByte(),
+                        ),
+                        'channel_pressure': Struct(
+                            'pressure' / MIDIDataByte(),
+                        ),
+                        'pitch_bend': Struct(
+                            '_lsb' / MIDIDataByte(),
+                            '_msb' / MIDIDataByte(),
+                            'value' / Computed(lambda ctx: ctx._lsb | (ctx._msb << 7)),
+                        ),
+                        'sysex': Struct(
+                            'data' / MIDISysExData(),
+                        ),
+                        'sysex_continue': Struct(
+                            'data' / MIDISysExData(),
+                        ),
+                        'time_code': Struct(
+                            'value' / MIDIDataByte(),
+                        ),
+                        'song_position': Struct(
+                            '_lsb' / MIDIDataByte(),
+                            '_msb' / MIDIDataByte(),
+                            'value' / Computed(lambda ctx: ctx._lsb | (ctx._msb << 7)),
+                        ),
+                        'song_select': Struct(
+                            'song' / MIDIDataByte(),
                         ),
                     },
-                    default=Struct(
-                        'unknown' / GreedyBytes,
-                    ),
+                    # Every other command has no data bytes.
+                    default=Struct(),
                 ),
+                # Real-time commands found among the data bytes, which came first.
+                'realtime' / Computed(_take_realtime),
             ),
         ),
     ),
@@ -353,8 +586,11 @@ MIDIPacketJournal = Struct(
         'totchan' / BitsInteger(4),
     ),
     'checkpoint_seqnum' / Int16ub,
-    'system_journal' / If(_this.header.s, MIDISystemJournal),
-    'channel_journal' / If(_this.header.a, MIDIChapterJournal),
+    'system_journal' / If(_this.header.y, MIDISystemJournal),
+    'channel_journals' / If(_this.header.a, Array(_this.header.totchan + 1, MIDIChapterJournal)),
+    # The first channel journal, for compatibility.
+    'channel_journal'
+    / Computed(lambda ctx: ctx.channel_journals[0] if ctx.channel_journals else None),
 )
 
 MIDIPacket = Struct(
@@ -363,3 +599,526 @@ MIDIPacket = Struct(
     'command' / MIDIPacketCommand,
     'journal' / If(_this.command.flags.j, MIDIPacketJournal),
 )
+
+
+# Fast-path decoding
+#
+# `decode_midi_packet()` is a hand-written equivalent of `MIDIPacket.parse()`.
+# The construct schemas above remain the reference definition of the wire
+# format; the decoder below must produce the same logical result for every
+# input (see `pymidi/tests/decoder_test.py`), including the quirks of the
+# schema. The only difference is that MIDI commands are returned as
+# `MIDIEvent` objects rather than `Container`s.
+
+_RTP_HEADER = struct.Struct('>BBHII')
+_UINT16 = struct.Struct('>H')
+
+_MIDI_NOTE_NAMES = MIDINote.decmapping
+
+_MIDI_COMMAND_NAMES = {
+    value: EnumIntegerString.new(value, name) for name, value in _MIDI_COMMANDS.items()
+}
+
+
+def _midi_note(value):
+    name = _MIDI_NOTE_NAMES.get(value)
+    return name if name is not None else EnumInteger(value)
+
+
+class MIDIEvent(object):
+    """A single decoded MIDI command.
+
+    A compact replacement for the construct `Container` produced by
+    `MIDIPacketCommand`. The `command`, `channel`, `command_byte` and `params`
+    attributes give the same view as the construct schema; `params` is built
+    on access, so code reading `status`, `data1` and `data2` directly pays for
+    no extra allocations.
+
+    Messages with data bytes keep them in `data1` and `data2` (0 if unused),
+    except for system exclusive, whose data, up to and including its end
+    byte, is in `unknown`.
+    """
+
+    __slots__ = ('status', 'data1', 'data2', 'delta_time', 'unknown')
+
+    # True for commands synthesized from a recovery journal; see `RepairEvent`.
+    repair = False
+
+    def __init__(self, status, data1=0, data2=0, delta_time=None, unknown=None):
+        self.status = status
+        self.data1 = data1
+        self.data2 = data2
+        self.delta_time = delta_time
+        self.unknown = unknown
+
+    @property
+    def command_byte(self):
+        return self.status
+
+    @property
+    def channel(self):
+        return self.status & 0x0F if self.status < 0xF0 else None
+
+    @property
+    def command(self):
+        value = _command_value(self.status)
+        command = _MIDI_COMMAND_NAMES.get(value)
+        return command if command is not None else EnumInteger(value)
+
+    @property
+    def params(self):
+        command = _command_value(self.status)
+        if command in (COMMAND_NOTE_ON, COMMAND_NOTE_OFF):
+            return Container(key=_midi_note(self.data1), velocity=self.data2)
+        elif command == COMMAND_AFTERTOUCH:
+            return Container(key=_midi_note(self.data1), touch=self.data2)
+        elif command == COMMAND_CONTROL_MODE_CHANGE:
+            return Container(controller=self.data1, value=self.data2)
+        elif command == COMMAND_PROGRAM_CHANGE:
+            return Container(program=self.data1)
+        elif command == COMMAND_CHANNEL_PRESSURE:
+            return Container(pressure=self.data1)
+        elif command in (COMMAND_PITCH_BEND, COMMAND_SONG_POSITION):
+            return Container(value=self.data1 | (self.data2 << 7))
+        elif command in (COMMAND_SYSEX, COMMAND_SYSEX_END):
+            return Container(data=self.unknown)
+        elif command == COMMAND_TIME_CODE:
+            return Container(value=self.data1)
+        elif command == COMMAND_SONG_SELECT:
+            return Container(song=self.data1)
+        return Container()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __eq__(self, other):
+        if not isinstance(other, MIDIEvent):
+            return NotImplemented
+        return (self.status, self.data1, self.data2, self.delta_time, self.unknown) == (
+            other.status,
+            other.data1,
+            other.data2,
+            other.delta_time,
+            other.unknown,
+        )
+
+    def __repr__(self):
+        return '{}(status=0x{:02x}, data1={}, data2={}, delta_time={}, unknown={})'.format(
+            type(self).__name__, self.status, self.data1, self.data2, self.delta_time, self.unknown
+        )
+
+
+class RepairEvent(MIDIEvent):
+    """A MIDI command synthesized from a recovery journal, after packet loss.
+
+    Sent by `DataProtocol` ahead of the commands of the packet whose journal
+    it came from, to bring the receiver's state back in line with the sender.
+    """
+
+    __slots__ = ()
+
+    repair = True
+
+
+def _decode_midi_list(data, pos, end):
+    """Decodes the MIDI list in `data[pos:end]` into `MIDIEvent`s.
+
+    Mirrors the `GreedyRange` in `MIDIPacketCommand`: decoding stops silently
+    at the first command which can't be fully read. Real-time commands found
+    among another command's data bytes are returned before it, with its delta
+    time; it then gets a delta time of 0.
+    """
+    midi_list = []
+    running_status = None
+    index = 0
+    while pos < end:
+        if index > 0:
+            # Delta time; see `MIDIDeltaTime`.
+            delta_time = 0
+            for _ in range(4):
+                if pos >= end:
+                    return midi_list
+                b = data[pos]
+                pos += 1
+                delta_time = (delta_time << 7) | (b & 0x7F)
+                if not b & 0x80:
+                    break
+            else:
+                return midi_list
+            if pos >= end:
+                return midi_list
+        else:
+            delta_time = None
+
+        status = data[pos]
+        if status & 0x80:
+            pos += 1
+            if status < 0xF0:
+                running_status = status
+            elif status < 0xF8:
+                running_status = None
+        elif running_status is None:
+            return midi_list
+        else:
+            status = running_status
+
+        if status < 0xF0:
+            length = CHANNEL_DATA_LENGTHS[status & 0xF0]
+        else:
+            length = SYSTEM_DATA_LENGTHS[status]
+        if length == 2 and pos + 2 <= end and not (data[pos] | data[pos + 1]) & 0x80:
+            midi_list.append(MIDIEvent(status, data[pos], data[pos + 1], delta_time))
+            pos += 2
+        elif length == 0:
+            midi_list.append(MIDIEvent(status, delta_time=delta_time))
+        else:
+            result = _read_data_bytes(data, pos, end, length)
+            if result is None:
+                return midi_list
+            values, realtime, pos = result
+            for realtime_status in realtime:
+                midi_list.append(MIDIEvent(realtime_status, delta_time=delta_time))
+                delta_time = 0
+            if length is None:
+                event = MIDIEvent(status, delta_time=delta_time, unknown=values)
+            else:
+                event = MIDIEvent(status, values[0], values[1] if length > 1 else 0, delta_time)
+            midi_list.append(event)
+        index += 1
+    return midi_list
+
+
+def _read_data_bytes(data, pos, end, length):
+    """Reads the data bytes of a command; see `MIDIDataByte` and `MIDISysExData`.
+
+    Reads `length` data bytes or, if None, system exclusive data. Returns a
+    tuple of `(values, realtime, pos)`, where `realtime` lists the real-time
+    commands found among them, or None if the command is incomplete.
+    """
+    values = bytearray()
+    realtime = []
+    while length is None or len(values) < length:
+        if pos >= end:
+            return None
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            values.append(b)
+        elif b >= 0xF8:
+            realtime.append(b)
+        elif length is None and b in SYSEX_END_BYTES:
+            values.append(b)
+            break
+        else:
+            return None
+    return bytes(values), realtime, pos
+
+
+def _read_bytes(data, pos, length):
+    if length < 0:
+        raise StreamError('length must be non-negative, found {}'.format(length))
+    if pos + length > len(data):
+        raise StreamError(
+            'stream read less than specified amount, expected {}, found {}'.format(
+                length, max(len(data) - pos, 0)
+            )
+        )
+    return bytes(data[pos : pos + length]), pos + length
+
+
+def _decode_journal(data, pos):
+    if pos + 3 > len(data):
+        raise StreamError('Truncated journal header at offset {}'.format(pos))
+    b = data[pos]
+    header = Container(
+        s=bool(b & 0x80),
+        y=bool(b & 0x40),
+        a=bool(b & 0x20),
+        h=bool(b & 0x10),
+        totchan=b & 0x0F,
+    )
+    (checkpoint_seqnum,) = _UINT16.unpack_from(data, pos + 1)
+    pos += 3
+
+    system_journal = None
+    if header.y:
+        if pos + 2 > len(data):
+            raise StreamError('Truncated system journal at offset {}'.format(pos))
+        (word,) = _UINT16.unpack_from(data, pos)
+        length = word & 0x3FF
+        journal, pos = _read_bytes(data, pos + 2, length - 2)
+        system_journal = Container(
+            _name='MIDISystemJournal',
+            header=Container(
+                s=bool(word & 0x8000),
+                d=bool(word & 0x4000),
+                v=bool(word & 0x2000),
+                q=bool(word & 0x1000),
+                f=bool(word & 0x0800),
+                x=bool(word & 0x0400),
+                length=length,
+            ),
+            journal=journal,
+        )
+
+    channel_journals = None
+    if header.a:
+        channel_journals = ListContainer()
+        for _ in range(header.totchan + 1):
+            if pos + 3 > len(data):
+                raise StreamError('Truncated channel journal at offset {}'.format(pos))
+            (word,) = _UINT16.unpack_from(data, pos)
+            toc = data[pos + 2]
+            length = word & 0x3FF
+            journal, pos = _read_bytes(data, pos + 3, length - 3)
+            channel_journals.append(
+                Container(
+                    _name='MIDIChapterJournal',
+                    header=Container(
+                        s=bool(word & 0x8000),
+                        chan=(word >> 11) & 0x0F,
+                        h=bool(word & 0x0400),
+                        length=length,
+                        p=bool(toc & 0x80),
+                        c=bool(toc & 0x40),
+                        m=bool(toc & 0x20),
+                        w=bool(toc & 0x10),
+                        n=bool(toc & 0x08),
+                        e=bool(toc & 0x04),
+                        t=bool(toc & 0x02),
+                        a=bool(toc & 0x01),
+                    ),
+                    journal=journal,
+                )
+            )
+
+    return Container(
+        _name='MIDIPacketJournal',
+        header=header,
+        checkpoint_seqnum=checkpoint_seqnum,
+        system_journal=system_journal,
+        channel_journals=channel_journals,
+        channel_journal=channel_journals[0] if channel_journals else None,
+    )
+
+
+def decode_midi_packet(data):
+    """Decodes an RTP-MIDI packet; a fast equivalent of `MIDIPacket.parse()`.
+
+    Entries of `command.midi_list` are `MIDIEvent` instances. Accepts
+    `bytes`, `bytearray` or `memoryview`. Raises a `ConstructError` subclass
+    on malformed input, like the construct schema would.
+    """
+    if len(data) < _RTP_HEADER.size + 1:
+        raise StreamError('Truncated MIDI packet ({} bytes)'.format(len(data)))
+    b0, b1, sequence_number, timestamp, ssrc = _RTP_HEADER.unpack_from(data, 0)
+    header = Container(
+        _name='MIDIPacketHeader',
+        rtp_header=Container(
+            flags=Container(
+                v=b0 >> 6,
+                p=bool(b0 & 0x20),
+                x=bool(b0 & 0x10),
+                cc=b0 & 0x0F,
+                m=bool(b1 & 0x80),
+                pt=b1 & 0x7F,
+            ),
+            sequence_number=sequence_number,
+        ),
+        timestamp=timestamp,
+        ssrc=ssrc,
+    )
+
+    pos = _RTP_HEADER.size
+    b = data[pos]
+    length = b & 0x0F
+    pos += 1
+    if b & 0x80:
+        if pos >= len(data):
+            raise StreamError('Truncated MIDI command section header')
+        length = (length << 8) | data[pos]
+        pos += 1
+    flags = Container(
+        b=bool(b & 0x80),
+        j=bool(b & 0x40),
+        z=bool(b & 0x20),
+        p=bool(b & 0x10),
+        len=length,
+    )
+    end = pos + length
+    if end > len(data):
+        raise StreamError(
+            'MIDI list length {} exceeds packet size {}'.format(length, len(data) - pos)
+        )
+    command = Container(
+        _name='MIDIPacketCommand',
+        flags=flags,
+        midi_list=_decode_midi_list(data, pos, end),
+    )
+
+    journal = _decode_journal(data, end) if flags.j else None
+
+    return Container(_name='MIDIPacket', header=header, command=command, journal=journal)
+
+
+# Fast-path encoding
+
+# Version 2, no padding/extension/CSRCs; marker bit set, payload type 0x61.
+_RTP_HEADER_FLAGS = (0x80, 0xE1)
+_RTP_SEQUENCE_AND_TIMESTAMP = struct.Struct('>HI')
+
+
+def pack_rtp_header(buf, offset, sequence_number, timestamp, ssrc):
+    """Writes an RTP-MIDI packet header into `buf` at `offset`."""
+    _RTP_HEADER.pack_into(
+        buf, offset, *_RTP_HEADER_FLAGS, sequence_number & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc
+    )
+
+
+def event_from_bytes(data):
+    """Returns a `MIDIEvent` for `data`, the bytes of one complete MIDI message."""
+    if not data or data[0] < 0x80:
+        raise ValueError('MIDI message must begin with a status byte')
+    status = data[0]
+    length = data_length(status)
+    if length is None:
+        return MIDIEvent(status, unknown=bytes(data[1:]))
+    elif len(data) != 1 + length:
+        raise ValueError('Expected {} data bytes after 0x{:02x}'.format(length, status))
+    return MIDIEvent(status, data[1] if length > 0 else 0, data[2] if length > 1 else 0)
+
+
+def note_number(note):
+    """Returns the MIDI note number for `note`, a name like `'C3'` or an int."""
+    if isinstance(note, int):
+        return note
+    return MIDINote.encmapping[note]
+
+
+class MIDIPacketWriter(object):
+    """Encodes outgoing RTP-MIDI packets into a reusable buffer.
+
+    The RTP header is written once, at construction; each `write_*()` call
+    patches the sequence number and timestamp in place, writes the command
+    section after it, and returns a `memoryview` of the finished packet. The
+    view is only valid until the next call.
+
+    The command section begins with a short (1 byte) header when the MIDI
+    list is at most 15 bytes, and a long (2 byte, B=1) header otherwise.
+    """
+
+    HEADER_SIZE = _RTP_HEADER.size
+
+    def __init__(self, ssrc, max_size=1024):
+        self.ssrc = ssrc
+        self.buffer = bytearray(max_size)
+        self.view = memoryview(self.buffer)
+        _RTP_HEADER.pack_into(self.buffer, 0, *_RTP_HEADER_FLAGS, 0, 0, ssrc)
+        self._short_view = self.view[: self.HEADER_SIZE + 3]
+        self._long_view = self.view[: self.HEADER_SIZE + 4]
+
+    def write_command(self, sequence_number, timestamp, status, data1, data2=None, journal=None):
+        """Writes a packet holding a single MIDI command.
+
+        `data2` should be `None` for one-byte commands, such as program change.
+        If `journal` is given (see `pymidi.journal`), it is appended to the
+        packet and the J flag set.
+        """
+        buf = self.buffer
+        _RTP_SEQUENCE_AND_TIMESTAMP.pack_into(
+            buf, 2, sequence_number & 0xFFFF, timestamp & 0xFFFFFFFF
+        )
+        pos = self.HEADER_SIZE
+        buf[pos + 1] = status
+        buf[pos + 2] = data1
+        if data2 is None:
+            buf[pos] = 2
+            view = self._short_view
+        else:
+            buf[pos] = 3
+            buf[pos + 3] = data2
+            view = self._long_view
+        if journal:
+            return self._append_journal(len(view), journal)
+        return view
+
+    def _append_journal(self, end, journal):
+        if end + len(journal) > len(self.buffer):
+            raise ValueError('Journal too large for packet ({} bytes)'.format(len(journal)))
+        self.buffer[self.HEADER_SIZE] |= 0x40
+        self.buffer[end : end + len(journal)] = journal
+        return self.view[: end + len(journal)]
+
+    def write_events(self, sequence_number, timestamp, events, start=0, journal=None):
+        """Writes a packet holding as many of `events[start:]` as will fit.
+
+        `events` is a sequence of `MIDIEvent`s; the `delta_time` of each event
+        after the first in the packet is encoded before it, and consecutive
+        channel messages with the same status use running status.
+
+        Returns a tuple of `(packet, count)`, where `count` is the number of
+        events written. As with `write_command()`, `journal` is appended if
+        given; room is left for it.
+        """
+        buf = self.buffer
+        _RTP_SEQUENCE_AND_TIMESTAMP.pack_into(
+            buf, 2, sequence_number & 0xFFFF, timestamp & 0xFFFFFFFF
+        )
+        list_start = pos = self.HEADER_SIZE + 2
+        limit = min(len(buf) - len(journal or b''), list_start + MAX_MIDI_LIST_SIZE)
+        last_status = None
+        index = start
+        while index < len(events):
+            event = events[index]
+            status = event.status
+            unknown = event.unknown
+            if unknown is not None:
+                length = len(unknown)
+            else:
+                length = data_length(status) or 0
+
+            if index > start:
+                delta_time = encode_delta_time(event.delta_time or 0)
+            else:
+                delta_time = b''
+            running = status == last_status
+            size = len(delta_time) + (0 if running else 1) + length
+            if pos + size > limit:
+                if index == start:
+                    raise ValueError('MIDI event too large for packet: {!r}'.format(event))
+                break
+
+            if delta_time:
+                buf[pos : pos + len(delta_time)] = delta_time
+                pos += len(delta_time)
+            if not running:
+                buf[pos] = status
+                pos += 1
+            if unknown is not None:
+                buf[pos : pos + length] = unknown
+            elif length == 2:
+                buf[pos] = event.data1
+                buf[pos + 1] = event.data2
+            elif length == 1:
+                buf[pos] = event.data1
+            pos += length
+
+            # Only channel messages use running status; to keep receivers
+            # simple, any system message is followed by a full status byte.
+            last_status = status if status < 0xF0 else None
+            index += 1
+
+        length = pos - list_start
+        if length > 15:
+            buf[list_start - 2] = 0x80 | (length >> 8)
+            buf[list_start - 1] = length & 0xFF
+        else:
+            buf[list_start - 2] = length
+            buf[list_start - 1 : pos - 1] = buf[list_start:pos]
+            pos -= 1
+        if journal:
+            return self._append_journal(pos, journal), index - start
+        return self.view[:pos], index - start
@@ -1,78 +1,355 @@
 import logging
 import random
+import socket
+import struct
+import threading
 import time
 
+from pymidi import clock
 from pymidi import packets
+from pymidi import sysex
+from pymidi import trace
+from pymidi.clock import ClockEstimator
+from pymidi.jitter import JitterBuffer
+from pymidi import metrics
+from pymidi.journal import RecoveryJournal, RecoveryState
+from pymidi.sender import BatchSender
 from pymidi.utils import b2h
 from construct import ConstructError
 
 # Command messages are preceded with this sequence.
 APPLEMIDI_PREAMBLE = b'\xff\xff'
 
+# The `command` label of RTP-MIDI data packets in metrics.
+MIDI_COMMAND_LABEL = 'midi'
+
 # Two-byte RTP-MIDI control commands
 APPLEMIDI_COMMAND_INVITATION = b'IN'
 APPLEMIDI_COMMAND_INVITATION_ACCEPTED = b'OK'
 APPLEMIDI_COMMAND_INVITATION_REJECTED = b'NO'
 APPLEMIDI_COMMAND_TIMESTAMP_SYNC = b'CK'
 APPLEMIDI_COMMAND_EXIT = b'BY'
+APPLEMIDI_COMMAND_RECEIVER_FEEDBACK = b'RS'
+
+# Offset of the sender's SSRC within each kind of command message.
+COMMAND_SSRC_OFFSETS = {
+    APPLEMIDI_COMMAND_INVITATION: 12,
+    APPLEMIDI_COMMAND_INVITATION_ACCEPTED: 12,
+    APPLEMIDI_COMMAND_INVITATION_REJECTED: 12,
+    APPLEMIDI_COMMAND_EXIT: 12,
+    APPLEMIDI_COMMAND_TIMESTAMP_SYNC: 4,
+    APPLEMIDI_COMMAND_RECEIVER_FEEDBACK: 4,
+}
+
+# Default minimum interval, in seconds, between receiver feedback messages
+# sent to any one peer.
+DEFAULT_FEEDBACK_INTERVAL = 1.0
+
+# Statuses which begin system exclusive messages or segments of them.
+_SYSEX_STATUSES = (packets.COMMAND_SYSEX, packets.COMMAND_SYSEX_END)
+
+# Offset of the sender's SSRC within an RTP-MIDI data message.
+RTP_SSRC_OFFSET = 8
+
+_UINT32 = struct.Struct('>I')
+
+
+def packet_ssrc(data):
+    """Returns the sender SSRC of a command or data message, or None.
+
+    Reads the SSRC from its fixed offset, without parsing the message.
+    """
+    if data[0:2] == APPLEMIDI_PREAMBLE:
+        offset = COMMAND_SSRC_OFFSETS.get(bytes(data[2:4]))
+    else:
+        offset = RTP_SSRC_OFFSET
+    if offset is None or len(data) < offset + 4:
+        return None
+    return _UINT32.unpack_from(data, offset)[0]
+
+
+class CommandSender(object):
+    """Provides `send_*()` methods for single MIDI commands.
+
+    Subclasses implement `send_commands(events, timestamp=None)` and
+    `_send_rtp_command(status, data1, data2=None)`.
+    """
+
+    def send_note_on(self, notestr, velocity=80, channel=1):
+        self._send_note(notestr, packets.COMMAND_NOTE_ON, velocity, channel)
 
+    def send_note_off(self, notestr, velocity=80, channel=1):
+        self._send_note(notestr, packets.COMMAND_NOTE_OFF, velocity, channel)
 
-class Peer(object):
-    """Holds state about a midi peer."""
+    def send_aftertouch(self, notestr, touch, channel=1):
+        self._send_note(notestr, packets.COMMAND_AFTERTOUCH, touch, channel)
+
+    def send_control_change(self, controller, value, channel=1):
+        self._send_rtp_command(
+            packets.COMMAND_CONTROL_MODE_CHANGE | (channel & 0xF), controller, value
+        )
+
+    def send_program_change(self, program, channel=1):
+        self._send_rtp_command(packets.COMMAND_PROGRAM_CHANGE | (channel & 0xF), program)
+
+    def send_pitch_bend(self, value, channel=1):
+        """Sends a pitch bend; `value` is 14 bits, with 0x2000 meaning centered."""
+        self._send_rtp_command(
+            packets.COMMAND_PITCH_BEND | (channel & 0xF), value & 0x7F, (value >> 7) & 0x7F
+        )
+
+    def send_raw(self, data):
+        """Sends `data`, the bytes of one complete MIDI message."""
+        self.send_commands([packets.event_from_bytes(data)])
+
+    def send_sysex(self, data, segment_size=sysex.DEFAULT_SEGMENT_SIZE):
+        """Sends system exclusive message `data` (`F0 ... F7`), of any length.
+
+        Messages longer than `segment_size` bytes are split into RFC 6295
+        segments, one per packet; see `pymidi.sysex.segment()`.
+        """
+        for event in sysex.segment(data, segment_size):
+            self.send_commands([event])
+
+    def _send_note(self, notestr, command, velocity=80, channel=1):
+        key = packets.note_number(notestr)
+        self._send_rtp_command(command | (channel & 0xF), key, velocity)
+
+
+class Peer(CommandSender):
+    """Holds state about a midi peer.
+
+    Once connected, MIDI may be sent to the peer with the `send_*()`
+    methods, over the data socket of the session it opened.
+    """
 
     def __init__(self, name, addr, ssrc):
         self.name = name
         self.addr = addr
         self.ssrc = ssrc
 
+        # The `DataProtocol` of the session, through which `send_*()` send.
+        self.protocol = None
+
+        # Set by `DataProtocol` when repairing packet loss; a `RecoveryState`.
+        self.recovery = None
+
+        # Estimates the peer's clock from CK exchanges; a `ClockEstimator`.
+        self.clock = ClockEstimator()
+        # The `time.monotonic()` time to next begin a CK exchange, if we do.
+        self.next_clock_sync = None
+
+        # Set by `DataProtocol` when given a playout delay; a `JitterBuffer`.
+        self.jitter = None
+
+        # Set by `DataProtocol` when reassembling segmented system exclusive
+        # messages; a `SysExAssembler`.
+        self.sysex = None
+
+        # The `RecoveryJournal` of commands sent to this peer, if any;
+        # trimmed when the peer sends receiver feedback.
+        self.journal = None
+
+        # The sequence number and `time.monotonic()` time of the last receiver
+        # feedback sent to this peer.
+        self.feedback_seqnum = None
+        self.feedback_time = None
+
+        # RTP sequence number of the last data packet sent to this peer.
+        self.sequence_number = random.randint(0, 2 ** 16 - 1)
+
     def __str__(self):
         return '{} (ssrc={}, addr={})'.format(self.name, self.ssrc, self.addr)
 
+    def __getstate__(self):
+        # The protocol, and its socket, stay behind when a peer is pickled.
+        state = self.__dict__.copy()
+        state['protocol'] = None
+        return state
+
+    def next_sequence_number(self):
+        self.sequence_number = (self.sequence_number + 1) & 0xFFFF
+        return self.sequence_number
+
+    def send_commands(self, events, timestamp=None):
+        """Sends a list of `packets.MIDIEvent`s; see `DataProtocol.send_commands()`."""
+        if self.protocol is None:
+            raise ProtocolError('No data session with {}'.format(self))
+        self.protocol.send_commands(self, events, timestamp)
+
+    def _send_rtp_command(self, status, data1, data2=None):
+        self.send_commands([packets.MIDIEvent(status, data1, data2 or 0)])
+
 
 class ProtocolError(Exception):
     pass
 
 
 class BaseProtocol(object):
-    def __init__(self, socket, name='pymidi', ssrc=None, connect_cb=None, disconnect_cb=None):
+    # The `protocol` label of this protocol's metrics.
+    kind = 'base'
+
+    def __init__(
+        self,
+        socket,
+        name='pymidi',
+        ssrc=None,
+        connect_cb=None,
+        disconnect_cb=None,
+        metrics_registry=None,
+        trace_ring=None,
+    ):
+        """Creates a new protocol.
+
+        Counts of datagrams received, sent and dropped, the number of
+        connected peers, and timings are kept in `metrics_registry`, a
+        `pymidi.metrics.Registry`, which may be shared; by default, each
+        protocol has its own, as `self.metrics`.
+
+        Every datagram received and sent is also recorded in `trace_ring`,
+        a `pymidi.trace.TraceRing`, likewise `self.trace` and by default
+        the protocol's own.
+        """
         self.socket = socket
         self.name = name
         self.peers_by_ssrc = {}
+        self._ssrcs_by_addr = {}
         self.ssrc = ssrc or random.randint(0, 2 ** 32 - 1)
         self.connect_cb = connect_cb
         self.disconnect_cb = disconnect_cb
         self.logger = logging.getLogger('pymidi.{}'.format(self.__class__.__name__))
+        self._init_metrics(metrics_registry or metrics.Registry())
+        self.trace = trace_ring if trace_ring is not None else trace.TraceRing()
+        # A `pymidi.capture.PcapWriter` while capturing; see `start_capture()`.
+        self.capture = None
+        self._capture_addr = None
+
+    def _init_metrics(self, registry):
+        self.metrics = registry
+        self._metric_labels = (self.kind,)
+        labels = ('protocol', 'command')
+        self._rx_packets = registry.counter(
+            'pymidi_rx_packets_total', 'Datagrams received, by AppleMIDI command.', labels
+        )
+        self._rx_bytes = registry.counter(
+            'pymidi_rx_bytes_total', 'Bytes received, by AppleMIDI command.', labels
+        )
+        self._tx_packets = registry.counter(
+            'pymidi_tx_packets_total', 'Datagrams sent, by AppleMIDI command.', labels
+        )
+        self._tx_bytes = registry.counter(
+            'pymidi_tx_bytes_total', 'Bytes sent, by AppleMIDI command.', labels
+        )
+        self._dropped = registry.counter(
+            'pymidi_dropped_packets_total', 'Datagrams ignored, by reason.', ('protocol', 'reason')
+        )
+        self._peers_gauge = registry.gauge('pymidi_peers', 'Connected peers.', ('protocol',))
+        self._count_peers = lambda: len(self.peers_by_ssrc)
+        self._peers_gauge.add_callback(self._count_peers, self._metric_labels)
+        self._decode_time = registry.histogram(
+            'pymidi_decode_seconds', 'Time to decode each MIDI packet.', ('protocol',)
+        ).histogram(self._metric_labels)
+        self._callback_time = registry.histogram(
+            'pymidi_callback_seconds', 'Time spent delivering each MIDI packet.', ('protocol',)
+        ).histogram(self._metric_labels)
+
+    def _drop(self, reason):
+        self._dropped.inc((self.kind, reason))
 
     def _connect_peer(self, name, addr, ssrc):
         peer = Peer(name=name, addr=addr, ssrc=ssrc)
         self.peers_by_ssrc[ssrc] = peer
+        self._ssrcs_by_addr[addr] = ssrc
         if self.connect_cb:
             self.connect_cb(peer)
         return peer
 
     def _disconnect_peer(self, ssrc):
         peer = self.peers_by_ssrc.pop(ssrc, None)
+        if peer and self._ssrcs_by_addr.get(peer.addr) == ssrc:
+            del self._ssrcs_by_addr[peer.addr]
         if peer and self.disconnect_cb:
             self.disconnect_cb(peer)
         return peer
 
+    def on_timer(self, now):
+        """Called periodically by the server, with the `time.monotonic()` time.
+
+        Also called once `next_deadline()` has passed.
+        """
+        pass
+
+    def next_deadline(self):
+        """Returns the `time.monotonic()` time `on_timer()` is next needed, or None."""
+        return None
+
+    def start_capture(self, writer):
+        """Writes every datagram received and sent to `writer`, a `pymidi.capture.PcapWriter`."""
+        if isinstance(self.socket, socket.socket):
+            self._capture_addr = self.socket.getsockname()[:2]
+        else:
+            # Such as an asyncio transport.
+            self._capture_addr = self.socket.get_extra_info('sockname')[:2]
+        self.capture = writer
+
+    def stop_capture(self):
+        self.capture = None
+
+    def close(self):
+        """Stops any capture, and stops counting peers in the shared metrics.
+
+        The socket is left open, for its owner to close.
+        """
+        self.stop_capture()
+        if self._count_peers is not None:
+            self._peers_gauge.remove_callback(self._count_peers, self._metric_labels)
+            self._count_peers = None
+
     def sendto(self, message, addr):
         if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug('tx: {}'.format(b2h(message)))
+        self._count_tx(message)
+        self.trace.record(trace.DIRECTION_TX, self._ssrcs_by_addr.get(addr, 0), message)
+        if self.capture is not None:
+            self.capture.write(self._capture_addr, addr, message)
         self.socket.sendto(message, addr)
 
+    def _count_tx(self, message):
+        if message[0:2] == APPLEMIDI_PREAMBLE:
+            command = bytes(message[2:4])
+        else:
+            command = MIDI_COMMAND_LABEL
+        labels = (self.kind, command)
+        self._tx_packets.inc(labels)
+        self._tx_bytes.inc(labels, len(message))
+
     def handle_message(self, data, addr):
+        """Handles an incoming datagram.
+
+        `data` may be `bytes` or a `memoryview`; command messages are copied
+        to `bytes` before parsing, and data messages are decoded in place.
+        """
         if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug('rx: {}'.format(b2h(data)))
+            self.logger.debug('rx: {}'.format(b2h(bytes(data))))
+        self.trace.record(trace.DIRECTION_RX, packet_ssrc(data) or 0, data)
+        if self.capture is not None:
+            self.capture.write(addr, self._capture_addr, data)
 
         try:
             if data[0:2] == APPLEMIDI_PREAMBLE:
+                data = bytes(data)
                 command = data[2:4]
-                self.logger.debug('Command: {}'.format(b2h(command)))
+                labels = (self.kind, command)
+                self._rx_packets.inc(labels)
+                self._rx_bytes.inc(labels, len(data))
                 self.handle_command_message(command, data, addr)
             else:
+                labels = (self.kind, MIDI_COMMAND_LABEL)
+                self._rx_packets.inc(labels)
+                self._rx_bytes.inc(labels, len(data))
                 self.handle_data_message(data, addr)
         except ConstructError:
+            self._drop('malformed')
             self.logger.exception('Bug or malformed packet, ignoring')
 
     def handle_data_message(self, data, addr):
@@ -83,6 +360,7 @@ class BaseProtocol(object):
             packet = packets.AppleMIDIExchangePacket.parse(data)
             ssrc = packet.ssrc
             if ssrc in self.peers_by_ssrc:
+                self._drop('duplicate_connection')
                 self.logger.warning('Ignoring duplicate connection from ssrc {}'.format(ssrc))
                 return
             peer = self._connect_peer(name=packet.name, addr=addr, ssrc=ssrc)
@@ -101,15 +379,32 @@ class BaseProtocol(object):
             packet = packets.AppleMIDIExchangePacket.parse(data)
             ssrc = packet.ssrc
             if ssrc not in self.peers_by_ssrc:
+                self._drop('unknown_ssrc')
                 self.logger.warning('Ignoring exit from unknown ssrc {}'.format(ssrc))
                 return
             peer = self._disconnect_peer(ssrc)
             self.logger.info('Peer {} exited'.format(peer))
+        elif command == APPLEMIDI_COMMAND_RECEIVER_FEEDBACK:
+            self.handle_receiver_feedback(data, addr)
         else:
+            self._drop('unknown_command')
             self.logger.warning('Ignoring unrecognized command: {}'.format(command))
 
+    def handle_receiver_feedback(self, data, addr):
+        """Trims the journal of commands sent to the peer, up to the one it has."""
+        packet = packets.AppleMIDIReceiverFeedbackPacket.parse(data)
+        peer = self.peers_by_ssrc.get(packet.ssrc)
+        if not peer:
+            self._drop('unknown_ssrc')
+            self.logger.debug('Ignoring feedback from unknown ssrc={}'.format(packet.ssrc))
+            return
+        if peer.journal is not None:
+            peer.journal.acknowledge(packet.sequence_number)
+
 
 class ControlProtocol(BaseProtocol):
+    kind = 'control'
+
     def __init__(self, data_protocol=None, *args, **kwargs):
         super(ControlProtocol, self).__init__(*args, **kwargs)
         self.data_protocol = data_protocol
@@ -117,6 +412,11 @@ class ControlProtocol(BaseProtocol):
     def associate_data_protocol(self, data_protocol):
         self.data_protocol = data_protocol
 
+    def _connect_peer(self, name, addr, ssrc):
+        peer = super(ControlProtocol, self)._connect_peer(name, addr, ssrc)
+        peer.protocol = self.data_protocol
+        return peer
+
     def _disconnect_peer(self, ssrc):
         """Disconnect from data protocol when disconnecting locally."""
         peer = super(ControlProtocol, self)._disconnect_peer(ssrc)
@@ -124,11 +424,224 @@ class ControlProtocol(BaseProtocol):
             self.data_protocol._disconnect_peer(ssrc)
         return peer
 
+    def handle_receiver_feedback(self, data, addr):
+        """Journals are kept by the data protocol, so feedback is passed to it."""
+        if self.data_protocol:
+            self.data_protocol.handle_receiver_feedback(data, addr)
+
 
 class DataProtocol(BaseProtocol):
+    kind = 'data'
+
     def __init__(self, *args, **kwargs):
+        """Creates a new DataProtocol.
+
+        Unless `recover_lost_packets` is False, each peer's sequence numbers
+        are followed and, after a loss, commands synthesized from the
+        recovery journal are delivered as `packets.RepairEvent`s ahead of
+        the packet's own.
+
+        Each peer is also sent receiver feedback, acknowledging the last
+        sequence number received, at most once per `feedback_interval`
+        seconds; see `send_feedback()`. This lets the peer trim its journal,
+        and so requires `recover_lost_packets`.
+
+        If `playout_delay` is given, each peer's packets are held in a
+        `pymidi.jitter.JitterBuffer` for that many seconds past their RTP
+        timestamp, and delivered in sequence order from `on_timer()`;
+        duplicates and packets arriving too late are dropped. Otherwise
+        packets are delivered as they arrive.
+
+        Unless `reassemble_sysex` is False, system exclusive messages sent in
+        segments are put back together, and delivered whole once complete,
+        as a single `MIDIEvent` whose `unknown` is a `memoryview`; see
+        `pymidi.sysex.SysExAssembler`, which `sysex_max_size` and
+        `sysex_timeout` are passed to. A message is dropped if a packet is
+        lost while it is received.
+
+        MIDI may be sent to peers with `send_commands()`, or the `send_*()`
+        methods of `Peer`. Unless `recovery_journal` is False, each peer is
+        sent a recovery journal, kept in `peer.journal`.
+
+        Clock synchronization (CK) exchanges begun by peers are answered,
+        and update `peer.clock`. With `sync_interval`, an exchange with each
+        peer is also begun every `sync_interval` seconds, from `on_timer()`.
+        """
         self.midi_command_cb = kwargs.pop('midi_command_cb', None)
+        self.recover_lost_packets = kwargs.pop('recover_lost_packets', True)
+        self.feedback_interval = kwargs.pop('feedback_interval', DEFAULT_FEEDBACK_INTERVAL)
+        self.playout_delay = kwargs.pop('playout_delay', None)
+        self.sync_interval = kwargs.pop('sync_interval', None)
+        self.recovery_journal = kwargs.pop('recovery_journal', True)
+        self.reassemble_sysex = kwargs.pop('reassemble_sysex', True)
+        self.sysex_max_size = kwargs.pop('sysex_max_size', sysex.DEFAULT_MAX_SIZE)
+        self.sysex_timeout = kwargs.pop('sysex_timeout', sysex.DEFAULT_TIMEOUT)
         super(DataProtocol, self).__init__(*args, **kwargs)
+        # Created on first use, when sending.
+        self._writer = None
+        self._sender = None
+        # Guards the writer, as handlers may send from several threads.
+        self._send_lock = threading.Lock()
+
+    def _connect_peer(self, name, addr, ssrc):
+        peer = super(DataProtocol, self)._connect_peer(name, addr, ssrc)
+        if self.recover_lost_packets:
+            peer.recovery = RecoveryState()
+        if self.playout_delay is not None:
+            peer.jitter = JitterBuffer(self.playout_delay)
+        if self.recovery_journal:
+            peer.journal = RecoveryJournal()
+        if self.reassemble_sysex:
+            peer.sysex = sysex.SysExAssembler(self.sysex_max_size, self.sysex_timeout)
+        peer.protocol = self
+        return peer
+
+    def on_timer(self, now):
+        self.release_packets(now)
+        self.send_feedback(now)
+        self.sync_clocks(now)
+        for peer in self.peers_by_ssrc.values():
+            if peer.sysex is not None:
+                peer.sysex.expire(now)
+
+    def next_deadline(self):
+        deadline = None
+        for peer in self.peers_by_ssrc.values():
+            if peer.jitter is not None:
+                peer_deadline = peer.jitter.next_deadline()
+                if peer_deadline is not None and (deadline is None or peer_deadline < deadline):
+                    deadline = peer_deadline
+        return deadline
+
+    def release_packets(self, now=None):
+        """Delivers the packets due from every peer's jitter buffer."""
+        if now is None:
+            now = time.monotonic()
+        for peer in list(self.peers_by_ssrc.values()):
+            if peer.jitter is not None and len(peer.jitter):
+                for packet in peer.jitter.pop(now):
+                    self._deliver(peer, packet)
+
+    def send_feedback(self, now=None):
+        """Sends receiver feedback to every peer with news since its last.
+
+        Once a loss has been repaired from the journal, the last sequence
+        number received stands for everything before it, too. Peers sent
+        feedback within the last `feedback_interval` seconds are skipped.
+        """
+        if now is None:
+            now = time.monotonic()
+        for peer in list(self.peers_by_ssrc.values()):
+            if peer.recovery is None or peer.recovery.last_seqnum is None:
+                continue
+            seqnum = peer.recovery.last_seqnum
+            if seqnum == peer.feedback_seqnum:
+                continue
+            if peer.feedback_time is not None and now - peer.feedback_time < self.feedback_interval:
+                continue
+            message = packets.AppleMIDIReceiverFeedbackPacket.build(
+                dict(
+                    command=APPLEMIDI_COMMAND_RECEIVER_FEEDBACK,
+                    ssrc=self.ssrc,
+                    sequence_number=seqnum,
+                )
+            )
+            self.sendto(message, peer.addr)
+            peer.feedback_seqnum = seqnum
+            peer.feedback_time = now
+
+    def broadcast(self, events, timestamp=None, peers=None):
+        """Sends `events`, a list of `packets.MIDIEvent`s, to every peer.
+
+        `peers` may limit the peers sent to. Each packet's command section
+        is encoded once; only the RTP header, with the peer's own sequence
+        number, is written for each peer, and all the copies are sent
+        together (with `sendmmsg(2)`, where available). The packets carry
+        no recovery journal, and are not recorded in the peers' journals.
+        Timestamps work as for `Client.send_commands()`.
+        """
+        if timestamp is None:
+            timestamp = clock.timestamp()
+        peers = list(self.peers_by_ssrc.values() if peers is None else peers)
+        if not peers or not events:
+            return
+        with self._send_lock:
+            self._broadcast(events, timestamp, peers)
+
+    def _broadcast(self, events, timestamp, peers):
+        if self._writer is None:
+            self._writer = packets.MIDIPacketWriter(self.ssrc)
+        header_size = packets.MIDIPacketWriter.HEADER_SIZE
+        headers = bytearray(header_size * len(peers))
+        header_views = [
+            memoryview(headers)[i * header_size : (i + 1) * header_size] for i in range(len(peers))
+        ]
+        start = 0
+        while start < len(events):
+            packet, count = self._writer.write_events(0, timestamp, events, start)
+            payload = bytearray(packet[header_size:])
+            messages = []
+            for i, peer in enumerate(peers):
+                packets.pack_rtp_header(
+                    headers, i * header_size, peer.next_sequence_number(), timestamp, self.ssrc
+                )
+                messages.append(((header_views[i], payload), peer.addr))
+            self._send_batch(messages)
+            start += count
+            timestamp += sum(e.delta_time or 0 for e in events[start - count + 1 : start + 1])
+
+    def send_commands(self, peer, events, timestamp=None):
+        """Sends a list of `packets.MIDIEvent`s to `peer`, in as few packets as possible.
+
+        Packets go out on this protocol's socket, with the peer's own
+        sequence numbers and recovery journal. Timestamps work as for
+        `Client.send_commands()`. `peer` may also be the peer's control
+        session `Peer`, as given to `Handler.on_peer_connected()`.
+        """
+        data_peer = self.peers_by_ssrc.get(peer.ssrc)
+        if data_peer is None:
+            raise ProtocolError('Not connected to {}'.format(peer))
+        if timestamp is None:
+            timestamp = clock.timestamp()
+        with self._send_lock:
+            if self._writer is None:
+                self._writer = packets.MIDIPacketWriter(self.ssrc)
+            journal = data_peer.journal
+            start = 0
+            while start < len(events):
+                sequence_number = data_peer.next_sequence_number()
+                packet, count = self._writer.write_events(
+                    sequence_number,
+                    timestamp,
+                    events,
+                    start,
+                    journal.encode() if journal is not None else None,
+                )
+                self.sendto(packet, data_peer.addr)
+                if journal is not None:
+                    journal.record_events(sequence_number, events[start : start + count])
+                start += count
+                timestamp += sum(e.delta_time or 0 for e in events[start - count + 1 : start + 1])
+
+    def _send_batch(self, messages):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for buffers, addr in messages:
+                self.logger.debug('tx: {}'.format(b2h(b''.join(buffers))))
+        for buffers, addr in messages:
+            self.trace.record_parts(trace.DIRECTION_TX, self._ssrcs_by_addr.get(addr, 0), buffers)
+            if self.capture is not None:
+                self.capture.write(self._capture_addr, addr, b''.join(buffers))
+        labels = (self.kind, MIDI_COMMAND_LABEL)
+        self._tx_packets.inc(labels, len(messages))
+        self._tx_bytes.inc(labels, sum(len(b) for buffers, _ in messages for b in buffers))
+        if not isinstance(self.socket, socket.socket):
+            # Such as an asyncio transport.
+            for buffers, addr in messages:
+                self.socket.sendto(b''.join(buffers), addr)
+            return
+        if self._sender is None:
+            self._sender = BatchSender(self.socket)
+        self._sender.send(messages)
 
     def handle_command_message(self, command, data, addr):
         if command == APPLEMIDI_COMMAND_TIMESTAMP_SYNC:
@@ -137,23 +650,104 @@ class DataProtocol(BaseProtocol):
             super(DataProtocol, self).handle_command_message(command, data, addr)
 
     def handle_data_message(self, data, addr):
-        packet = packets.MIDIPacket.parse(data)
+        start = metrics.now_ns()
+        packet = packets.decode_midi_packet(data)
+        self._decode_time.record(metrics.now_ns() - start)
         if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug(packet)
         peer = self.peers_by_ssrc.get(packet.header.ssrc)
         if not peer:
+            self._drop('unknown_ssrc')
             self.logger.debug('Ignoring message from unknown ssrc={}'.format(packet.header.ssrc))
             return
+        if peer.jitter is not None:
+            now = time.monotonic()
+            peer.jitter.push(packet, now)
+            for packet in peer.jitter.pop(now):
+                self._deliver(peer, packet)
+            return
+        self._deliver(peer, packet)
+
+    def _deliver(self, peer, packet):
+        if peer.recovery is not None:
+            lost = peer.recovery.lost
+            repairs = peer.recovery.process(packet)
+            if repairs:
+                packet.command.midi_list[0:0] = repairs
+            if peer.sysex is not None and peer.recovery.lost != lost:
+                peer.sysex.abort()
+        if peer.sysex is not None:
+            self._reassemble_sysex(peer, packet)
         if self.midi_command_cb:
+            start = metrics.now_ns()
             self.midi_command_cb(peer, packet)
+            self._callback_time.record(metrics.now_ns() - start)
+
+    def _reassemble_sysex(self, peer, packet):
+        """Replaces SysEx segments in `packet` with any message they complete."""
+        midi_list = packet.command.midi_list
+        if not any(e.unknown is not None and e.status in _SYSEX_STATUSES for e in midi_list):
+            return
+        now = time.monotonic()
+        result = []
+        # Delta time of segments taken out, added to the next command's.
+        carry = 0
+        for event in midi_list:
+            if event.unknown is not None and event.status in _SYSEX_STATUSES:
+                completed = peer.sysex.feed(event, now)
+                if completed is None:
+                    carry += event.delta_time or 0
+                    continue
+                event = completed
+            if carry:
+                event.delta_time = (event.delta_time or 0) + carry
+                carry = 0
+            result.append(event)
+        packet.command.midi_list = result
+
+    def send_timestamp(self, peer, count=0, timestamp_1=None, timestamp_2=0, timestamp_3=0):
+        """Sends a clock synchronization (CK) message to `peer`.
+
+        With the defaults, begins a new exchange, stamped with the current
+        time.
+        """
+        if timestamp_1 is None:
+            timestamp_1 = clock.timestamp()
+        message = packets.AppleMIDITimestampPacket.build(
+            dict(
+                command=APPLEMIDI_COMMAND_TIMESTAMP_SYNC,
+                count=count,
+                ssrc=self.ssrc,
+                timestamp_1=timestamp_1,
+                timestamp_2=timestamp_2,
+                timestamp_3=timestamp_3,
+            )
+        )
+        self.sendto(message, peer.addr)
+
+    def sync_clocks(self, now=None):
+        """Begins a CK exchange with each peer not synced within `sync_interval`."""
+        if self.sync_interval is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        for peer in list(self.peers_by_ssrc.values()):
+            if peer.next_clock_sync is None or now >= peer.next_clock_sync:
+                peer.next_clock_sync = now + self.sync_interval
+                self.send_timestamp(peer)
 
     def handle_timestamp(self, data, addr):
+        """Takes part in a CK exchange, as responder or initiator.
+
+        Each completed exchange updates the peer's `clock` estimate, and the
+        clock offset of its jitter buffer, if any.
+        """
         packet = packets.AppleMIDITimestampPacket.parse(data)
-        response = None
         if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug(packet)
 
-        now = int(time.time() * 10000)  # units of 100 microseconds
+        now = clock.timestamp()
+        peer = self.peers_by_ssrc.get(packet.ssrc)
         if packet.count == 0:
             response = packets.AppleMIDITimestampPacket.build(
                 dict(
@@ -166,6 +760,23 @@ class DataProtocol(BaseProtocol):
                 )
             )
             self.sendto(response, addr)
+        elif not peer:
+            self._drop('unknown_ssrc')
+            self.logger.debug('Ignoring clock sync from unknown ssrc={}'.format(packet.ssrc))
+        elif packet.count == 1:
+            self.send_timestamp(peer, 2, packet.timestamp_1, packet.timestamp_2, now)
+            self._update_clock(peer, packet.timestamp_1, packet.timestamp_2, now, True)
         elif packet.count == 2:
-            offset_estimate = ((packet.timestamp_3 + packet.timestamp_1) / 2) - packet.timestamp_2
-            self.logger.debug('offset estimate: {}'.format(offset_estimate))
+            self._update_clock(
+                peer, packet.timestamp_1, packet.timestamp_2, packet.timestamp_3, False
+            )
+
+    def _update_clock(self, peer, timestamp_1, timestamp_2, timestamp_3, initiator):
+        peer.clock.add_exchange(timestamp_1, timestamp_2, timestamp_3, initiator)
+        if peer.clock.offset is None:
+            return
+        self.logger.debug(
+            'Clock of {}: offset {}, round trip {}'.format(peer, peer.clock.offset, peer.clock.rtt)
+        )
+        if peer.jitter is not None:
+            peer.jitter.clock_offset = -peer.clock.offset / packets.RTP_TIMESTAMP_RATE
@@ -0,0 +1,164 @@
+"""Batched datagram receive.
+
+`BatchReceiver` drains every datagram waiting on a socket in as few system
+calls as possible, into a ring of preallocated buffers. On Linux it uses
+`recvmmsg(2)` (through ctypes) to fetch up to `batch_size` datagrams per
+call; elsewhere it falls back to non-blocking `recvfrom_into()`.
+"""
+
+import ctypes
+import errno
+import os
+import socket
+import struct
+import sys
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.recvmmsg
+    except (OSError, AttributeError):
+        _libc = None
+
+# Large enough for a `struct sockaddr_in6`.
+SOCKADDR_SIZE = 28
+
+# Decoded peer addresses are cached by their raw form, up to this many.
+MAX_CACHED_ADDRS = 1024
+
+_SA_FAMILY = struct.Struct('=H')
+_UINT16 = struct.Struct('>H')
+_PORT_AND_FLOWINFO = struct.Struct('>HI')
+_SCOPE_ID = struct.Struct('=I')
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', _msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+def recvmmsg_available():
+    """Returns True if `recvmmsg(2)` can be used on this platform."""
+    return _libc is not None
+
+
+def _decode_sockaddr(raw):
+    """Decodes a `struct sockaddr_in` or `sockaddr_in6` to a Python address."""
+    (family,) = _SA_FAMILY.unpack_from(raw, 0)
+    if family == socket.AF_INET:
+        (port,) = _UINT16.unpack_from(raw, 2)
+        return (socket.inet_ntop(socket.AF_INET, raw[4:8]), port)
+    elif family == socket.AF_INET6:
+        port, flowinfo = _PORT_AND_FLOWINFO.unpack_from(raw, 2)
+        (scope_id,) = _SCOPE_ID.unpack_from(raw, 24)
+        return (socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope_id)
+    raise ValueError('Unsupported address family {}'.format(family))
+
+
+class BatchReceiver(object):
+    """Receives batches of datagrams from `sock` into reusable buffers.
+
+    `receive()` returns a list of `(data, addr)` pairs, where `data` is a
+    `memoryview` into one of the receiver's buffers. Views are only valid
+    until the next call to `receive()`; copy them to keep them.
+    """
+
+    def __init__(self, sock, batch_size=64, buffer_size=1024, use_recvmmsg=None):
+        if use_recvmmsg is None:
+            use_recvmmsg = recvmmsg_available()
+        elif use_recvmmsg and not recvmmsg_available():
+            raise ValueError('recvmmsg is not available on this platform')
+        self.sock = sock
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.use_recvmmsg = use_recvmmsg
+
+        self.buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self._addr_cache = {}
+
+        if use_recvmmsg:
+            self._names = (ctypes.c_char * (SOCKADDR_SIZE * batch_size))()
+            self._iovecs = (_iovec * batch_size)()
+            self._msgs = (_mmsghdr * batch_size)()
+            names_base = ctypes.addressof(self._names)
+            for i, buf in enumerate(self.buffers):
+                self._iovecs[i].iov_base = ctypes.addressof(
+                    (ctypes.c_char * buffer_size).from_buffer(buf)
+                )
+                self._iovecs[i].iov_len = buffer_size
+                hdr = self._msgs[i].msg_hdr
+                hdr.msg_name = names_base + i * SOCKADDR_SIZE
+                hdr.msg_namelen = SOCKADDR_SIZE
+                hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+                hdr.msg_iovlen = 1
+            self._names_view = memoryview(self._names).cast('B')
+
+    def receive(self):
+        """Returns all datagrams waiting on the socket, up to `batch_size`."""
+        if self.use_recvmmsg:
+            return self._receive_recvmmsg()
+        return self._receive_fallback()
+
+    def _receive_recvmmsg(self):
+        count = _libc.recvmmsg(
+            self.sock.fileno(), self._msgs, self.batch_size, socket.MSG_DONTWAIT, None
+        )
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+
+        result = []
+        names = self._names_view
+        addr_cache = self._addr_cache
+        for i in range(count):
+            msg = self._msgs[i]
+            offset = i * SOCKADDR_SIZE
+            raw_addr = bytes(names[offset : offset + msg.msg_hdr.msg_namelen])
+            addr = addr_cache.get(raw_addr)
+            if addr is None:
+                if len(addr_cache) >= MAX_CACHED_ADDRS:
+                    addr_cache.clear()
+                addr = addr_cache[raw_addr] = _decode_sockaddr(raw_addr)
+            result.append((self.views[i][: msg.msg_len], addr))
+            # The kernel overwrites this with the actual address length.
+            msg.msg_hdr.msg_namelen = SOCKADDR_SIZE
+        return result
+
+    def _receive_fallback(self):
+        result = []
+        flags = getattr(socket, 'MSG_DONTWAIT', 0)
+        for view in self.views:
+            try:
+                nbytes, addr = self.sock.recvfrom_into(view, self.buffer_size, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            result.append((view[:nbytes], addr))
+            if not flags:
+                # Without MSG_DONTWAIT, only the first read is known not to block.
+                break
+        return result
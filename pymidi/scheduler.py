@@ -0,0 +1,147 @@
+"""Timestamp-scheduled output.
+
+A `Scheduler` holds MIDI events in a heap, ordered by the time each should
+be played, and hands them back for sending when that time comes. Events due
+within the same tick are returned together, to go in a single packet, each
+stamped with its own time: the first in the packet's RTP timestamp, the rest
+in delta times.
+
+Times are `time.monotonic()` times, as read by `pymidi.clock.timestamp()`.
+Events may be released early by a lead time, such as the estimated one-way
+latency to the peer, so that they arrive when due.
+
+`ThreadScheduler` sends from a background thread. It sleeps until shortly
+before each deadline, then spins, so that packets leave within microseconds
+of their time rather than at the whim of the OS scheduler.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from pymidi import packets
+
+logger = logging.getLogger('pymidi.scheduler')
+
+# Events due within this many seconds of each other are sent together.
+DEFAULT_TICK = 0.001
+
+# `ThreadScheduler` spins for the last this many seconds before a deadline.
+SPIN_TIME = 0.001
+
+
+class Scheduler(object):
+    def __init__(self, send_cb, tick=DEFAULT_TICK, lead_cb=None):
+        """Creates a new Scheduler.
+
+        `send_cb(events, timestamp)` is called with each group of due
+        events, as `packets.MIDIEvent`s with delta times, and the RTP
+        timestamp of the first. `lead_cb()`, if given, returns the number of
+        seconds early to release events.
+        """
+        self.send_cb = send_cb
+        self.tick = tick
+        self.lead_cb = lead_cb
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _lead(self):
+        return (self.lead_cb() or 0) if self.lead_cb else 0
+
+    def schedule(self, event, at):
+        """Schedules `event`, a `packets.MIDIEvent`, to play at time `at`."""
+        heapq.heappush(self._heap, (at, next(self._counter), event))
+
+    def cancel_all(self):
+        """Forgets every event not yet sent."""
+        self._heap = []
+
+    def close(self):
+        """Stops sending; unsent events are dropped."""
+        self.cancel_all()
+
+    def next_deadline(self):
+        """Returns the time at which events must next be sent, or None."""
+        if not self._heap:
+            return None
+        return self._heap[0][0] - self._lead()
+
+    def run_due(self, now):
+        """Sends every event due by `now`, plus those due within one tick."""
+        lead = self._lead()
+        events = []
+        first_timestamp = last_timestamp = None
+        while self._heap and self._heap[0][0] - lead <= now + self.tick:
+            at, _, event = heapq.heappop(self._heap)
+            timestamp = int(at * packets.RTP_TIMESTAMP_RATE)
+            if first_timestamp is None:
+                first_timestamp = last_timestamp = timestamp
+                delta_time = None
+            else:
+                delta_time = timestamp - last_timestamp
+                last_timestamp = timestamp
+            events.append(
+                packets.MIDIEvent(event.status, event.data1, event.data2, delta_time, event.unknown)
+            )
+        if events:
+            self.send_cb(events, first_timestamp)
+        return len(events)
+
+
+class ThreadScheduler(Scheduler):
+    """A `Scheduler` which sends from its own daemon thread."""
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadScheduler, self).__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def schedule(self, event, at):
+        with self._cond:
+            if self._closed:
+                raise ValueError('Scheduler is closed')
+            super(ThreadScheduler, self).schedule(event, at)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel_all(self):
+        with self._cond:
+            super(ThreadScheduler, self).cancel_all()
+
+    def close(self):
+        """Stops the thread; unsent events are dropped."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                deadline = self.next_deadline()
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining > SPIN_TIME:
+                    self._cond.wait(remaining - SPIN_TIME)
+                    continue
+                self._cond.release()
+                try:
+                    while time.monotonic() < deadline:
+                        pass
+                finally:
+                    self._cond.acquire()
+                try:
+                    self.run_due(time.monotonic())
+                except Exception:
+                    logger.exception('Error sending scheduled events')
@@ -0,0 +1,147 @@
+"""Batched datagram send.
+
+`BatchSender` sends many datagrams in as few system calls as possible, each
+gathered from several buffers, so that a payload shared by many datagrams
+need not be copied for each. On Linux it uses `sendmmsg(2)` (through
+ctypes); elsewhere it falls back to one `sendmsg()` (or `sendto()`) per
+datagram.
+"""
+
+import ctypes
+import errno
+import os
+import socket
+import struct
+
+from pymidi.receiver import SOCKADDR_SIZE, _iovec, _libc, _mmsghdr
+
+_SA_FAMILY = struct.Struct('=H')
+_PORT = struct.Struct('>H')
+_PORT_AND_FLOWINFO = struct.Struct('>HI')
+_SCOPE_ID = struct.Struct('=I')
+
+# Encoded destination addresses are cached, up to this many.
+MAX_CACHED_ADDRS = 1024
+
+
+def sendmmsg_available():
+    """Returns True if `sendmmsg(2)` can be used on this platform."""
+    return _libc is not None and hasattr(_libc, 'sendmmsg')
+
+
+def _encode_sockaddr(family, addr):
+    """Encodes a Python address as a `struct sockaddr_in` or `sockaddr_in6`."""
+    if family == socket.AF_INET:
+        raw = bytearray(16)
+        _SA_FAMILY.pack_into(raw, 0, family)
+        _PORT.pack_into(raw, 2, addr[1])
+        raw[4:8] = socket.inet_pton(socket.AF_INET, addr[0])
+        return bytes(raw)
+    elif family == socket.AF_INET6:
+        raw = bytearray(SOCKADDR_SIZE)
+        _SA_FAMILY.pack_into(raw, 0, family)
+        flowinfo = addr[2] if len(addr) > 2 else 0
+        scope_id = addr[3] if len(addr) > 3 else 0
+        _PORT_AND_FLOWINFO.pack_into(raw, 2, addr[1], flowinfo)
+        raw[8:24] = socket.inet_pton(socket.AF_INET6, addr[0])
+        _SCOPE_ID.pack_into(raw, 24, scope_id)
+        return bytes(raw)
+    raise ValueError('Unsupported address family {}'.format(family))
+
+
+def _address_of(buf, keep):
+    """Returns the address of writable buffer `buf`, keeping it alive in `keep`."""
+    array = (ctypes.c_char * len(buf)).from_buffer(buf)
+    keep.append(array)
+    return ctypes.addressof(array)
+
+
+class BatchSender(object):
+    """Sends batches of datagrams on `sock`.
+
+    `send()` takes a list of `(buffers, addr)` pairs, where `buffers` is a
+    sequence of up to `max_buffers` writable buffers (`bytearray`s, or views
+    of them), which are sent together as one datagram to `addr`.
+    """
+
+    def __init__(self, sock, batch_size=64, max_buffers=2, use_sendmmsg=None):
+        if use_sendmmsg is None:
+            use_sendmmsg = sendmmsg_available()
+        elif use_sendmmsg and not sendmmsg_available():
+            raise ValueError('sendmmsg is not available on this platform')
+        self.sock = sock
+        self.batch_size = batch_size
+        self.max_buffers = max_buffers
+        self.use_sendmmsg = use_sendmmsg
+        self._addr_cache = {}
+
+        if use_sendmmsg:
+            self._names = (ctypes.c_char * (SOCKADDR_SIZE * batch_size))()
+            self._iovecs = (_iovec * (batch_size * max_buffers))()
+            self._msgs = (_mmsghdr * batch_size)()
+            names_base = ctypes.addressof(self._names)
+            for i in range(batch_size):
+                hdr = self._msgs[i].msg_hdr
+                hdr.msg_name = names_base + i * SOCKADDR_SIZE
+                hdr.msg_iov = ctypes.pointer(self._iovecs[i * max_buffers])
+
+    def send(self, messages):
+        """Sends every message, and returns the number sent."""
+        if not self.use_sendmmsg:
+            return self._send_fallback(messages)
+        for start in range(0, len(messages), self.batch_size):
+            self._send_sendmmsg(messages[start : start + self.batch_size])
+        return len(messages)
+
+    def _sockaddr(self, addr):
+        raw = self._addr_cache.get(addr)
+        if raw is None:
+            if len(self._addr_cache) >= MAX_CACHED_ADDRS:
+                self._addr_cache.clear()
+            raw = self._addr_cache[addr] = _encode_sockaddr(self.sock.family, addr)
+        return raw
+
+    def _send_sendmmsg(self, messages):
+        keep = []
+        names_base = ctypes.addressof(self._names)
+        for i, (buffers, addr) in enumerate(messages):
+            if len(buffers) > self.max_buffers:
+                raise ValueError('At most {} buffers per message'.format(self.max_buffers))
+            raw_addr = self._sockaddr(addr)
+            ctypes.memmove(names_base + i * SOCKADDR_SIZE, raw_addr, len(raw_addr))
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_namelen = len(raw_addr)
+            iovlen = 0
+            for buf in buffers:
+                if not len(buf):
+                    continue
+                iov = self._iovecs[i * self.max_buffers + iovlen]
+                iov.iov_base = _address_of(buf, keep)
+                iov.iov_len = len(buf)
+                iovlen += 1
+            hdr.msg_iovlen = iovlen
+
+        sent = 0
+        msg_size = ctypes.sizeof(_mmsghdr)
+        while sent < len(messages):
+            count = _libc.sendmmsg(
+                self.sock.fileno(),
+                ctypes.byref(self._msgs, sent * msg_size),
+                len(messages) - sent,
+                0,
+            )
+            if count < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            sent += count
+
+    def _send_fallback(self, messages):
+        sendmsg = getattr(self.sock, 'sendmsg', None)
+        for buffers, addr in messages:
+            if sendmsg:
+                sendmsg(buffers, (), 0, addr)
+            else:
+                self.sock.sendto(b''.join(buffers), addr)
+        return len(messages)
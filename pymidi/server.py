@@ -2,12 +2,17 @@ from builtins import bytes
 
 from optparse import OptionParser
 import logging
-import select
+import selectors
 import socket
 import sys
+import time
 
+from pymidi import capture
+from pymidi import metrics
+from pymidi import trace
 from pymidi.protocol import DataProtocol
 from pymidi.protocol import ControlProtocol
+from pymidi.receiver import BatchReceiver
 from pymidi import utils
 
 try:
@@ -17,6 +22,9 @@ except ImportError:
 
 logger = logging.getLogger('pymidi.server')
 
+# Seconds between calls to each protocol's `on_timer()`.
+TIMER_INTERVAL = 0.25
+
 
 class Handler(object):
     def on_peer_connected(self, peer):
@@ -30,22 +38,75 @@ class Handler(object):
 
 
 class Server(object):
-    def __init__(self, bind_addrs):
+    def __init__(
+        self,
+        bind_addrs,
+        batch_receive=False,
+        dispatcher=None,
+        metrics_registry=None,
+        trace_ring=None,
+        data_protocol_options=None,
+        sync_interval=None,
+    ):
         """Creates a new Server instance.
 
         `bind_addrs` should be an iterable of 1 or more addresses to bind to,
         each a 2-tuple of (ip, port). Socket family will be automatically
         detected from the IP address.
+
+        If `batch_receive` is set, each wakeup drains every datagram waiting
+        on a socket into preallocated buffers (see `pymidi.receiver`), and
+        protocols are handed `memoryview`s rather than `bytes`.
+
+        Handlers are called on the serving thread, unless a `dispatcher`
+        (such as a `pymidi.dispatch.ThreadPoolDispatcher`) is given to run
+        them elsewhere. The dispatcher remains the caller's: `close()` leaves
+        it running, so that it may be shared, and the caller should close it.
+
+        Every protocol records its metrics in `self.metrics`, which is
+        `metrics_registry` if given, else a new `pymidi.metrics.Registry`;
+        export it with `self.metrics.snapshot()` or `to_prometheus()`.
+
+        Likewise, every datagram is recorded in `self.trace`, `trace_ring` or
+        a new `pymidi.trace.TraceRing`; see `pymidi.trace.dump_on_signal()`.
+
+        `data_protocol_options` is a dict of further keyword arguments for
+        each `DataProtocol`, such as `playout_delay`, `recover_lost_packets`,
+        `feedback_interval` or `reassemble_sysex`.
+
+        With `sync_interval`, the server also begins a clock synchronization
+        (CK) exchange with each peer every `sync_interval` seconds, rather
+        than only answering those begun by peers; see `DataProtocol`.
         """
         if not bind_addrs:
             raise ValueError('Must provide at least one bind address.')
         map(utils.validate_addr, bind_addrs)
         self.bind_addrs = bind_addrs
+        self.batch_receive = batch_receive
+        self.dispatcher = dispatcher
+        self.metrics = metrics_registry or metrics.Registry()
+        self.trace = trace_ring if trace_ring is not None else trace.TraceRing()
+        self.data_protocol_options = dict(data_protocol_options or {})
+        self.sync_interval = sync_interval
+        # A `pymidi.capture.PcapWriter` while capturing; see `start_capture()`.
+        self.capture = None
         self.handlers = set()
 
         # Maps sockets to their protocol handlers.
         self.socket_map = {}
 
+        # Every protocol created by `_init_protocols()`, to close with the server.
+        self.protocols = []
+
+        # Maps sockets to their `BatchReceiver`, when `batch_receive` is set.
+        self.receivers = {}
+
+        # Created on first use, by `_init_selector()`.
+        self.selector = None
+        self._wakeup_sockets = None
+        self._shutdown_requested = False
+        self._next_timer = None
+
     @classmethod
     def from_bind_addrs(cls, hosts):
         """Convenience method to construct an instance from a string."""
@@ -66,18 +127,80 @@ class Server(object):
         assert isinstance(handler, Handler)
         self.handlers.discard(handler)
 
+    def get_peer(self, ssrc):
+        """Returns the connected `Peer` with `ssrc`, which MIDI may be sent to, or None."""
+        for proto in self.socket_map.values():
+            if isinstance(proto, DataProtocol) and ssrc in proto.peers_by_ssrc:
+                return proto.peers_by_ssrc[ssrc]
+        return None
+
+    def send_commands(self, peer, events, timestamp=None):
+        """Sends a list of `packets.MIDIEvent`s to `peer`, a `Peer` or its SSRC."""
+        ssrc = getattr(peer, 'ssrc', peer)
+        data_peer = self.get_peer(ssrc)
+        if data_peer is None:
+            raise ValueError('No connected peer with ssrc {}'.format(ssrc))
+        data_peer.send_commands(events, timestamp)
+
+    def broadcast(self, events, timestamp=None):
+        """Sends `events`, a list of `packets.MIDIEvent`s, to every connected peer.
+
+        See `DataProtocol.broadcast()`.
+        """
+        for proto in list(self.socket_map.values()):
+            if isinstance(proto, DataProtocol):
+                proto.broadcast(events, timestamp)
+
+    def start_capture(self, file, snap_length=capture.DEFAULT_SNAP_LENGTH):
+        """Writes every datagram received and sent, on all ports, to pcap file `file`.
+
+        `file` is a path or binary file; see `pymidi.capture.PcapWriter`.
+        Capturing lasts until `stop_capture()` or `close()`. Returns the
+        writer.
+        """
+        self.stop_capture()
+        self.capture = capture.PcapWriter(file, snap_length)
+        for proto in self.socket_map.values():
+            proto.start_capture(self.capture)
+        return self.capture
+
+    def stop_capture(self):
+        if self.capture is None:
+            return
+        for proto in self.socket_map.values():
+            proto.stop_capture()
+        self.capture.close()
+        self.capture = None
+
     def _peer_connected_cb(self, peer):
-        for handler in self.handlers:
-            handler.on_peer_connected(peer)
+        self._dispatch('on_peer_connected', peer)
 
     def _peer_disconnected_cb(self, peer):
-        for handler in self.handlers:
-            handler.on_peer_disconnected(peer)
+        self._dispatch('on_peer_disconnected', peer)
 
     def _midi_command_cb(self, peer, midi_packet):
-        commands = midi_packet.command.midi_list
-        for handler in self.handlers:
-            handler.on_midi_commands(peer, commands)
+        self._dispatch('on_midi_commands', peer, midi_packet.command.midi_list)
+
+    def _dispatch(self, method_name, peer, *args):
+        """Calls `method_name` on every handler, via the dispatcher if any.
+
+        Only MIDI commands may be dropped by the dispatcher's overflow policy.
+        """
+        if self.dispatcher:
+            self.dispatcher.submit(
+                peer.ssrc,
+                self._call_handlers,
+                method_name,
+                peer,
+                *args,
+                droppable=method_name == 'on_midi_commands',
+            )
+        else:
+            self._call_handlers(method_name, peer, *args)
+
+    def _call_handlers(self, method_name, *args):
+        for handler in list(self.handlers):
+            getattr(handler, method_name)(*args)
 
     def _build_control_protocol(self, host, port, family):
         logger.info('Control socket on {}:{}'.format(host, port))
@@ -87,6 +210,8 @@ class Server(object):
             socket=control_socket,
             connect_cb=self._peer_connected_cb,
             disconnect_cb=self._peer_disconnected_cb,
+            metrics_registry=self.metrics,
+            trace_ring=self.trace,
         )
 
     def _build_data_protocol(self, host, family, ctrl_protocol):
@@ -94,7 +219,16 @@ class Server(object):
         logger.info('Data socket on {}:{}'.format(host, ctrl_port + 1))
         data_socket = socket.socket(family, socket.SOCK_DGRAM)
         data_socket.bind((host, ctrl_port + 1))
-        data_protocol = DataProtocol(data_socket, midi_command_cb=self._midi_command_cb)
+        options = dict(self.data_protocol_options)
+        if self.sync_interval is not None:
+            options['sync_interval'] = self.sync_interval
+        data_protocol = DataProtocol(
+            data_socket,
+            midi_command_cb=self._midi_command_cb,
+            metrics_registry=self.metrics,
+            trace_ring=self.trace,
+            **options,
+        )
         ctrl_protocol.associate_data_protocol(data_protocol)
         return data_protocol
 
@@ -112,6 +246,13 @@ class Server(object):
 
             self.socket_map[data_protocol.socket] = data_protocol
             self.socket_map[ctrl_protocol.socket] = ctrl_protocol
+            self.protocols.extend((ctrl_protocol, data_protocol))
+            if self.capture is not None:
+                for proto in (ctrl_protocol, data_protocol):
+                    proto.start_capture(self.capture)
+            if self.batch_receive:
+                for proto in (ctrl_protocol, data_protocol):
+                    self.receivers[proto.socket] = BatchReceiver(proto.socket)
 
             protos = (ctrl_protocol, data_protocol)
             if family == socket.AF_INET:
@@ -119,16 +260,114 @@ class Server(object):
             elif family == socket.AF_INET6:
                 self.ipv6_protocols = protos
 
+    def _init_selector(self):
+        """Registers all sockets, once, with a `selectors.DefaultSelector`.
+
+        A socket pair is registered alongside them, so that `shutdown()` can
+        wake the loop.
+        """
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_sockets = socket.socketpair()
+        for sock in self._wakeup_sockets:
+            sock.setblocking(False)
+        self.selector.register(self._wakeup_sockets[0], selectors.EVENT_READ, None)
+        for sock, proto in self.socket_map.items():
+            self.selector.register(sock, selectors.EVENT_READ, proto)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_sockets[0].recv(64):
+                pass
+        except BlockingIOError:
+            pass
+
     def _loop_once(self, timeout=None):
-        sockets = self.socket_map.keys()
-        rr, _, _ = select.select(sockets, [], [], timeout)
-        for s in rr:
-            buffer, addr = s.recvfrom(1024)
-            buffer = bytes(buffer)
-            proto = self.socket_map[s]
-            proto.handle_message(buffer, addr)
+        if self.selector is None:
+            self._init_selector()
+        for key, _ in self.selector.select(timeout):
+            if key.data is None:
+                self._drain_wakeup()
+            else:
+                self._handle_readable(key.fileobj, key.data)
+
+    def _run_timers(self, now=None):
+        """Calls `on_timer()` on every protocol each `TIMER_INTERVAL`, and on
+        any protocol whose `next_deadline()` has passed.
+        """
+        if now is None:
+            now = time.monotonic()
+        periodic = self._next_timer is None or now >= self._next_timer
+        if periodic:
+            self._next_timer = now + TIMER_INTERVAL
+        for proto in list(self.socket_map.values()):
+            deadline = proto.next_deadline()
+            if periodic or (deadline is not None and now >= deadline):
+                proto.on_timer(now)
+
+    def _timer_timeout(self, now=None):
+        """Returns the number of seconds until `_run_timers()` has work to do."""
+        if now is None:
+            now = time.monotonic()
+        deadline = self._next_timer if self._next_timer is not None else now
+        for proto in self.socket_map.values():
+            proto_deadline = proto.next_deadline()
+            if proto_deadline is not None and proto_deadline < deadline:
+                deadline = proto_deadline
+        return max(0, deadline - now)
+
+    def _handle_readable(self, s, proto):
+        """Reads from socket `s`, and passes what was read to `proto`."""
+        receiver = self.receivers.get(s)
+        if receiver:
+            for buffer, addr in receiver.receive():
+                proto.handle_message(buffer, addr)
+            return
+        buffer, addr = s.recvfrom(1024)
+        buffer = bytes(buffer)
+        proto.handle_message(buffer, addr)
 
     def serve_forever(self):
+        """Serves until `shutdown()` is called, then closes all sockets.
+
+        May be called again afterwards, to serve anew.
+        """
         self._init_protocols()
-        while True:
-            self._loop_once()
+        self._init_selector()
+        try:
+            while not self._shutdown_requested:
+                self._loop_once(self._timer_timeout())
+                self._run_timers()
+        finally:
+            self._shutdown_requested = False
+            self.close()
+
+    def shutdown(self):
+        """Asks `serve_forever()` to return.
+
+        Safe to call from another thread, a signal handler, or a `Handler`
+        callback; does not wait for the loop to exit.
+        """
+        self._shutdown_requested = True
+        if self._wakeup_sockets:
+            try:
+                self._wakeup_sockets[1].send(b'\0')
+            except OSError:
+                pass
+
+    def close(self):
+        """Closes all sockets, and stops any capture."""
+        self.stop_capture()
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        if self._wakeup_sockets:
+            for sock in self._wakeup_sockets:
+                sock.close()
+            self._wakeup_sockets = None
+        for proto in self.protocols:
+            proto.close()
+        self.protocols = []
+        for sock in self.socket_map:
+            sock.close()
+        self.socket_map = {}
+        self.receivers = {}
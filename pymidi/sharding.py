@@ -0,0 +1,231 @@
+"""A `Server` which spreads work across several processes.
+
+The parent process owns the sockets and does nothing but receive: each
+datagram's sender SSRC is read from a fixed offset, and the datagram is
+handed to worker `ssrc % num_workers` over a pipe. Workers are forked after
+the sockets are bound, and each runs its own copy of the control and data
+protocols, so invitation, clock sync and MIDI data for a session are always
+handled by the same worker; replies are sent on the inherited sockets.
+
+Sharding by SSRC is used rather than `SO_REUSEPORT`, because the kernel
+balances reuseport sockets by address, and a peer's control and data
+traffic come from different ports.
+
+Requires the `fork` start method, so is only available on POSIX systems.
+`broadcast()` is passed to every worker, but `start_capture()` is not
+supported, since the workers would all write the one file.
+"""
+
+import logging
+import multiprocessing
+import os
+import selectors
+import signal
+
+from pymidi import protocol
+from pymidi import server
+
+logger = logging.getLogger('pymidi.sharding')
+
+# Sent to workers, in place of a datagram's protocol index, to broadcast.
+BROADCAST = 'broadcast'
+
+
+class ShardForwarder(object):
+    """Stands in for a protocol in the parent, forwarding to workers."""
+
+    def __init__(self, sharded_server, index):
+        self.server = sharded_server
+        self.index = index
+
+    def handle_message(self, data, addr):
+        ssrc = protocol.packet_ssrc(data)
+        worker = self.server.worker_for_ssrc(ssrc)
+        self.server.worker_conns[worker].send((self.index, bytes(data), addr))
+
+    def on_timer(self, now):
+        """Timers run in the workers, on their own copies of the protocols."""
+        pass
+
+    def next_deadline(self):
+        return None
+
+
+class ShardedServer(server.Server):
+    def __init__(self, bind_addrs, num_workers=None, forward_events=False, **kwargs):
+        """Creates a new ShardedServer.
+
+        `num_workers` defaults to the number of CPUs. Handlers run in the
+        worker processes, on each worker's copy of the handler; with
+        `forward_events`, handler events are instead sent back to the parent
+        and run there, in the order each worker produced them.
+
+        Each worker records metrics and traces in its own copy of
+        `self.metrics` and `self.trace`.
+        """
+        super(ShardedServer, self).__init__(bind_addrs, **kwargs)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.forward_events = forward_events
+        self.processes = []
+        self.worker_conns = []
+        self.event_conns = []
+
+        # Set in worker processes, when `forward_events` is set.
+        self._event_conn = None
+        self._in_worker = False
+
+        # With `forward_events`, the parent's stand-in for each connected
+        # `Peer`, by SSRC, given to handlers.
+        self._forwarded_peers = {}
+
+    def broadcast(self, events, timestamp=None):
+        """Sends `events` to every connected peer, from the worker handling it.
+
+        Returns once the events are passed to the workers, not once sent.
+        """
+        if self._in_worker:
+            super(ShardedServer, self).broadcast(events, timestamp)
+            return
+        for conn in self.worker_conns:
+            conn.send((BROADCAST, events, timestamp))
+
+    def start_capture(self, file, snap_length=None):
+        """Not supported: the workers would each write to `file` at once.
+
+        Raises RuntimeError; capture a `Server` instead, or use tcpdump.
+        """
+        raise RuntimeError('ShardedServer does not support start_capture()')
+
+    def worker_for_ssrc(self, ssrc):
+        """Returns the index of the worker responsible for `ssrc`."""
+        if ssrc is None:
+            return 0
+        return ssrc % self.num_workers
+
+    def _init_protocols(self):
+        super(ShardedServer, self)._init_protocols()
+        protocols = list(self.socket_map.values())
+        ctx = multiprocessing.get_context('fork')
+        for _ in range(self.num_workers):
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            event_recv_conn, event_send_conn = (
+                ctx.Pipe(duplex=False) if self.forward_events else (None, None)
+            )
+            process = ctx.Process(
+                target=self._worker_main,
+                args=(protocols, recv_conn, event_send_conn),
+                daemon=True,
+            )
+            process.start()
+            recv_conn.close()
+            if event_send_conn:
+                event_send_conn.close()
+                self.event_conns.append(event_recv_conn)
+            self.processes.append(process)
+            self.worker_conns.append(send_conn)
+
+        for index, sock in enumerate(self.socket_map):
+            self.socket_map[sock] = ShardForwarder(self, index)
+
+    def _worker_main(self, protocols, conn, event_conn):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self._event_conn = event_conn
+        self._in_worker = True
+        # A dispatcher's threads don't survive the fork; call handlers directly.
+        self.dispatcher = None
+        # Here, the protocols take the place of the forwarders, for timers.
+        self.socket_map = dict(zip(self.socket_map, protocols))
+        while True:
+            if conn.poll(self._timer_timeout()):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    break
+                if message is None:
+                    break
+                self._handle_worker_message(protocols, message)
+            self._run_timers()
+
+    def _handle_worker_message(self, protocols, message):
+        if message[0] == BROADCAST:
+            _, events, timestamp = message
+            try:
+                self.broadcast(events, timestamp)
+            except Exception:
+                logger.exception('Error broadcasting')
+            return
+        index, data, addr = message
+        try:
+            protocols[index].handle_message(data, addr)
+        except Exception:
+            logger.exception('Error handling message from {}'.format(addr))
+
+    def _forward_event(self, method_name, peer, *args):
+        # Only what identifies the peer is sent, rather than pickling it.
+        self._event_conn.send((method_name, (peer.name, peer.addr, peer.ssrc), args))
+
+    def _forwarded_peer(self, method_name, name, addr, ssrc):
+        """Returns the parent's `Peer` for a forwarded event, creating it if new."""
+        peer = self._forwarded_peers.get(ssrc)
+        if peer is None or (peer.name, peer.addr) != (name, addr):
+            peer = self._forwarded_peers[ssrc] = protocol.Peer(name, addr, ssrc)
+        if method_name == 'on_peer_disconnected':
+            del self._forwarded_peers[ssrc]
+        return peer
+
+    def _peer_connected_cb(self, peer):
+        if self._event_conn:
+            self._forward_event('on_peer_connected', peer)
+        else:
+            super(ShardedServer, self)._peer_connected_cb(peer)
+
+    def _peer_disconnected_cb(self, peer):
+        if self._event_conn:
+            self._forward_event('on_peer_disconnected', peer)
+        else:
+            super(ShardedServer, self)._peer_disconnected_cb(peer)
+
+    def _midi_command_cb(self, peer, midi_packet):
+        if self._event_conn:
+            self._forward_event('on_midi_commands', peer, midi_packet.command.midi_list)
+        else:
+            super(ShardedServer, self)._midi_command_cb(peer, midi_packet)
+
+    def _init_selector(self):
+        super(ShardedServer, self)._init_selector()
+        for conn in self.event_conns:
+            self.selector.register(conn, selectors.EVENT_READ, conn)
+
+    def _handle_readable(self, s, proto):
+        if s not in self.socket_map:
+            self._handle_events(s)
+            return
+        super(ShardedServer, self)._handle_readable(s, proto)
+
+    def _handle_events(self, conn):
+        while conn.poll():
+            try:
+                method_name, peer_key, args = conn.recv()
+            except EOFError:
+                self.selector.unregister(conn)
+                return
+            peer = self._forwarded_peer(method_name, *peer_key)
+            self._dispatch(method_name, peer, *args)
+
+    def close(self):
+        """Stops all workers, and closes all sockets."""
+        for conn in self.worker_conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join(timeout=5)
+        for conn in self.event_conns:
+            conn.close()
+        self.processes = []
+        self.worker_conns = []
+        self.event_conns = []
+        self._forwarded_peers = {}
+        super(ShardedServer, self).close()
@@ -0,0 +1,153 @@
+"""System exclusive reassembly and segmentation.
+
+RFC 6295 (section 3.2) lets a long system exclusive (SysEx) message be sent
+in segments, across several packets:
+
+* `F0 ... F7`: a whole message;
+* `F0 ... F0`: the first segment;
+* `F7 ... F0`: a middle segment;
+* `F7 ... F7`: the last segment;
+* `... F4`: cancels the message being sent.
+
+`SysExAssembler` puts segments received from one peer back together.
+`segment()` does the reverse, for sending.
+"""
+
+import logging
+
+from pymidi import packets
+
+logger = logging.getLogger('pymidi.sysex')
+
+# Largest reassembled message, in bytes; longer ones are dropped.
+DEFAULT_MAX_SIZE = 1024 * 1024
+
+# Seconds to wait for the next segment before dropping a message.
+DEFAULT_TIMEOUT = 5.0
+
+# Largest segment `segment()` makes, in bytes after the status byte: small
+# enough that a packet holding one, plus a recovery journal of the default
+# maximum size, fits a `MIDIPacketWriter` buffer, which stays under the
+# usual 1500 byte MTU.
+DEFAULT_SEGMENT_SIZE = 480
+
+
+def segment(data, segment_size=DEFAULT_SEGMENT_SIZE):
+    """Splits SysEx message `data` (`F0 ... F7`) into `packets.MIDIEvent` segments.
+
+    A message which fits in `segment_size` bytes is returned whole, as one
+    event.
+    """
+    data = bytes(data)
+    if len(data) < 2 or data[0] != packets.COMMAND_SYSEX or data[-1] != packets.COMMAND_SYSEX_END:
+        raise ValueError('SysEx message must begin with 0xF0 and end with 0xF7')
+    payload = data[1:-1]
+    if any(b & 0x80 for b in payload):
+        raise ValueError('SysEx data bytes must be below 0x80')
+    if segment_size < 2:
+        raise ValueError('segment_size must be at least 2')
+
+    chunk = segment_size - 1
+    events = []
+    for start in range(0, max(len(payload), 1), chunk):
+        status = packets.COMMAND_SYSEX if start == 0 else packets.COMMAND_SYSEX_END
+        last = start + chunk >= len(payload)
+        end_byte = packets.COMMAND_SYSEX_END if last else packets.COMMAND_SYSEX
+        events.append(
+            packets.MIDIEvent(status, unknown=payload[start : start + chunk] + bytes([end_byte]))
+        )
+    return events
+
+
+class SysExAssembler(object):
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, timeout=DEFAULT_TIMEOUT):
+        """Creates a new SysExAssembler.
+
+        Messages longer than `max_size` bytes, or whose next segment takes
+        more than `timeout` seconds to arrive, are dropped.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+
+        # The message being reassembled, from its F0, or None.
+        self._buffer = None
+        # The `time.monotonic()` time its last segment arrived.
+        self._last_time = None
+        # True while skipping the segments of a dropped message.
+        self._dropping = False
+
+        # Counters.
+        self.completed = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        """True while a message is partly received."""
+        return self._buffer is not None
+
+    def feed(self, event, now):
+        """Takes a SysEx `packets.MIDIEvent` (status F0 or F7).
+
+        Returns the completed message, as a `MIDIEvent` with status F0 and
+        the data up to and including F7 in `unknown`, or None. A message
+        sent in segments is returned as a `memoryview`.
+        """
+        self.expire(now)
+        data = event.unknown
+        end_byte = data[-1]
+
+        if event.status == packets.COMMAND_SYSEX:
+            if self._buffer is not None:
+                self._drop('interrupted by a new message')
+            self._dropping = False
+            if end_byte == packets.COMMAND_SYSEX_END:
+                self.completed += 1
+                return event
+            self._buffer = bytearray()
+        elif self._buffer is None:
+            # The first segment was lost, or the message dropped.
+            if not self._dropping:
+                logger.debug('Ignoring SysEx segment without a start')
+            if end_byte != packets.COMMAND_SYSEX:
+                self._dropping = False
+            return None
+
+        if end_byte == packets.SYSEX_CANCEL:
+            self._buffer = None
+            self.cancelled += 1
+            return None
+
+        if len(self._buffer) + len(data) > self.max_size:
+            self._drop('longer than {} bytes'.format(self.max_size))
+            self._dropping = end_byte == packets.COMMAND_SYSEX
+            return None
+
+        if end_byte == packets.COMMAND_SYSEX:
+            self._buffer += data[:-1]
+            self._last_time = now
+            return None
+
+        self._buffer += data
+        buffer, self._buffer = self._buffer, None
+        self.completed += 1
+        return packets.MIDIEvent(
+            packets.COMMAND_SYSEX, delta_time=event.delta_time, unknown=memoryview(buffer)
+        )
+
+    def expire(self, now):
+        """Drops a partly received message whose next segment is overdue."""
+        if self._buffer is not None and now - self._last_time > self.timeout:
+            self._drop('timed out')
+            self._dropping = True
+
+    def abort(self):
+        """Drops a partly received message, for example after packet loss."""
+        if self._buffer is not None:
+            self._drop('aborted')
+            self._dropping = True
+
+    def _drop(self, reason):
+        logger.debug('Dropping SysEx message: {}'.format(reason))
+        self._buffer = None
+        self.dropped += 1
@@ -0,0 +1,201 @@
+import asyncio
+import socket
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from pymidi import aio, client, packets
+from pymidi.tests.packets_test import APPLEMIDI_INVITATION_PACKET, SINGLE_MIDI_PACKET
+
+
+class RecordingHandler(aio.Handler):
+    def __init__(self):
+        self.peers = []
+        self.commands = []
+        self.received = asyncio.Event()
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def on_peer_connected(self, peer):
+        self.peers.append(peer)
+        self.received.set()
+
+    async def on_midi_commands(self, peer, command_list):
+        await self.unblocked.wait()
+        self.commands.append(command_list)
+        self.received.set()
+
+
+class AioServerTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = aio.Server([('127.0.0.1', 0)], max_queue_size=2)
+        self.handler = RecordingHandler()
+        self.server.add_handler(self.handler)
+        await self.server.start()
+        ctrl_protocol, data_protocol = self.server.ipv4_protocols
+        self.ctrl_addr = ctrl_protocol.socket.get_extra_info('sockname')
+        self.data_addr = data_protocol.socket.get_extra_info('sockname')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        self.sock.close()
+
+    async def wait_for(self, predicate):
+        while not predicate():
+            self.handler.received.clear()
+            await asyncio.wait_for(self.handler.received.wait(), 1)
+
+    async def connect(self):
+        self.sock.sendto(APPLEMIDI_INVITATION_PACKET, self.ctrl_addr)
+        self.sock.sendto(APPLEMIDI_INVITATION_PACKET, self.data_addr)
+        await self.wait_for(lambda: self.handler.peers)
+
+    async def test_invitation_and_commands(self):
+        await self.connect()
+        self.assertEqual('mbook-session', self.handler.peers[0].name)
+        self.sock.sendto(SINGLE_MIDI_PACKET, self.data_addr)
+        await self.wait_for(lambda: self.handler.commands)
+        self.assertEqual('note_on', self.handler.commands[0][0].command)
+
+    async def test_data_protocol_options(self):
+        server = aio.Server(
+            [('127.0.0.1', 0)], data_protocol_options=dict(playout_delay=0.5), sync_interval=2
+        )
+        await server.start()
+        try:
+            self.assertEqual(0.5, server.ipv4_protocols[1].playout_delay)
+            self.assertEqual(2, server.ipv4_protocols[1].sync_interval)
+        finally:
+            server.close()
+
+    async def test_backpressure(self):
+        await self.connect()
+        self.handler.unblocked.clear()
+        for _ in range(10):
+            self.sock.sendto(SINGLE_MIDI_PACKET, self.data_addr)
+        while not self.server.reading_paused:
+            await asyncio.sleep(0.01)
+
+        self.handler.unblocked.set()
+        await self.wait_for(lambda: len(self.handler.commands) == 10)
+        self.assertFalse(self.server.reading_paused)
+
+
+class AioClientTests(IsolatedAsyncioTestCase):
+    async def test_connect_and_send(self):
+        server = aio.Server([('127.0.0.1', 0)])
+        handler = RecordingHandler()
+        server.add_handler(handler)
+        await server.start()
+        ctrl_protocol, data_protocol = server.ipv4_protocols
+        host, port = ctrl_protocol.socket.get_extra_info('sockname')
+
+        midi_client = aio.Client(name='aio-test')
+        try:
+            await midi_client.connect(host, port, timeout=1)
+            self.assertIn(midi_client.ssrc, ctrl_protocol.peers_by_ssrc)
+            self.assertIn(midi_client.ssrc, data_protocol.peers_by_ssrc)
+            midi_client.send_note_on('C3', velocity=99)
+            while not handler.commands:
+                handler.received.clear()
+                await asyncio.wait_for(handler.received.wait(), 1)
+            self.assertEqual('aio-test', handler.peers[0].name)
+            self.assertEqual(99, handler.commands[0][0].params.velocity)
+            with self.assertRaises(client.AlreadyConnected):
+                await midi_client.connect(host, port)
+        finally:
+            midi_client.close()
+            await asyncio.sleep(0.05)
+            self.assertNotIn(midi_client.ssrc, ctrl_protocol.peers_by_ssrc)
+            server.close()
+
+    async def test_clock_sync(self):
+        server = aio.Server([('127.0.0.1', 0)])
+        await server.start()
+        ctrl_protocol, data_protocol = server.ipv4_protocols
+        host, port = ctrl_protocol.socket.get_extra_info('sockname')
+
+        midi_client = aio.Client(sync_interval=None)
+        try:
+            await midi_client.connect(host, port, timeout=1)
+            self.assertTrue(await midi_client.sync_timestamps())
+            # Both ends read the same monotonic clock here.
+            self.assertLess(abs(midi_client.clock.offset), midi_client.clock.rtt + 1)
+            await asyncio.sleep(0.05)
+            peer = data_protocol.peers_by_ssrc[midi_client.ssrc]
+            self.assertEqual(1, peer.clock.exchanges)
+        finally:
+            midi_client.close()
+            server.close()
+
+    async def test_schedule(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET
+        )
+        try:
+            midi_client = aio.Client()
+            midi_client.socket = transport
+            midi_client.host, port = sock.getsockname()
+            midi_client.port = port - 1
+            at = time.monotonic() + 0.02
+            midi_client.schedule(packets.MIDIEvent(0x90, 60, 100), at=at + 0.02)
+            midi_client.schedule(packets.MIDIEvent(0x90, 62, 100), at=at)
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), 1)
+            self.assertGreaterEqual(time.monotonic(), at)
+            self.assertEqual(62, packets.decode_midi_packet(data).command.midi_list[0].data1)
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), 1)
+            self.assertEqual(60, packets.decode_midi_packet(data).command.midi_list[0].data1)
+            self.assertEqual(0, len(midi_client.scheduler))
+        finally:
+            midi_client.close()
+            transport.close()
+            sock.close()
+
+    async def test_batch_window_timer(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET
+        )
+        try:
+            midi_client = aio.Client(batch_window=0.005)
+            midi_client.socket = transport
+            midi_client.host, port = sock.getsockname()
+            midi_client.port = port - 1
+            midi_client.send_note_on('C3')
+            midi_client.send_note_off('C3')
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), 1)
+            self.assertEqual(2, len(packets.decode_midi_packet(data).command.midi_list))
+        finally:
+            transport.close()
+            sock.close()
+
+    async def test_connect_timeout(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        host, port = sock.getsockname()
+        try:
+            midi_client = aio.Client()
+            with self.assertRaises(client.InvitationTimeout):
+                await midi_client.connect(host, port, timeout=0.2, retry_interval=0.02)
+            self.assertIsNone(midi_client.host)
+
+            # Retried with backoff: nominally sent at 0, 20ms, 60ms and 140ms.
+            invitations = 0
+            while True:
+                try:
+                    sock.recvfrom(1024)
+                    invitations += 1
+                except BlockingIOError:
+                    break
+            self.assertGreaterEqual(invitations, 2)
+            self.assertLessEqual(invitations, 4)
+        finally:
+            sock.close()
@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi.bench import codec, format_result, loadgen
+from pymidi.bench.__main__ import compare
+
+
+def result(name, value, higher_is_better=True):
+    return dict(name=name, value=value, unit='ops/s', higher_is_better=higher_is_better)
+
+
+class BenchTests(TestCase):
+    def test_benchmarks_run(self):
+        for name, fn in codec.benchmarks():
+            fn()
+
+    def test_compare(self):
+        baseline = [result('a', 100), result('b', 100), result('c', 10, higher_is_better=False)]
+        results = [result('a', 85), result('b', 70), result('c', 13, higher_is_better=False)]
+        regressions = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(regressions[0].startswith('b: 70.0 ops/s (was 100.0, -30%)'))
+        self.assertTrue(regressions[1].startswith('c: '))
+        self.assertEqual([], compare([result('new', 1)], baseline, tolerance=0.2))
+
+    def test_format_result(self):
+        line = format_result(dict(result('a', 1.25), samples=3))
+        self.assertEqual(['a', '1.2', 'ops/s', 'samples=3'], line.split())
+
+
+class LoadgenTests(TestCase):
+    def sent_events(self):
+        events = []
+        for data in self.sent:
+            events.extend(packets.decode_midi_packet(data).command.midi_list)
+        del self.sent[:]
+        return events
+
+    def test_patterns(self):
+        peer = loadgen.VirtualPeer(pattern='mixed', burst=2, sysex_size=600, sync_interval=None)
+        # Packets are written to a reused buffer, so must be copied.
+        self.sent = []
+        peer.socket = mock.Mock()
+        peer.socket.sendto.side_effect = lambda data, addr: self.sent.append(bytes(data))
+        peer.host, peer.port = '127.0.0.1', 5004
+
+        peer.send_step(0)
+        self.assertEqual(
+            [(0x90, 36), (0x90, 37)], [(e.status, e.data1) for e in self.sent_events()]
+        )
+        peer.send_step(1)
+        self.assertEqual(
+            [(0xB0, 1, 2), (0xB0, 1, 3)],
+            [(e.status, e.data1, e.data2) for e in self.sent_events()],
+        )
+        peer.send_step(2)
+        segments = self.sent_events()
+        self.assertEqual(2, len(segments))
+        # The 599 bytes after the first F0, and the F0 ending the first segment.
+        self.assertEqual(600, sum(len(e.unknown) for e in segments))
+        self.assertEqual(3, peer.sends)
+        self.assertEqual(4, peer.packets_sent)
+        self.assertEqual(5, peer.events_sent)
+
+        self.assertEqual(4, peer.unacknowledged)
+        peer.acknowledge((peer.sequence_number - 1) & 0xFFFF)
+        self.assertEqual(1, peer.unacknowledged)
+
+    def test_local_run(self):
+        results = loadgen.run(local=True, peers=3, rate=20, duration=0.3, settle_time=0.3)
+        by_name = {result['name']: result for result in results}
+        self.assertEqual(3, by_name['loadgen.sends']['peers'])
+        self.assertEqual(3 * 6 * 4, by_name['loadgen.events']['sent'])
+        self.assertEqual(3, by_name['loadgen.events']['synced'])
+        self.assertEqual(0, by_name['loadgen.loss']['lost'])
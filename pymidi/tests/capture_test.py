@@ -0,0 +1,142 @@
+import io
+import struct
+from unittest import TestCase
+
+from pymidi import capture
+from pymidi import packets
+from pymidi.bench import replay
+from pymidi.server import Server
+
+
+def invitation(ssrc):
+    return packets.AppleMIDIExchangePacket.create(
+        protocol_version=2, command=b'IN', initiator_token=1, ssrc=ssrc, name='peer'
+    )
+
+
+def note_packet(ssrc, sequence_number, key):
+    writer = packets.MIDIPacketWriter(ssrc)
+    return bytes(writer.write_command(sequence_number, 0, 0x90, key, 100))
+
+
+class PcapTests(TestCase):
+    def test_round_trip(self):
+        f = io.BytesIO()
+        writer = capture.PcapWriter(f, snap_length=8)
+        writer.write(('10.0.0.1', 5004), ('10.0.0.2', 5051), b'hello', time_ns=1500000000123)
+        writer.write(('::1', 5004), ('::1', 5051), b'0123456789', time_ns=1600000000000)
+        writer.write(('10.0.0.1', 5004), ('::', 5051), b'mapped')
+        writer.close()
+        self.assertEqual(3, writer.count)
+
+        datagrams = list(capture.read_datagrams(io.BytesIO(f.getvalue())))
+        self.assertEqual(
+            capture.Datagram(1500000000123, ('10.0.0.1', 5004), ('10.0.0.2', 5051), b'hello'),
+            datagrams[0],
+        )
+        self.assertEqual(
+            capture.Datagram(1600000000000, ('::1', 5004), ('::1', 5051), b'01234567'),
+            datagrams[1],
+        )
+        self.assertEqual(('::ffff:10.0.0.1', 5004), datagrams[2].src)
+
+    def test_ipv4_checksum(self):
+        f = io.BytesIO()
+        capture.PcapWriter(f).write(('192.168.1.10', 1), ('192.168.1.20', 2), b'x' * 100)
+        ip = f.getvalue()[24 + 16 : 24 + 16 + 20]
+        total = sum(struct.unpack('!10H', ip))
+        self.assertEqual(0xFFFF, (total & 0xFFFF) + (total >> 16))
+
+    def test_pcapng_ethernet(self):
+        udp = struct.pack('!HHHH', 5004, 5051, 8 + 3, 0) + b'abc'
+        ip = struct.pack(
+            '!BBHHHBBH4s4s',
+            0x45,
+            0,
+            20 + len(udp),
+            0,
+            0,
+            64,
+            17,
+            0,
+            b'\x0a\0\0\x01',
+            b'\x0a\0\0\x02',
+        )
+        frame = b'\0' * 12 + b'\x08\x00' + ip + udp
+
+        def block(block_type, body):
+            body += b'\0' * (-len(body) % 4)
+            return (
+                struct.pack('<II', block_type, len(body) + 12)
+                + body
+                + struct.pack('<I', len(body) + 12)
+            )
+
+        section = block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+        # Nanosecond timestamps (if_tsresol 9).
+        options = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)
+        interface = block(1, struct.pack('<HHI', 1, 0, 65535) + options)
+        timestamp = 1234567890123456789
+        packet = block(
+            6,
+            struct.pack(
+                '<IIIII', 0, timestamp >> 32, timestamp & 0xFFFFFFFF, len(frame), len(frame)
+            )
+            + frame,
+        )
+        datagrams = list(capture.read_datagrams(io.BytesIO(section + interface + packet)))
+        self.assertEqual(
+            [capture.Datagram(timestamp, ('10.0.0.1', 5004), ('10.0.0.2', 5051), b'abc')],
+            datagrams,
+        )
+
+    def test_not_a_capture(self):
+        with self.assertRaises(ValueError):
+            list(capture.read_datagrams(io.BytesIO(b'not a capture at all')))
+
+
+class ServerCaptureTests(TestCase):
+    def test_capture_and_replay(self):
+        server = Server([('127.0.0.1', 0)])
+        f = io.BytesIO()
+        writer = server.start_capture(f)
+        server._init_protocols()
+        ctrl_protocol, data_protocol = server.ipv4_protocols
+        ctrl_addr = ctrl_protocol.socket.getsockname()
+        data_addr = data_protocol.socket.getsockname()
+        try:
+            ctrl_protocol.handle_message(invitation(1234), ('127.0.0.1', 9))
+            data_protocol.handle_message(invitation(1234), ('127.0.0.1', 10))
+            for i in range(3):
+                data_protocol.handle_message(note_packet(1234, i + 1, 60 + i), ('127.0.0.1', 10))
+        finally:
+            server.close()
+        self.assertIsNone(server.capture)
+
+        datagrams = list(capture.read_datagrams(io.BytesIO(f.getvalue())))
+        self.assertEqual(writer.count, len(datagrams))
+        self.assertEqual((('127.0.0.1', 9), ctrl_addr), datagrams[0][1:3])
+        self.assertEqual((ctrl_addr, ('127.0.0.1', 9)), datagrams[1][1:3])
+        self.assertEqual(b'\xff\xffOK', datagrams[1].data[:4])
+        self.assertEqual((('127.0.0.1', 10), data_addr), datagrams[2][1:3])
+
+        player = replay.Replay()
+        player.run(datagrams)
+        self.assertEqual(ctrl_addr[1], player.port)
+        self.assertEqual(5, player.datagrams)
+        self.assertEqual(3, player.events)
+        self.assertIn(1234, player.data_protocol.peers_by_ssrc)
+
+    def test_replay_realtime(self):
+        datagrams = [
+            capture.Datagram(0, ('127.0.0.1', 9), ('127.0.0.1', 5004), invitation(1)),
+            capture.Datagram(0, ('127.0.0.1', 10), ('127.0.0.1', 5005), invitation(1)),
+            capture.Datagram(
+                50000000, ('127.0.0.1', 10), ('127.0.0.1', 5005), note_packet(1, 1, 60)
+            ),
+            capture.Datagram(50000000, ('127.0.0.1', 10), ('127.0.0.1', 6000), b'ignored'),
+        ]
+        player = replay.Replay(port=5004)
+        self.assertGreaterEqual(player.run(datagrams, realtime=True), 0.05)
+        self.assertEqual(3, player.datagrams)
+        self.assertEqual(1, player.events)
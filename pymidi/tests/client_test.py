@@ -0,0 +1,184 @@
+import threading
+import time
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi.client import Client
+
+
+class ClientTests(TestCase):
+    def setUp(self):
+        self.client = Client(ssrc=1234)
+        self.client.socket = mock.Mock()
+        self.sent = []
+        # Outgoing packets are views of a reused buffer; copy them on send.
+        self.client.socket.sendto.side_effect = lambda data, addr: self.sent.append(
+            (bytes(data), addr)
+        )
+        self.client.host = '127.0.0.1'
+        self.client.port = 5004
+        self.client.sequence_number = 0xFFFF
+
+    def sent_packets(self):
+        result = []
+        for data, addr in self.sent:
+            self.assertEqual(('127.0.0.1', 5005), addr)
+            result.append(packets.decode_midi_packet(data))
+        return result
+
+    def test_send_single_commands(self):
+        self.client.send_note_on('C3', velocity=100)
+        self.client.send_note_off(60, velocity=0, channel=2)
+        self.client.send_aftertouch('C3', 20)
+        self.client.send_control_change(7, 127)
+        self.client.send_program_change(5)
+        self.client.send_pitch_bend(0x2001)
+
+        sent = self.sent_packets()
+        self.assertEqual([0, 1, 2, 3, 4, 5], [p.header.rtp_header.sequence_number for p in sent])
+        self.assertEqual(
+            [
+                packets.MIDIEvent(0x91, 48, 100),
+                packets.MIDIEvent(0x82, 60, 0),
+                packets.MIDIEvent(0xA1, 48, 20),
+                packets.MIDIEvent(0xB1, 7, 127),
+                packets.MIDIEvent(0xC1, 5),
+                packets.MIDIEvent(0xE1, 1, 0x40),
+            ],
+            [p.command.midi_list[0] for p in sent],
+        )
+        for pkt in sent:
+            self.assertEqual(1234, pkt.header.ssrc)
+
+    def test_send_commands(self):
+        events = [packets.MIDIEvent(0x90, i % 128, 100, delta_time=5) for i in range(400)]
+        self.client.send_commands(events, timestamp=1000)
+
+        sent = self.sent_packets()
+        self.assertEqual(2, len(sent))
+        first, second = sent
+        self.assertEqual(True, first.command.flags.b)
+        self.assertEqual(1000, first.header.timestamp)
+        count = len(first.command.midi_list)
+        self.assertEqual(1000 + 5 * count, second.header.timestamp)
+        self.assertEqual(400, count + len(second.command.midi_list))
+        self.assertEqual(
+            [e.data1 for e in events], [e.data1 for p in sent for e in p.command.midi_list]
+        )
+
+    def test_send_commands_from_threads(self):
+        events = [packets.MIDIEvent(0x90, 60, 100, delta_time=5)] * 300
+        threads = [
+            threading.Thread(target=self.client.send_commands, args=(events,)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sent = self.sent_packets()
+        self.assertEqual(
+            list(range(len(sent))), sorted(p.header.rtp_header.sequence_number for p in sent)
+        )
+        self.assertEqual(1200, sum(len(p.command.midi_list) for p in sent))
+
+    def test_poll_skipped_while_polling(self):
+        self.client._next_poll = 0
+        self.client._next_sync = 0
+        with mock.patch.object(self.client, '_poll') as poll:
+            with self.client._poll_lock:
+                self.client.send_note_on('C3')
+            poll.assert_not_called()
+            self.client.send_note_on('C3')
+            poll.assert_called_once_with()
+
+    def test_batch(self):
+        with self.client.batch():
+            self.client.send_note_on('C3')
+            self.client.send_note_on('E3')
+            self.client.send_note_on('G3')
+            self.assertEqual([], self.sent)
+        sent = self.sent_packets()
+        self.assertEqual(1, len(sent))
+        self.assertEqual([48, 52, 55], [e.data1 for e in sent[0].command.midi_list])
+
+    def test_batch_window(self):
+        self.client.batch_window = 0.01
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.client.send_note_on('C3')
+            self.client.send_note_on('E3')
+        self.assertEqual([], self.sent)
+        with mock.patch('time.monotonic', return_value=100.02):
+            self.client.send_note_on('G3')
+        sent = self.sent_packets()
+        self.assertEqual(1, len(sent))
+        self.assertEqual(1000000, sent[0].header.timestamp)
+        self.assertEqual([None, 0, 200], [e.delta_time for e in sent[0].command.midi_list])
+
+    def test_batch_window_timer(self):
+        self.client.batch_window = 0.005
+        self.client.send_note_on('C3')
+        self.client.send_note_off('C3')
+        deadline = time.time() + 5
+        while not self.sent and time.time() < deadline:
+            time.sleep(0.01)
+        sent = self.sent_packets()
+        self.assertEqual(1, len(sent))
+        self.assertEqual(2, len(sent[0].command.midi_list))
+        self.assertIsNone(self.client._flush_timer)
+
+    def test_recovery_journal(self):
+        self.client.send_note_on('C3', velocity=100)
+        self.client.send_note_off('C3')
+        first, second = self.sent_packets()
+        self.assertIsNone(first.journal)
+        self.assertEqual(0, second.journal.checkpoint_seqnum)
+        self.assertTrue(second.journal.channel_journal.header.n)
+
+        self.client.acknowledge(1)
+        self.client.send_note_on('C3')
+        self.assertIsNone(self.sent_packets()[2].journal)
+
+    def test_recovery_journal_is_bounded(self):
+        for channel in range(16):
+            for controller in range(120):
+                self.client.send_control_change(controller, 1, channel=channel)
+        for data, _ in self.sent:
+            self.assertLessEqual(len(data), 12 + 4 + self.client.journal.max_size)
+        self.assertLessEqual(len(self.client.journal.encode()), self.client.journal.max_size)
+
+    def test_recovery_journal_disabled(self):
+        client = Client(ssrc=1234, recovery_journal=False)
+        client.socket = self.client.socket
+        client.host, client.port = self.client.host, self.client.port
+        client.send_note_on('C3')
+        client.send_note_on('D3')
+        self.assertIsNone(self.sent_packets()[1].journal)
+
+    def test_clock_sync(self):
+        self.client.handle_command(
+            packets.AppleMIDITimestampPacket.create(
+                command=b'CK', ssrc=5678, count=0, timestamp_1=1000, timestamp_2=0, timestamp_3=0
+            )
+        )
+        with mock.patch('pymidi.clock.timestamp', return_value=1040):
+            self.client.handle_command(
+                packets.AppleMIDITimestampPacket.create(
+                    command=b'CK',
+                    ssrc=5678,
+                    count=1,
+                    timestamp_1=1000,
+                    timestamp_2=5020,
+                    timestamp_3=0,
+                )
+            )
+        reply, final = [packets.AppleMIDITimestampPacket.parse(data) for data, _ in self.sent]
+        self.assertEqual((1, 1000), (reply.count, reply.timestamp_1))
+        self.assertEqual(
+            (2, 1000, 5020, 1040),
+            tuple(final[k] for k in ('count', 'timestamp_1', 'timestamp_2', 'timestamp_3')),
+        )
+        self.assertEqual(('127.0.0.1', 5005), self.sent[1][1])
+        self.assertEqual((4000, 40), (self.client.clock.offset, self.client.clock.rtt))
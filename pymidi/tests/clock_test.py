@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi.clock import ClockEstimator
+from pymidi.protocol import DataProtocol
+
+
+class LoopbackSocket(object):
+    """Delivers everything sent straight to another protocol."""
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.target = None
+
+    def sendto(self, data, addr):
+        self.target.handle_message(bytes(data), self.addr)
+
+
+class ClockEstimatorTests(TestCase):
+    def test_initiator(self):
+        clock = ClockEstimator()
+        # The remote clock is 1000 ahead; 20 each way.
+        clock.add_exchange(100, 1120, 140, initiator=True)
+        self.assertEqual(1000, clock.offset)
+        self.assertEqual(40, clock.rtt)
+        self.assertEqual(0.002, clock.latency)
+        self.assertEqual(2000, clock.to_remote(1000))
+        self.assertEqual(1000, clock.to_local(2000))
+
+    def test_responder(self):
+        clock = ClockEstimator()
+        clock.add_exchange(100, 1120, 140, initiator=False)
+        self.assertEqual(-1000, clock.offset)
+
+    def test_min_rtt(self):
+        clock = ClockEstimator(window=2)
+        clock.add_exchange(0, 1030, 40, initiator=True)
+        clock.add_exchange(100, 1200, 300, initiator=True)
+        self.assertEqual((1010, 40), (clock.offset, clock.rtt))
+        clock.add_exchange(400, 1420, 440, initiator=True)
+        clock.add_exchange(500, 1600, 700, initiator=True)
+        self.assertEqual((1000, 40), (clock.offset, clock.rtt))
+
+    def test_ignores_negative_rtt(self):
+        clock = ClockEstimator()
+        clock.add_exchange(100, 1000, 50, initiator=True)
+        self.assertIsNone(clock.offset)
+        self.assertIsNone(clock.latency)
+
+
+class ClockSyncTests(TestCase):
+    def setUp(self):
+        self.a_socket = LoopbackSocket(('127.0.0.1', 5005))
+        self.b_socket = LoopbackSocket(('127.0.0.1', 6005))
+        self.a = DataProtocol(self.a_socket, ssrc=1, sync_interval=10, playout_delay=0.01)
+        self.b = DataProtocol(self.b_socket, ssrc=2)
+        self.a_socket.target, self.b_socket.target = self.b, self.a
+        self.a_peer = self.a._connect_peer('b', self.b_socket.addr, 2)
+        self.b_peer = self.b._connect_peer('a', self.a_socket.addr, 1)
+
+    def test_exchange(self):
+        # The initiator's clock reads 1000 when the responder's reads 5000.
+        times = iter([5010, 1020, 5030])
+        with mock.patch('pymidi.clock.timestamp', side_effect=lambda: next(times)):
+            self.a.send_timestamp(self.a_peer, timestamp_1=1000)
+        self.assertEqual((4000, 20), (self.a_peer.clock.offset, self.a_peer.clock.rtt))
+        self.assertEqual((-4000, 20), (self.b_peer.clock.offset, self.b_peer.clock.rtt))
+        self.assertEqual(-0.4, self.a_peer.jitter.clock_offset)
+
+    def test_scheduled(self):
+        self.a.on_timer(100)
+        self.a.on_timer(105)
+        self.assertEqual(1, self.a_peer.clock.exchanges)
+        self.a.on_timer(110)
+        self.assertEqual(2, self.a_peer.clock.exchanges)
+        self.assertEqual(2, self.b_peer.clock.exchanges)
+
+    def test_not_scheduled(self):
+        self.b.on_timer(100)
+        self.assertEqual(0, self.a_peer.clock.exchanges)
+
+    def test_unknown_peer(self):
+        protocol = DataProtocol(mock.Mock())
+        data = packets.AppleMIDITimestampPacket.build(
+            dict(command=b'CK', count=1, ssrc=3, timestamp_1=1, timestamp_2=2, timestamp_3=0)
+        )
+        protocol.handle_message(data, ('127.0.0.1', 5005))
+        protocol.socket.sendto.assert_not_called()
@@ -0,0 +1,254 @@
+import random
+from unittest import TestCase
+
+from construct import ConstructError
+
+from pymidi import packets
+from pymidi.tests.packets_test import (
+    CONTROL_MODE_CHANGE_PACKET,
+    MULTI_MIDI_PACKET,
+    SINGLE_MIDI_PACKET,
+)
+from pymidi.utils import h2b
+
+NO_JOURNAL_PACKET = h2b('806142a0550d8a5a47d8109603903446')
+
+FIXTURES = [
+    SINGLE_MIDI_PACKET,
+    MULTI_MIDI_PACKET,
+    CONTROL_MODE_CHANGE_PACKET,
+    NO_JOURNAL_PACKET,
+]
+
+FUZZ_SEED = 6295
+FUZZ_ITERATIONS = 3000
+
+
+def key(event, delta_time):
+    return (delta_time, event.command_byte, event.command, event.channel, event.params)
+
+
+def normalize(packet):
+    """Replaces the MIDI list of `packet` with comparable tuples.
+
+    Real-time commands found among a command's data bytes (its `realtime`
+    field, in the schema) are listed before it, as `decode_midi_packet()`
+    returns them.
+    """
+    midi_list = []
+    for e in packet.command.midi_list:
+        delta_time = e.delta_time
+        for status in getattr(e, 'realtime', None) or ():
+            midi_list.append(key(packets.MIDIEvent(status), delta_time))
+            delta_time = 0
+        midi_list.append(key(e, delta_time))
+    packet.command.midi_list = midi_list
+    return packet
+
+
+def reference_decode(data):
+    try:
+        return normalize(packets.MIDIPacket.parse(data))
+    except ConstructError:
+        return ConstructError
+
+
+def fast_decode(data):
+    try:
+        return normalize(packets.decode_midi_packet(data))
+    except ConstructError:
+        return ConstructError
+
+
+def random_data_byte(rng):
+    """Returns a data byte, or occasionally a real-time or other status byte."""
+    if rng.random() < 0.1:
+        return rng.choice([0xF8, 0xFE, 0xFF, 0x90, 0xF7])
+    return rng.randint(0, 0x7F)
+
+
+def random_midi_list(rng):
+    """Returns a plausible MIDI list, with running status and unusual commands."""
+    out = bytearray()
+    for i in range(rng.randint(0, 6)):
+        if i > 0:
+            out.append(rng.choice([0x00, 0x0A, 0x7F, 0x81, 0xFF]))
+            if out[-1] & 0x80:
+                out.append(rng.randint(0, 0x7F))
+        if i == 0 or rng.random() < 0.7:
+            status = rng.randint(0x80, 0xFF)
+            out.append(status)
+        length = rng.choice([2, 2, 1, 0, rng.randint(0, 6)])
+        out += bytes(random_data_byte(rng) for _ in range(length))
+        if status in (0xF0, 0xF7) and rng.random() < 0.8:
+            out.append(rng.choice([0xF0, 0xF4, 0xF7]))
+    return bytes(out)
+
+
+def random_journal(rng):
+    out = bytearray([rng.randint(0, 0xFF) & 0xE3, rng.randint(0, 0xFF), rng.randint(0, 0xFF)])
+    if out[0] & 0x40:
+        length = rng.randint(0, 8)
+        out += bytes([rng.randint(0, 0xFF) & 0xFC, length]) + bytes(rng.randint(0, 8))
+    if out[0] & 0x20:
+        for _ in range((out[0] & 0x0F) + 1):
+            length = rng.randint(0, 10)
+            out += bytes([rng.randint(0, 0xFF) & 0xFC, length, rng.randint(0, 0xFF)])
+            out += bytes(rng.randint(0, 10))
+    return bytes(out)
+
+
+def random_midi_packet(rng):
+    midi_list = random_midi_list(rng)
+    length = len(midi_list) + rng.randint(-2, 2)
+    length = max(length, 0)
+    flags = rng.randint(0, 0x3) << 5
+    if length > 15 or rng.random() < 0.2:
+        command_header = bytes([0x80 | flags | (length >> 8), length & 0xFF])
+    else:
+        command_header = bytes([flags | length])
+    journal = random_journal(rng) if flags & 0x40 else b''
+    return SINGLE_MIDI_PACKET[:12] + command_header + midi_list + journal
+
+
+def mutate(rng, data):
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        op = rng.randint(0, 2)
+        if op == 0 and data:
+            data[rng.randrange(len(data))] = rng.randint(0, 0xFF)
+        elif op == 1 and data:
+            del data[rng.randrange(len(data)) :]
+        else:
+            data.insert(rng.randint(0, len(data)), rng.randint(0, 0xFF))
+    return bytes(data)
+
+
+class TestDecoder(TestCase):
+    def assertEquivalent(self, data):
+        expected = reference_decode(data)
+        actual = fast_decode(data)
+        self.assertEqual(expected, actual, 'Decoders disagree on {}'.format(data.hex()))
+        if expected is not ConstructError:
+            self.assertEqual(
+                packets.to_string(packets.MIDIPacket.parse(data)),
+                packets.to_string(packets.decode_midi_packet(data)),
+            )
+
+    def test_fixtures(self):
+        for data in FIXTURES:
+            self.assertEquivalent(data)
+
+    def test_accepts_buffers(self):
+        expected = fast_decode(MULTI_MIDI_PACKET)
+        self.assertEqual(expected, fast_decode(bytearray(MULTI_MIDI_PACKET)))
+        self.assertEqual(expected, fast_decode(memoryview(MULTI_MIDI_PACKET)))
+
+    def test_truncated_fixtures(self):
+        for data in FIXTURES:
+            for i in range(len(data)):
+                self.assertEquivalent(data[:i])
+
+    def test_midi_event(self):
+        pkt = packets.decode_midi_packet(MULTI_MIDI_PACKET)
+        first, second = pkt.command.midi_list
+        self.assertEqual(packets.MIDIEvent(0x90, 62, 49), first)
+        self.assertEqual(packets.MIDIEvent(0x90, 64, 59, delta_time=10), second)
+        self.assertEqual('note_on', second.command)
+        self.assertEqual(0, second.channel)
+        self.assertEqual('E4', second.params.key)
+        self.assertEqual(59, second.params.velocity)
+        self.assertEqual('note_on', second['command'])
+        with self.assertRaises(AttributeError):
+            second.velocity = 1
+
+        pkt = packets.decode_midi_packet(CONTROL_MODE_CHANGE_PACKET)
+        event = pkt.command.midi_list[0]
+        self.assertEqual('control_mode_change', event.command)
+        self.assertEqual(108, event.params.controller)
+        self.assertEqual(0, event.params.value)
+
+    def test_all_commands(self):
+        midi_list = h2b(
+            'c305'  # program change
+            '00d17f'  # channel pressure
+            '00e20140'  # pitch bend
+            '000100'  # running status: pitch bend
+            '00f0 7e7f 0901 f7'  # system exclusive
+            '00f1 23'  # time code
+            '00f2 0102'  # song position
+            '00f3 04'  # song select
+            '00f6'  # tune request
+            '00f8'  # timing clock
+            '00fa'  # start
+            '00f5'  # undefined
+            '0a903c fe 40'  # real-time in a note on
+            '00f0 01 f8 02 f0'  # ...and in a sysex segment
+            '00f7 03f7'  # last segment
+            '003e40'  # no running status after system common
+        )
+        data = SINGLE_MIDI_PACKET[:12] + bytes(
+            [0x80 | (len(midi_list) >> 8), len(midi_list) & 0xFF]
+        )
+        self.assertEquivalent(data + midi_list)
+        events = packets.decode_midi_packet(data + midi_list).command.midi_list
+        self.assertEqual(
+            [
+                packets.MIDIEvent(0xC3, 5),
+                packets.MIDIEvent(0xD1, 127, delta_time=0),
+                packets.MIDIEvent(0xE2, 1, 0x40, 0),
+                packets.MIDIEvent(0xE2, 1, 0, 0),
+                packets.MIDIEvent(0xF0, delta_time=0, unknown=h2b('7e7f0901f7')),
+                packets.MIDIEvent(0xF1, 0x23, delta_time=0),
+                packets.MIDIEvent(0xF2, 1, 2, 0),
+                packets.MIDIEvent(0xF3, 4, delta_time=0),
+                packets.MIDIEvent(0xF6, delta_time=0),
+                packets.MIDIEvent(0xF8, delta_time=0),
+                packets.MIDIEvent(0xFA, delta_time=0),
+                packets.MIDIEvent(0xF5, delta_time=0),
+                packets.MIDIEvent(0xFE, delta_time=10),
+                packets.MIDIEvent(0x90, 60, 64, 0),
+                packets.MIDIEvent(0xF8, delta_time=0),
+                packets.MIDIEvent(0xF0, delta_time=0, unknown=h2b('0102f0')),
+                packets.MIDIEvent(0xF7, delta_time=0, unknown=h2b('03f7')),
+            ],
+            events,
+        )
+        self.assertEqual(
+            ['program_change', 'channel_pressure', 'pitch_bend', 'pitch_bend', 'sysex'],
+            [e.command for e in events[:5]],
+        )
+        self.assertEqual(3, events[0].channel)
+        self.assertIsNone(events[4].channel)
+        self.assertEqual(0x2001, events[2].params.value)
+        self.assertEqual(0x101, events[6].params.value)
+        self.assertEqual(h2b('7e7f0901f7'), events[4].params.data)
+        self.assertEqual('sysex_continue', events[-1].command)
+
+    def test_interrupted_command(self):
+        # A status byte other than real-time cuts a command short.
+        data = SINGLE_MIDI_PACKET[:12] + h2b('05 903c b007 00')
+        self.assertEquivalent(data)
+        self.assertEqual([], packets.decode_midi_packet(data).command.midi_list)
+
+    def test_malformed(self):
+        with self.assertRaises(ConstructError):
+            packets.decode_midi_packet(b'')
+        with self.assertRaises(ConstructError):
+            packets.decode_midi_packet(SINGLE_MIDI_PACKET[:14])
+
+    def test_fuzz_mutated_fixtures(self):
+        rng = random.Random(FUZZ_SEED)
+        for _ in range(FUZZ_ITERATIONS):
+            self.assertEquivalent(mutate(rng, rng.choice(FIXTURES)))
+
+    def test_fuzz_generated_packets(self):
+        rng = random.Random(FUZZ_SEED)
+        for _ in range(FUZZ_ITERATIONS):
+            self.assertEquivalent(random_midi_packet(rng))
+
+    def test_fuzz_random_bytes(self):
+        rng = random.Random(FUZZ_SEED)
+        for _ in range(FUZZ_ITERATIONS):
+            data = bytes(rng.randint(0, 0xFF) for _ in range(rng.randint(0, 40)))
+            self.assertEquivalent(data)
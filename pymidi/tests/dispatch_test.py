@@ -0,0 +1,137 @@
+import threading
+import time
+from unittest import TestCase
+
+from pymidi import dispatch
+from pymidi.protocol import Peer
+from pymidi.server import Handler, Server
+
+
+class ThreadPoolDispatcherTests(TestCase):
+    def setUp(self):
+        self.dispatchers = []
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.close()
+
+    def make_dispatcher(self, **kwargs):
+        dispatcher = dispatch.ThreadPoolDispatcher(**kwargs)
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def wait_idle(self, dispatcher):
+        for _ in range(500):
+            stats = dispatcher.stats()
+            if stats['queue_depth'] == 0 and stats['peers'] == 0:
+                return stats
+            time.sleep(0.01)
+        self.fail('Dispatcher did not go idle')
+
+    def test_per_key_ordering(self):
+        dispatcher = self.make_dispatcher(num_threads=4)
+        results = {key: [] for key in range(5)}
+        for i in range(200):
+            for key in results:
+                dispatcher.submit(key, results[key].append, i)
+        stats = self.wait_idle(dispatcher)
+        for key in results:
+            self.assertEqual(list(range(200)), results[key])
+        self.assertEqual(1000, stats['processed'])
+        self.assertEqual(0, stats['dropped'])
+
+    def test_slow_key_does_not_block_others(self):
+        dispatcher = self.make_dispatcher(num_threads=2)
+        release = threading.Event()
+        done = threading.Event()
+        dispatcher.submit('slow', release.wait)
+        dispatcher.submit('fast', done.set)
+        self.assertTrue(done.wait(1))
+        release.set()
+
+    def block_key(self, dispatcher, key):
+        """Occupies `key` until the returned event is set."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait()
+
+        dispatcher.submit(key, blocker)
+        started.wait()
+        return release
+
+    def test_drop_newest(self):
+        dispatcher = self.make_dispatcher(max_queue_size=2, overflow='drop_newest')
+        results = []
+        release = self.block_key(dispatcher, 1)
+        accepted = [dispatcher.submit(1, results.append, i) for i in range(4)]
+        self.assertEqual([True, True, False, False], accepted)
+        release.set()
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual([0, 1], results)
+        self.assertEqual(2, stats['dropped'])
+        self.assertEqual(2, stats['max_queue_depth'])
+
+    def test_drop_oldest(self):
+        dispatcher = self.make_dispatcher(max_queue_size=2, overflow='drop_oldest')
+        results = []
+        release = self.block_key(dispatcher, 1)
+        dispatcher.submit(1, results.append, 'connect', droppable=False)
+        for i in range(4):
+            dispatcher.submit(1, results.append, i)
+        release.set()
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual(['connect', 3], results)
+        self.assertEqual(3, stats['dropped'])
+
+    def test_block(self):
+        dispatcher = self.make_dispatcher(max_queue_size=1, overflow='block')
+        results = []
+        release = self.block_key(dispatcher, 1)
+        dispatcher.submit(1, results.append, 0)
+        submitter = threading.Thread(target=dispatcher.submit, args=(1, results.append, 1))
+        submitter.start()
+        submitter.join(0.1)
+        self.assertTrue(submitter.is_alive(), 'Expected submit() to block')
+        release.set()
+        submitter.join(1)
+        self.wait_idle(dispatcher)
+        self.assertEqual([0, 1], results)
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            dispatch.ThreadPoolDispatcher(overflow='explode')
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+
+    def on_peer_connected(self, peer):
+        self.calls.append(('connected', peer.ssrc))
+
+    def on_midi_commands(self, peer, command_list):
+        self.threads.add(threading.current_thread().name)
+        self.calls.append(('commands', command_list))
+
+
+class ServerDispatchTests(TestCase):
+    def test_server_dispatcher(self):
+        dispatcher = dispatch.ThreadPoolDispatcher(num_threads=2)
+        server = Server([('127.0.0.1', 0)], dispatcher=dispatcher)
+        handler = RecordingHandler()
+        server.add_handler(handler)
+        peer = Peer('test', None, 1234)
+        server._peer_connected_cb(peer)
+        for i in range(10):
+            server._dispatch('on_midi_commands', peer, [i])
+        server.close()
+        self.assertFalse(dispatcher.closed)
+        dispatcher.close()
+        self.assertEqual(
+            [('connected', 1234)] + [('commands', [i]) for i in range(10)], handler.calls
+        )
+        self.assertTrue(all(t.startswith('pymidi-dispatch-') for t in handler.threads))
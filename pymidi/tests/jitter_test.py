@@ -0,0 +1,128 @@
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi.jitter import JitterBuffer
+from pymidi.protocol import DataProtocol
+from pymidi.server import TIMER_INTERVAL, Server
+
+
+def make_packet(seqnum, timestamp, note=60):
+    writer = packets.MIDIPacketWriter(1234)
+    data = writer.write_command(seqnum, timestamp, packets.COMMAND_NOTE_ON, note, 100)
+    return packets.decode_midi_packet(bytes(data))
+
+
+def seqnums(released):
+    return [p.header.rtp_header.sequence_number for p in released]
+
+
+class JitterBufferTests(TestCase):
+    def setUp(self):
+        # Remote RTP time 0 is local time 100.
+        self.buffer = JitterBuffer(playout_delay=0.01, clock_offset=100.0)
+
+    def test_playout_delay(self):
+        self.buffer.push(make_packet(1, 0), now=100.001)
+        self.assertEqual(100.01, self.buffer.next_deadline())
+        self.assertEqual([], self.buffer.pop(100.005))
+        self.assertEqual([1], seqnums(self.buffer.pop(100.01)))
+        self.assertIsNone(self.buffer.next_deadline())
+
+    def test_reorder(self):
+        for seqnum in (1, 3, 2):
+            self.buffer.push(make_packet(seqnum, seqnum * 10), now=100.002)
+        self.assertEqual([1, 2, 3], seqnums(self.buffer.pop(101)))
+        self.assertEqual(1, self.buffer.reordered)
+        self.assertEqual(0, self.buffer.lost)
+
+    def test_wraparound(self):
+        for seqnum in (0xFFFE, 0x0000, 0xFFFF, 0x0001):
+            self.buffer.push(make_packet(seqnum, 0), now=100)
+        self.assertEqual([0xFFFE, 0xFFFF, 0x0000, 0x0001], seqnums(self.buffer.pop(101)))
+
+    def test_timestamp_wraparound(self):
+        buffer = JitterBuffer(playout_delay=0.01)
+        buffer.push(make_packet(1, 0xFFFFFFFF - 9), now=50)
+        buffer.push(make_packet(2, 10), now=50.002)
+        self.assertEqual([1], seqnums(buffer.pop(50.01)))
+        self.assertEqual([2], seqnums(buffer.pop(50.012)))
+
+    def test_duplicate_and_late(self):
+        self.buffer.push(make_packet(1, 0), now=100)
+        self.assertFalse(self.buffer.push(make_packet(1, 0), now=100))
+        self.buffer.push(make_packet(3, 20), now=100)
+        self.assertEqual([1, 3], seqnums(self.buffer.pop(101)))
+        self.assertEqual(1, self.buffer.lost)
+
+        self.assertFalse(self.buffer.push(make_packet(3, 20), now=101))
+        self.assertFalse(self.buffer.push(make_packet(2, 10), now=101))
+        self.assertEqual((2, 1), (self.buffer.duplicate, self.buffer.late))
+
+    def test_missing_packet_waits_for_next(self):
+        self.buffer.push(make_packet(1, 0), now=100)
+        self.buffer.push(make_packet(3, 100), now=100.011)
+        self.assertEqual([1], seqnums(self.buffer.pop(100.015)))
+        # Packet 2 is waited for until packet 3 is due.
+        self.assertEqual([], self.buffer.pop(100.019))
+        self.assertEqual([3], seqnums(self.buffer.pop(100.021)))
+        self.assertEqual(1, self.buffer.lost)
+
+    def test_estimated_offset(self):
+        buffer = JitterBuffer(playout_delay=0.01)
+        buffer.push(make_packet(1, 0), now=100.005)
+        buffer.push(make_packet(2, 100), now=100.011)
+        self.assertAlmostEqual(100.001, buffer.estimated_offset())
+
+    def test_max_packets(self):
+        buffer = JitterBuffer(playout_delay=10, clock_offset=0, max_packets=2)
+        for seqnum in range(3):
+            buffer.push(make_packet(seqnum, 0), now=0)
+        self.assertEqual(float('-inf'), buffer.next_deadline())
+        self.assertEqual([0], seqnums(buffer.pop(0)))
+
+
+class DataProtocolJitterTests(TestCase):
+    def setUp(self):
+        self.delivered = []
+        self.protocol = DataProtocol(
+            mock.Mock(),
+            playout_delay=0.01,
+            midi_command_cb=lambda peer, pkt: self.delivered.append(pkt),
+        )
+        self.peer = self.protocol._connect_peer('client', ('127.0.0.1', 5006), 1234)
+        self.peer.jitter.clock_offset = 100.0
+
+    def send(self, seqnum, timestamp, now):
+        writer = packets.MIDIPacketWriter(1234)
+        data = bytes(writer.write_command(seqnum, timestamp, packets.COMMAND_NOTE_ON, 60, 100))
+        with mock.patch('time.monotonic', return_value=now):
+            self.protocol.handle_message(data, ('127.0.0.1', 5006))
+
+    def test_jitter_buffer(self):
+        self.send(2, 10, now=100.002)
+        self.send(1, 0, now=100.003)
+        self.assertEqual([], self.delivered)
+        self.assertAlmostEqual(100.01, self.protocol.next_deadline())
+        self.protocol.on_timer(100.02)
+        self.assertEqual([1, 2], [p.header.rtp_header.sequence_number for p in self.delivered])
+        # Packets reach recovery in order, so nothing is counted as late.
+        self.assertEqual(0, self.peer.recovery.late)
+
+    def test_late_packet_dropped(self):
+        self.send(1, 0, now=100)
+        self.send(2, 10, now=100.05)
+        self.send(1, 0, now=100.06)
+        self.assertEqual(2, len(self.delivered))
+        self.assertEqual(1, self.peer.jitter.duplicate)
+
+    def test_server_timeout(self):
+        server = Server([('127.0.0.1', 0)])
+        server.socket_map = {mock.Mock(): self.protocol}
+        server._run_timers(now=100)
+        self.assertAlmostEqual(TIMER_INTERVAL, server._timer_timeout(100))
+        self.send(1, 0, now=100)
+        self.assertAlmostEqual(0.01, server._timer_timeout(100))
+        server._run_timers(now=100.01)
+        self.assertEqual(1, len(self.delivered))
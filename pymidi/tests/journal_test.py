@@ -0,0 +1,440 @@
+import socket
+from unittest import TestCase
+
+import mock
+from construct import StreamError
+
+from pymidi import packets
+from pymidi.client import Client
+from pymidi.journal import (
+    RecoveryJournal,
+    parse_channel_chapters,
+    parse_system_chapters,
+    seq_after,
+)
+from pymidi.protocol import ControlProtocol, DataProtocol
+
+
+def parse(data):
+    return packets.MIDIPacketJournal.parse(data)
+
+
+def channel_journal(chan, toc, data):
+    length = 3 + len(data)
+    header = bytes([(chan << 3) | (length >> 8), length & 0xFF, toc])
+    return packets.MIDIChapterJournal.parse(header + data)
+
+
+def system_journal(flags, data):
+    length = 2 + len(data)
+    return packets.MIDISystemJournal.parse(bytes([flags | (length >> 8), length & 0xFF]) + data)
+
+
+# Chapters M (P=1, one log with ENTRY-MSB, A-BUTTON and COUNT), E, T and A.
+CHAPTER_M = b'\x40\x0a\x85' + b'\x06\x00\xa8\x40\x80\x05\x03'
+CHAPTER_E = b'\x00\x3c\x85'
+CHAPTER_T = b'\x85'
+CHAPTER_A = b'\x01\x3c\x10\x3e\x90'
+
+# Chapters D (reset, song select and an undefined 0xF9 log), V, Q (clock and
+# timetools), F (complete) and X.
+CHAPTER_D = b'\x52\x03\x85\x02\x01'
+CHAPTER_V = b'\x07'
+CHAPTER_Q = b'\x19\x00\x10\x00\x01\x02'
+CHAPTER_F = b'\x42\x01\x02\x03\x04'
+CHAPTER_X = b'\x40\x01\x02'
+
+
+class RecoveryJournalTests(TestCase):
+    def setUp(self):
+        self.journal = RecoveryJournal()
+
+    def test_empty(self):
+        self.assertIsNone(self.journal.encode())
+        self.assertFalse(self.journal)
+
+    def test_note_on(self):
+        self.journal.record(100, 0x90, 60, 37)
+        journal = parse(self.journal.encode())
+        self.assertTrue(journal.header.a)
+        self.assertEqual(0, journal.header.totchan)
+        self.assertEqual(100, journal.checkpoint_seqnum)
+        chapter = journal.channel_journal
+        self.assertEqual(0, chapter.header.chan)
+        self.assertTrue(chapter.header.n)
+        self.assertFalse(chapter.header.c)
+        # LEN=1, LOW=1 > HIGH=0 (no OFFBITS), note 60 with Y=1.
+        self.assertEqual(b'\x01\x10\x3c\xa5', chapter.journal)
+
+    def test_note_off(self):
+        self.journal.record(100, 0x90, 60, 37)
+        self.journal.record(101, 0x80, 60, 0)
+        self.journal.record(102, 0x90, 62, 0)
+        chapter = parse(self.journal.encode()).channel_journal
+        # No logs; LOW=HIGH=7, with bits for notes 60 and 62.
+        self.assertEqual(b'\x00\x77\x0a', chapter.journal)
+
+    def test_chapters(self):
+        self.journal.record(1, 0xB3, 0, 2)
+        self.journal.record(2, 0xC3, 5)
+        self.journal.record(3, 0xB3, 7, 100)
+        self.journal.record(4, 0xE3, 0x01, 0x40)
+        chapter = parse(self.journal.encode()).channel_journal
+        self.assertEqual(3, chapter.header.chan)
+        self.assertEqual((True, True, True, False), tuple(chapter.header[k] for k in 'pcwn'))
+        self.assertEqual(
+            b'\x05\x82\x00' + b'\x01\x00\x02\x07\x64' + b'\x01\x40',
+            chapter.journal,
+        )
+
+    def test_multiple_channels(self):
+        self.journal.record(1, 0x90, 60, 1)
+        self.journal.record(1, 0x9F, 60, 1)
+        data = self.journal.encode()
+        journal = parse(data)
+        self.assertEqual(1, journal.header.totchan)
+        self.assertEqual(3 + 2 * 7, len(data))
+
+    def test_acknowledge(self):
+        self.journal.record(0xFFFE, 0x90, 60, 1)
+        self.journal.record(0xFFFF, 0x90, 61, 1)
+        self.journal.record(0, 0xB0, 7, 1)
+        self.journal.acknowledge(0xFFFF)
+        journal = parse(self.journal.encode())
+        self.assertEqual(0, journal.checkpoint_seqnum)
+        self.assertEqual(b'\x00\x07\x01', journal.channel_journal.journal)
+
+        self.journal.acknowledge(0)
+        self.assertIsNone(self.journal.encode())
+        self.assertIsNone(self.journal.checkpoint_seqnum)
+
+    def test_acknowledge_before_checkpoint(self):
+        self.journal.record(10, 0x90, 60, 1)
+        self.journal.acknowledge(9)
+        self.assertEqual(10, parse(self.journal.encode()).checkpoint_seqnum)
+
+    def test_encode_is_cached(self):
+        self.journal.record(1, 0x90, 60, 1)
+        self.assertIs(self.journal.encode(), self.journal.encode())
+        self.journal.record(2, 0x90, 61, 1)
+        self.assertEqual(2, parse(self.journal.encode()).channel_journal.journal[0])
+
+    def test_all_notes_on(self):
+        for note in range(128):
+            self.journal.record(1, 0x90, note, 1)
+        chapter = parse(self.journal.encode()).channel_journal
+        self.assertEqual(b'\x7f\xf0', chapter.journal[:2])
+        self.assertEqual(2 + 256, len(chapter.journal))
+
+    def test_untracked_commands(self):
+        self.journal.record(1, 0xA0, 60, 1)
+        self.journal.record(1, 0xD0, 1)
+        self.assertIsNone(self.journal.encode())
+
+    def test_max_size(self):
+        journal = RecoveryJournal(max_size=64)
+        for seqnum in range(100):
+            journal.record(seqnum, 0xB0 | (seqnum % 16), seqnum, 1)
+            data = journal.encode()
+            self.assertLessEqual(len(data), 64)
+        self.assertGreater(journal.overflows, 0)
+        # The most recent change is always kept.
+        parsed = parse(data)
+        self.assertTrue(seq_after(parsed.checkpoint_seqnum, 50))
+        self.assertIn(b'\x63\x01', data)
+
+    def test_max_size_single_packet(self):
+        journal = RecoveryJournal(max_size=16)
+        for note in range(20):
+            journal.record(7, 0x90, note, 1)
+        self.assertIsNone(journal.encode())
+        self.assertFalse(journal)
+
+    def test_encode_reuses_unchanged_chapters(self):
+        self.journal.record(1, 0xB0, 7, 1)
+        self.journal.record(2, 0x90, 60, 1)
+        self.journal.encode()
+        chapter_c = self.journal.channels[0].chapters[0x40]
+        self.journal.record(3, 0x90, 61, 1)
+        self.journal.encode()
+        self.assertIs(chapter_c, self.journal.channels[0].chapters[0x40])
+
+    def test_seq_after(self):
+        self.assertTrue(seq_after(1, 0))
+        self.assertTrue(seq_after(0, 0xFFFF))
+        self.assertFalse(seq_after(0xFFFF, 0))
+        self.assertFalse(seq_after(5, 5))
+
+
+class WriterJournalTests(TestCase):
+    def test_write_command(self):
+        writer = packets.MIDIPacketWriter(1234)
+        journal = RecoveryJournal()
+        journal.record(1, 0x90, 60, 37)
+        pkt = packets.decode_midi_packet(writer.write_command(2, 0, 0x80, 60, 0, journal.encode()))
+        self.assertTrue(pkt.command.flags.j)
+        self.assertEqual([packets.MIDIEvent(0x80, 60, 0)], pkt.command.midi_list)
+        self.assertEqual(1, pkt.journal.checkpoint_seqnum)
+
+        pkt = packets.decode_midi_packet(writer.write_command(3, 0, 0x80, 60, 0))
+        self.assertFalse(pkt.command.flags.j)
+        self.assertIsNone(pkt.journal)
+
+    def test_write_events(self):
+        writer = packets.MIDIPacketWriter(1234, max_size=64)
+        journal = RecoveryJournal()
+        journal.record(1, 0xB0, 7, 1)
+        data = journal.encode()
+        events = [packets.MIDIEvent(0x90, i, 1, delta_time=0) for i in range(40)]
+        packet, count = writer.write_events(2, 0, events, journal=data)
+        self.assertLessEqual(len(packet), 64)
+        pkt = packets.MIDIPacket.parse(bytes(packet))
+        self.assertEqual(count, len(pkt.command.midi_list))
+        self.assertTrue(pkt.journal.channel_journal.header.c)
+        self.assertEqual(data, bytes(packet[-len(data) :]))
+
+
+class ChapterParsingTests(TestCase):
+    def test_encoder_output(self):
+        journal = RecoveryJournal()
+        journal.record(1, 0xB2, 0, 3)
+        journal.record(2, 0xC2, 9)
+        journal.record(3, 0xE2, 0x01, 0x40)
+        journal.record(4, 0x92, 60, 100)
+        journal.record(5, 0x82, 64, 0)
+        chapters = parse_channel_chapters(parse(journal.encode()).channel_journal)
+        self.assertEqual(
+            (9, True, 3, 0),
+            (chapters.p.program, chapters.p.b, chapters.p.bank_msb, chapters.p.bank_lsb),
+        )
+        self.assertEqual([(0, 3)], [(log.number, log.value) for log in chapters.c.logs])
+        self.assertEqual((0x01, 0x40), (chapters.w.first, chapters.w.second))
+        self.assertEqual(
+            [(60, True, 100)], [(log.notenum, log.y, log.velocity) for log in chapters.n.logs]
+        )
+        self.assertEqual([64], chapters.n.note_offs)
+        self.assertIsNone(chapters.m)
+        self.assertIsNone(chapters.t)
+
+    def test_channel_chapters(self):
+        journal = channel_journal(5, 0x27, CHAPTER_M + CHAPTER_E + CHAPTER_T + CHAPTER_A)
+        chapters = parse_channel_chapters(journal)
+
+        m = chapters.m
+        self.assertEqual((True, False, 10), (m.p, m.z, m.length))
+        self.assertEqual((True, 5), (m.pending.q, m.pending.pending))
+        (log,) = m.logs
+        self.assertEqual(
+            (6, 0, 0x40, None, 3),
+            (log.pnum_lsb, log.pnum_msb, log.entry_msb, log.entry_lsb, log.count),
+        )
+        self.assertEqual((True, 5), (log.a_button.g, log.a_button.value))
+        self.assertIsNone(log.c_button)
+
+        self.assertEqual(
+            [(60, True, 5)], [(log.notenum, log.v, log.count_vel) for log in chapters.e.logs]
+        )
+        self.assertEqual((True, 5), (chapters.t.s, chapters.t.pressure))
+        self.assertEqual(
+            [(60, False, 16), (62, True, 16)],
+            [(log.notenum, log.x, log.pressure) for log in chapters.a.logs],
+        )
+
+    def test_system_chapters(self):
+        journal = system_journal(0x7C, CHAPTER_D + CHAPTER_V + CHAPTER_Q + CHAPTER_F + CHAPTER_X)
+        chapters = parse_system_chapters(journal)
+
+        d = chapters.d
+        self.assertEqual(3, d.reset.value)
+        self.assertIsNone(d.tune_request)
+        self.assertEqual((True, 5), (d.song_select.s, d.song_select.value))
+        self.assertEqual(b'\x02\x01', d.undefined_f9)
+        self.assertIsNone(d.undefined_f4)
+        self.assertEqual(7, chapters.v.count)
+        self.assertEqual(((1 << 16) | 0x10, 0x102), (chapters.q.clock, chapters.q.timetools))
+        self.assertEqual(
+            (2, 0x01020304, None), (chapters.f.point, chapters.f.complete, chapters.f.partial)
+        )
+        self.assertEqual((True, b'\x01\x02'), (chapters.x.t, chapters.x.data))
+
+    def test_truncated_channel_chapters(self):
+        chapters = (
+            (0x80, b'\x05\x82\x00'),
+            (0x40, b'\x01\x00\x02\x07\x64'),
+            (0x20, CHAPTER_M),
+            (0x10, b'\x01\x40'),
+            (0x08, b'\x01\x77\x3c\xa5\x0a'),
+            (0x04, CHAPTER_E),
+            (0x02, CHAPTER_T),
+            (0x01, CHAPTER_A),
+        )
+        for toc, data in chapters:
+            parse_channel_chapters(channel_journal(0, toc, data))
+            for i in range(len(data)):
+                with self.assertRaises(StreamError, msg='toc={:02x} len={}'.format(toc, i)):
+                    parse_channel_chapters(channel_journal(0, toc, data[:i]))
+
+    def test_truncated_system_chapters(self):
+        chapters = (
+            (0x40, CHAPTER_D),
+            (0x20, CHAPTER_V),
+            (0x10, CHAPTER_Q),
+            (0x08, CHAPTER_F),
+            # Chapter X runs to the end of the journal; only its header is
+            # required.
+            (0x04, CHAPTER_X[:1]),
+        )
+        for flags, data in chapters:
+            parse_system_chapters(system_journal(flags, data))
+            for i in range(len(data)):
+                with self.assertRaises(StreamError, msg='flags={:02x} len={}'.format(flags, i)):
+                    parse_system_chapters(system_journal(flags, data[:i]))
+
+
+class RecoveryStateTests(TestCase):
+    def setUp(self):
+        self.client = Client(ssrc=1234)
+        self.client.socket = mock.Mock()
+        self.client.socket.sendto.side_effect = lambda data, addr: self.sent.append(bytes(data))
+        self.client.host, self.client.port = '127.0.0.1', 5004
+        self.sent = []
+
+        self.delivered = []
+        self.protocol = DataProtocol(
+            mock.Mock(),
+            midi_command_cb=lambda peer, pkt: self.delivered.append(list(pkt.command.midi_list)),
+        )
+        self.peer = self.protocol._connect_peer('client', ('127.0.0.1', 5006), 1234)
+
+    def test_repair(self):
+        self.client.send_note_on('C3')
+        self.client.send_control_change(7, 64)
+        self.client.send_note_off('C3')  # Lost
+        self.client.send_control_change(7, 100)  # Lost
+        self.client.send_note_on('D3')
+        for i in (0, 1, 4):
+            self.protocol.handle_message(self.sent[i], ('127.0.0.1', 5006))
+
+        self.assertEqual([packets.MIDIEvent(0x91, 48, 80)], self.delivered[0])
+        self.assertEqual([packets.MIDIEvent(0xB1, 7, 64)], self.delivered[1])
+        repaired = self.delivered[2]
+        self.assertEqual(
+            [
+                packets.RepairEvent(0xB1, 7, 100),
+                packets.RepairEvent(0x81, 48, 0),
+                packets.MIDIEvent(0x91, 50, 80),
+            ],
+            repaired,
+        )
+        self.assertEqual([True, True, False], [e.repair for e in repaired])
+        self.assertEqual((2, 2), (self.peer.recovery.lost, self.peer.recovery.repaired))
+
+    def test_repair_is_minimal(self):
+        self.client.send_control_change(7, 64)
+        self.client.send_note_on('C3')  # Lost
+        self.client.send_note_on('D3')
+        for i in (0, 2):
+            self.protocol.handle_message(self.sent[i], ('127.0.0.1', 5006))
+        # CC 7 is in the journal, but already has the right value.
+        self.assertEqual(
+            [packets.RepairEvent(0x91, 48, 80), packets.MIDIEvent(0x91, 50, 80)],
+            self.delivered[1],
+        )
+
+    def test_late_packets_delivered(self):
+        self.client.send_note_on('C3')
+        self.client.send_note_on('D3')
+        self.client.send_note_on('E3')
+        for i in (0, 2, 1, 1):
+            self.protocol.handle_message(self.sent[i], ('127.0.0.1', 5006))
+        self.assertEqual(4, len(self.delivered))
+        self.assertEqual(2, self.peer.recovery.late)
+        self.assertEqual(1, self.peer.recovery.lost)
+
+    def test_disabled(self):
+        protocol = DataProtocol(mock.Mock(), recover_lost_packets=False)
+        self.assertIsNone(protocol._connect_peer('client', None, 1).recovery)
+
+
+class ReceiverFeedbackTests(TestCase):
+    def setUp(self):
+        self.client = Client(ssrc=1234)
+        self.client.socket = mock.Mock()
+        self.client.socket.sendto.side_effect = lambda data, addr: self.sent.append(bytes(data))
+        self.client.host, self.client.port = '127.0.0.1', 5004
+        self.sent = []
+
+        self.socket = mock.Mock()
+        self.protocol = DataProtocol(self.socket, ssrc=5678)
+        self.peer = self.protocol._connect_peer('client', ('127.0.0.1', 5006), 1234)
+
+    def receive(self, *indexes):
+        for i in indexes:
+            self.protocol.handle_message(self.sent[i], ('127.0.0.1', 5006))
+
+    def feedback(self):
+        result = []
+        for (data, addr), _ in self.socket.sendto.call_args_list:
+            self.assertEqual(('127.0.0.1', 5006), addr)
+            result.append(packets.AppleMIDIReceiverFeedbackPacket.parse(data).sequence_number)
+        return result
+
+    def test_send_feedback(self):
+        self.protocol.send_feedback(now=10)
+        self.assertEqual([], self.feedback())
+
+        self.client.send_note_on('C3')
+        self.client.send_note_on('D3')
+        self.receive(0, 1)
+        self.protocol.send_feedback(now=10)
+        self.assertEqual([self.client.sequence_number], self.feedback())
+        pkt = packets.AppleMIDIReceiverFeedbackPacket.parse(self.socket.sendto.call_args[0][0])
+        self.assertEqual(5678, pkt.ssrc)
+
+        # Nothing new, then rate-limited.
+        self.protocol.send_feedback(now=12)
+        self.client.send_note_on('E3')
+        self.receive(2)
+        self.protocol.on_timer(10.5)
+        self.assertEqual(1, len(self.feedback()))
+        self.protocol.on_timer(11)
+        self.assertEqual(2, len(self.feedback()))
+
+    def test_feedback_trims_journal(self):
+        self.client.send_note_on('C3')
+        self.client.send_note_on('D3')
+        self.receive(0, 1)
+        self.protocol.send_feedback(now=10)
+        self.assertIsNotNone(self.client.journal.encode())
+        self.client.handle_feedback(self.socket.sendto.call_args[0][0])
+        self.assertIsNone(self.client.journal.encode())
+
+    def test_receive_feedback(self):
+        self.peer.journal = RecoveryJournal()
+        self.peer.journal.record(100, 0x90, 60, 100)
+        self.peer.journal.record(101, 0x90, 62, 100)
+        control = ControlProtocol(data_protocol=self.protocol, socket=mock.Mock())
+        message = packets.AppleMIDIReceiverFeedbackPacket.build(
+            dict(command=b'RS', ssrc=1234, sequence_number=100)
+        )
+        control.handle_message(message, ('127.0.0.1', 5005))
+        self.assertEqual(101, self.peer.journal.checkpoint_seqnum)
+
+    def test_client_polls_feedback(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(receiver.close)
+        self.addCleanup(sender.close)
+        receiver.bind(('127.0.0.1', 0))
+        self.client.journal.record(100, 0x90, 60, 100)
+        self.client.journal.record(101, 0x90, 62, 100)
+        self.client.socket = receiver
+        message = packets.AppleMIDIReceiverFeedbackPacket.build(
+            dict(command=b'RS', ssrc=5678, sequence_number=101)
+        )
+        sender.sendto(message, receiver.getsockname())
+        for _ in range(100):
+            self.client.poll()
+            if self.client.journal.encode() is None:
+                break
+        self.assertIsNone(self.client.journal.encode())
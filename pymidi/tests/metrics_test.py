@@ -0,0 +1,167 @@
+import random
+from unittest import TestCase
+
+import mock
+
+from pymidi import metrics
+from pymidi import packets
+from pymidi.protocol import ControlProtocol, DataProtocol
+from pymidi.server import Server
+
+
+class HistogramTests(TestCase):
+    def test_small_values_exact(self):
+        histogram = metrics.Histogram(precision=3)
+        for value in range(16):
+            histogram.record(value)
+        self.assertEqual(0, histogram.percentile(1))
+        self.assertEqual(7, histogram.percentile(50))
+        self.assertEqual(15, histogram.percentile(100))
+
+    def test_relative_error(self):
+        histogram = metrics.Histogram(precision=5)
+        rng = random.Random(1)
+        values = sorted(rng.randint(0, 10 ** 9) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        for percent in (50, 90, 99, 99.9):
+            exact = values[int(percent / 100.0 * len(values)) - 1]
+            self.assertLessEqual(abs(histogram.percentile(percent) - exact), exact / 2 ** 5)
+        self.assertEqual(values[0], histogram.min)
+        self.assertEqual(values[-1], histogram.max)
+        self.assertEqual(values[-1], histogram.percentile(100))
+        self.assertLess(len(histogram.counts), 30 * 2 ** 5)
+
+    def test_bucket_bounds(self):
+        histogram = metrics.Histogram(precision=2)
+        for value in range(1, 2 ** 12):
+            index = histogram._index(value)
+            self.assertLessEqual(value, histogram._upper_bound(index))
+            self.assertGreater(value, histogram._upper_bound(index - 1))
+
+    def test_merge(self):
+        first, second = metrics.Histogram(), metrics.Histogram()
+        first.record(10)
+        second.record(1000)
+        second.record(5)
+        first.merge(second)
+        self.assertEqual(3, first.count)
+        self.assertEqual(1015, first.sum)
+        self.assertEqual(5, first.min)
+        self.assertEqual(1000, first.max)
+        self.assertEqual([1, 2, 3], first.cumulative_counts([5, 100, 2000]))
+
+    def test_empty(self):
+        self.assertIsNone(metrics.Histogram().percentile(50))
+
+
+class RegistryTests(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_get_or_create(self):
+        counter = self.registry.counter('c', 'A counter.', ('kind',))
+        self.assertIs(counter, self.registry.counter('c', 'A counter.', ('kind',)))
+        with self.assertRaises(ValueError):
+            self.registry.gauge('c', 'A gauge.', ('kind',))
+        with self.assertRaises(ValueError):
+            self.registry.counter('c', 'A counter.', ('other',))
+
+    def test_snapshot(self):
+        counter = self.registry.counter('c', 'A counter.', ('kind',))
+        counter.inc(('a',))
+        counter.inc(('b',), 5)
+        gauge = self.registry.gauge('g', 'A gauge.')
+        gauge.add_callback(lambda: 2)
+        gauge.add_callback(lambda: 3)
+        self.registry.histogram('h', 'A histogram.').record(2000)
+        snapshot = self.registry.snapshot()
+        self.assertEqual({'a': 1, 'b': 5}, snapshot['c'])
+        self.assertEqual({'': 5}, snapshot['g'])
+        self.assertEqual(1, snapshot['h']['']['count'])
+        self.assertAlmostEqual(2e-6, snapshot['h']['']['p50'], delta=1e-7)
+
+    def test_prometheus(self):
+        self.registry.counter('c', 'A counter.', ('command',)).inc((b'IN',), 2)
+        self.registry.counter('q', 'Quoted.', ('reason',)).inc(('a"b',))
+        self.registry.histogram('h', 'A histogram.', ('protocol',)).record(3000, ('data',))
+        lines = self.registry.to_prometheus().splitlines()
+        self.assertEqual('# HELP c A counter.', lines[0])
+        self.assertEqual('# TYPE c counter', lines[1])
+        self.assertEqual('c{command="IN"} 2', lines[2])
+        self.assertIn('q{reason="a\\"b"} 1', lines)
+        self.assertIn('# TYPE h histogram', lines)
+        self.assertIn('h_bucket{protocol="data",le="2.5e-06"} 0', lines)
+        self.assertIn('h_bucket{protocol="data",le="5e-06"} 1', lines)
+        self.assertIn('h_bucket{protocol="data",le="+Inf"} 1', lines)
+        self.assertIn('h_count{protocol="data"} 1', lines)
+
+
+class ProtocolMetricsTests(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.data = DataProtocol(mock.Mock(), metrics_registry=self.registry)
+        self.control = ControlProtocol(
+            data_protocol=self.data, socket=mock.Mock(), metrics_registry=self.registry
+        )
+        self.addr = ('127.0.0.1', 5004)
+
+    def invitation(self, ssrc):
+        return packets.AppleMIDIExchangePacket.create(
+            protocol_version=2, command=b'IN', initiator_token=1, ssrc=ssrc, name='peer'
+        )
+
+    def test_counters(self):
+        invitation = self.invitation(1234)
+        self.control.handle_message(invitation, self.addr)
+        self.control.handle_message(invitation, self.addr)
+        self.data.handle_message(invitation, self.addr)
+        writer = packets.MIDIPacketWriter(4321)
+        self.data.handle_message(bytes(writer.write_command(1, 0, 0x90, 60, 100)), self.addr)
+        self.data.handle_message(b'\x80\x61\x00', self.addr)
+
+        snapshot = self.registry.snapshot()
+        self.assertEqual(
+            {'control,IN': 2, 'data,IN': 1, 'data,midi': 2}, snapshot['pymidi_rx_packets_total']
+        )
+        rx_bytes = self.registry.metrics['pymidi_rx_bytes_total']
+        self.assertEqual(2 * len(invitation), rx_bytes.get(('control', b'IN')))
+        self.assertEqual({'control,OK': 1, 'data,OK': 1}, snapshot['pymidi_tx_packets_total'])
+        self.assertEqual(
+            {'control,duplicate_connection': 1, 'data,malformed': 1, 'data,unknown_ssrc': 1},
+            snapshot['pymidi_dropped_packets_total'],
+        )
+        self.assertEqual({'control': 1, 'data': 1}, snapshot['pymidi_peers'])
+        self.assertEqual(1, snapshot['pymidi_decode_seconds']['data']['count'])
+
+    def test_callback_time(self):
+        self.data.midi_command_cb = mock.Mock()
+        self.data.handle_message(self.invitation(1234), self.addr)
+        writer = packets.MIDIPacketWriter(1234)
+        self.data.handle_message(bytes(writer.write_command(1, 0, 0x90, 60, 100)), self.addr)
+        self.data.midi_command_cb.assert_called_once()
+        self.assertEqual(1, self.data._callback_time.count)
+
+    def test_server_registry(self):
+        server = Server([('127.0.0.1', 0)])
+        server._init_protocols()
+        try:
+            for proto in server.socket_map.values():
+                self.assertIs(server.metrics, proto.metrics)
+            self.assertEqual({'control': 0, 'data': 0}, server.metrics.snapshot()['pymidi_peers'])
+        finally:
+            server.close()
+
+    def test_server_restart(self):
+        server = Server([('127.0.0.1', 0)])
+        server._init_protocols()
+        server.ipv4_protocols[0].peers_by_ssrc[1234] = mock.Mock()
+        self.assertEqual({'control': 1, 'data': 0}, server.metrics.snapshot()['pymidi_peers'])
+        server.close()
+        self.assertEqual({'control': 0, 'data': 0}, server.metrics.snapshot()['pymidi_peers'])
+        server._init_protocols()
+        try:
+            server.ipv4_protocols[1].peers_by_ssrc[1234] = mock.Mock()
+            self.assertEqual({'control': 0, 'data': 1}, server.metrics.snapshot()['pymidi_peers'])
+        finally:
+            server.close()
@@ -50,6 +50,15 @@ class TestPackets(TestCase):
         self.assertEqual(15370297433218, pkt.timestamp_2)
         self.assertEqual(1140859528, pkt.timestamp_3)
 
+    def test_receiver_feedback_packet(self):
+        data = packets.AppleMIDIReceiverFeedbackPacket.build(
+            dict(command=b'RS', ssrc=1205342358, sequence_number=0x1234)
+        )
+        self.assertEqual(h2b('ffff525347d81096' '12340000'), data)
+        pkt = packets.AppleMIDIReceiverFeedbackPacket.parse(data)
+        self.assertEqual(1205342358, pkt.ssrc)
+        self.assertEqual(0x1234, pkt.sequence_number)
+
     def test_single_midi_packet(self):
         pkt = packets.MIDIPacket.parse(SINGLE_MIDI_PACKET)
         print(pkt)
@@ -139,3 +148,62 @@ class TestPackets(TestCase):
         pkt = packets.AppleMIDIExchangePacket.parse(APPLEMIDI_EXIT_PACKET)
         strval = packets.to_string(pkt)
         self.assertEqual('AppleMIDIExchangePacket [command=BY ssrc=1205342358 name=None]', strval)
+
+    def test_midi_packet_writer(self):
+        writer = packets.MIDIPacketWriter(ssrc=1205342358)
+        data = writer.write_command(17018, 1268723766, 0x90, 48, 38)
+        pkt = packets.MIDIPacket.parse(bytes(data))
+        self.assertEqual(17018, pkt.header.rtp_header.sequence_number)
+        self.assertEqual(1268723766, pkt.header.timestamp)
+        self.assertEqual(1205342358, pkt.header.ssrc)
+        self.assertEqual(False, pkt.command.flags.j)
+        self.assertEqual('MIDIPacket [note_on C3 38]', packets.to_string(pkt))
+
+        # Sequence number and timestamp are patched in place, and wrap.
+        data = writer.write_command(0x10001, 2 ** 32 + 5, 0xC3, 7)
+        pkt = packets.decode_midi_packet(data)
+        self.assertEqual(1, pkt.header.rtp_header.sequence_number)
+        self.assertEqual(5, pkt.header.timestamp)
+        self.assertEqual(2, pkt.command.flags.len)
+        self.assertEqual([packets.MIDIEvent(0xC3, 7)], pkt.command.midi_list)
+
+    def test_midi_packet_writer_events(self):
+        writer = packets.MIDIPacketWriter(ssrc=1205342358)
+        events = [
+            packets.MIDIEvent(0x90, 62, 49),
+            packets.MIDIEvent(0x90, 64, 59, delta_time=10),
+        ]
+        data, count = writer.write_events(17050, 1372773511, events)
+        self.assertEqual(2, count)
+        # Same MIDI list as MULTI_MIDI_PACKET, using running status.
+        self.assertEqual(h2b('80e1429a51d2dc8747d8109606903e310a403b'), bytes(data))
+
+        # Long lists use the long header; large deltas take several octets.
+        events = [packets.MIDIEvent(0x90, 60 + i, 100, delta_time=200) for i in range(8)]
+        events.append(packets.MIDIEvent(0xC0, 5, delta_time=0x0FFFFFFF))
+        data, count = writer.write_events(1, 2, events)
+        self.assertEqual(9, count)
+        for pkt in (packets.MIDIPacket.parse(bytes(data)), packets.decode_midi_packet(data)):
+            self.assertEqual(True, pkt.command.flags.b)
+            self.assertEqual(3 + 7 * 4 + 6, pkt.command.flags.len)
+            midi_list = pkt.command.midi_list
+            self.assertEqual(9, len(midi_list))
+            self.assertEqual([None] + [200] * 7 + [0x0FFFFFFF], [e.delta_time for e in midi_list])
+            self.assertEqual('G4', midi_list[7].params.key)
+
+    def test_midi_packet_writer_splits_events(self):
+        writer = packets.MIDIPacketWriter(ssrc=1, max_size=12 + 2 + 9)
+        events = [packets.MIDIEvent(0x90, 60 + i, 100, delta_time=1) for i in range(5)]
+        data, count = writer.write_events(1, 2, events)
+        self.assertEqual(3, count)
+        data, count = writer.write_events(1, 2, events, start=3)
+        self.assertEqual(2, count)
+        pkt = packets.decode_midi_packet(data)
+        self.assertEqual([63, 64], [e.data1 for e in pkt.command.midi_list])
+
+    def test_delta_time(self):
+        for value, encoded in ((0, '00'), (0x7F, '7f'), (0x80, '8100'), (0x0FFFFFFF, 'ffffff7f')):
+            self.assertEqual(h2b(encoded), packets.encode_delta_time(value))
+            self.assertEqual(value, packets.MIDIDeltaTime().parse(h2b(encoded)))
+        with self.assertRaises(ValueError):
+            packets.encode_delta_time(0x10000000)
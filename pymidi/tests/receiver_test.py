@@ -0,0 +1,79 @@
+import socket
+import unittest
+from unittest import TestCase
+
+from pymidi import receiver
+from pymidi.protocol import Peer
+from pymidi.server import Handler, Server
+from pymidi.tests.packets_test import SINGLE_MIDI_PACKET
+
+
+class BatchReceiverTests(TestCase):
+    def check_receive(self, family, host, use_recvmmsg):
+        rx = socket.socket(family, socket.SOCK_DGRAM)
+        tx = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            rx.bind((host, 0))
+            tx.bind((host, 0))
+            batch = receiver.BatchReceiver(rx, batch_size=4, use_recvmmsg=use_recvmmsg)
+            self.assertEqual([], batch.receive())
+
+            payloads = [bytes([i]) * (i + 1) for i in range(6)]
+            for payload in payloads:
+                tx.sendto(payload, rx.getsockname())
+
+            first = batch.receive()
+            self.assertEqual(payloads[:4], [bytes(data) for data, _ in first])
+            for data, addr in first:
+                self.assertIsInstance(data, memoryview)
+                self.assertEqual(tx.getsockname()[:2], addr[:2])
+            second = batch.receive()
+            self.assertEqual(payloads[4:], [bytes(data) for data, _ in second])
+            self.assertEqual([], batch.receive())
+        finally:
+            rx.close()
+            tx.close()
+
+    @unittest.skipUnless(receiver.recvmmsg_available(), 'recvmmsg not available')
+    def test_recvmmsg_ipv4(self):
+        self.check_receive(socket.AF_INET, '127.0.0.1', use_recvmmsg=True)
+
+    @unittest.skipUnless(receiver.recvmmsg_available(), 'recvmmsg not available')
+    def test_recvmmsg_ipv6(self):
+        try:
+            self.check_receive(socket.AF_INET6, '::1', use_recvmmsg=True)
+        except OSError as e:
+            self.skipTest('IPv6 loopback unavailable: {}'.format(e))
+
+    def test_fallback(self):
+        self.check_receive(socket.AF_INET, '127.0.0.1', use_recvmmsg=False)
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.commands = []
+
+    def on_midi_commands(self, peer, command_list):
+        self.commands.extend(command_list)
+
+
+class BatchReceiveServerTests(TestCase):
+    def test_server_batch_receive(self):
+        server = Server([('127.0.0.1', 0)], batch_receive=True)
+        server._init_protocols()
+        handler = RecordingHandler()
+        server.add_handler(handler)
+        _, data_protocol = server.ipv4_protocols
+        data_protocol.peers_by_ssrc[1205342358] = Peer('test', None, 1205342358)
+
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for _ in range(3):
+                tx.sendto(SINGLE_MIDI_PACKET, data_protocol.socket.getsockname())
+            while len(handler.commands) < 3:
+                server._loop_once(timeout=1)
+        finally:
+            tx.close()
+            for sock in server.socket_map:
+                sock.close()
+        self.assertEqual(['note_on'] * 3, [c.command for c in handler.commands])
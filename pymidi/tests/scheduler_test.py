@@ -0,0 +1,119 @@
+import threading
+import time
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi.client import Client
+from pymidi.scheduler import Scheduler, ThreadScheduler
+
+
+def note_on(note):
+    return packets.MIDIEvent(packets.COMMAND_NOTE_ON, note, 100)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.sent = []
+        self.scheduler = Scheduler(lambda events, ts: self.sent.append((ts, events)))
+
+    def test_run_due(self):
+        self.scheduler.schedule(note_on(62), at=10.0005)
+        self.scheduler.schedule(note_on(60), at=10.0)
+        self.scheduler.schedule(note_on(64), at=10.5)
+        self.assertEqual(10.0, self.scheduler.next_deadline())
+
+        self.assertEqual(0, self.scheduler.run_due(9.9))
+        self.assertEqual(2, self.scheduler.run_due(10.0))
+        timestamp, events = self.sent[0]
+        self.assertEqual(100000, timestamp)
+        self.assertEqual([60, 62], [e.data1 for e in events])
+        self.assertEqual([None, 5], [e.delta_time for e in events])
+        self.assertEqual(10.5, self.scheduler.next_deadline())
+
+    def test_same_time_keeps_order(self):
+        for note in (60, 62, 64):
+            self.scheduler.schedule(note_on(note), at=5)
+        self.scheduler.run_due(5)
+        self.assertEqual([60, 62, 64], [e.data1 for e in self.sent[0][1]])
+
+    def test_lead(self):
+        self.scheduler.lead_cb = lambda: 0.01
+        self.scheduler.schedule(note_on(60), at=10.0)
+        self.assertEqual(9.99, self.scheduler.next_deadline())
+        self.scheduler.run_due(9.99)
+        # Stamped with the time it should play, not the time it was sent.
+        self.assertEqual(100000, self.sent[0][0])
+
+    def test_cancel_all(self):
+        self.scheduler.schedule(note_on(60), at=10.0)
+        self.scheduler.cancel_all()
+        self.assertIsNone(self.scheduler.next_deadline())
+
+
+class ThreadSchedulerTests(TestCase):
+    def test_sends_on_time(self):
+        sent = []
+        done = threading.Event()
+
+        def send(events, timestamp):
+            sent.append((time.monotonic(), timestamp, events))
+            done.set()
+
+        scheduler = ThreadScheduler(send)
+        self.addCleanup(scheduler.close)
+        at = time.monotonic() + 0.02
+        scheduler.schedule(note_on(60), at)
+        scheduler.schedule(note_on(64), at)
+        self.assertTrue(done.wait(5))
+        sent_at, timestamp, events = sent[0]
+        self.assertGreaterEqual(sent_at, at)
+        self.assertEqual(int(at * packets.RTP_TIMESTAMP_RATE), timestamp)
+        self.assertEqual(2, len(events))
+
+    def test_closed(self):
+        scheduler = ThreadScheduler(mock.Mock())
+        scheduler.close()
+        with self.assertRaises(ValueError):
+            scheduler.schedule(note_on(60), 0)
+
+
+class ClientScheduleTests(TestCase):
+    def test_schedule(self):
+        client = Client(ssrc=1234)
+        client.socket = mock.Mock()
+        client.host, client.port = '127.0.0.1', 5004
+        done = threading.Event()
+        client.socket.sendto.side_effect = lambda data, addr: done.set()
+
+        at = time.monotonic() + 0.01
+        client.schedule(note_on(60), at=at)
+        client.schedule(note_on(60), at=at + 0.0002)
+        self.addCleanup(client.scheduler.close)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(1, client.socket.sendto.call_count)
+        packet = packets.decode_midi_packet(client.socket.sendto.call_args[0][0])
+        self.assertEqual(int(at * packets.RTP_TIMESTAMP_RATE) & 0xFFFFFFFF, packet.header.timestamp)
+        self.assertEqual(2, len(packet.command.midi_list))
+
+    def test_schedule_sysex(self):
+        client = Client(ssrc=1234)
+        client.socket = mock.Mock()
+        client.host, client.port = '127.0.0.1', 5004
+        sent = []
+        done = threading.Event()
+
+        def sendto(data, addr):
+            sent.append(bytes(data))
+            done.set()
+
+        client.socket.sendto.side_effect = sendto
+        event = packets.MIDIEvent(packets.COMMAND_SYSEX, unknown=b'\x7d\x01\x02\xf7')
+        client.schedule(event, at=time.monotonic() + 0.01)
+        self.addCleanup(client.scheduler.close)
+        self.assertTrue(done.wait(5))
+        midi_list = packets.decode_midi_packet(sent[0]).command.midi_list
+        self.assertEqual(1, len(midi_list))
+        self.assertEqual(packets.COMMAND_SYSEX, midi_list[0].status)
+        self.assertEqual(b'\x7d\x01\x02\xf7', bytes(midi_list[0].unknown))
@@ -0,0 +1,186 @@
+import socket
+import unittest
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi import sender
+from pymidi.protocol import ControlProtocol, DataProtocol, Peer, ProtocolError
+from pymidi.server import Server
+
+
+class BatchSenderTests(TestCase):
+    def check_send(self, family, host, use_sendmmsg):
+        rx = socket.socket(family, socket.SOCK_DGRAM)
+        tx = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            rx.bind((host, 0))
+            rx.settimeout(1)
+            batch = sender.BatchSender(tx, batch_size=4, use_sendmmsg=use_sendmmsg)
+            shared = bytearray(b'payload')
+            messages = [((bytearray([i]), shared), rx.getsockname()) for i in range(6)]
+            self.assertEqual(6, batch.send(messages))
+            received = [rx.recv(1024) for _ in range(6)]
+            self.assertEqual([bytes([i]) + b'payload' for i in range(6)], received)
+        finally:
+            rx.close()
+            tx.close()
+
+    @unittest.skipUnless(sender.sendmmsg_available(), 'sendmmsg not available')
+    def test_sendmmsg_ipv4(self):
+        self.check_send(socket.AF_INET, '127.0.0.1', use_sendmmsg=True)
+
+    @unittest.skipUnless(sender.sendmmsg_available(), 'sendmmsg not available')
+    def test_sendmmsg_ipv6(self):
+        try:
+            self.check_send(socket.AF_INET6, '::1', use_sendmmsg=True)
+        except OSError as e:
+            self.skipTest('IPv6 loopback unavailable: {}'.format(e))
+
+    def test_fallback(self):
+        self.check_send(socket.AF_INET, '127.0.0.1', use_sendmmsg=False)
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.tx.bind(('127.0.0.1', 0))
+        self.protocol = DataProtocol(self.tx, ssrc=5678)
+        self.receivers = []
+        for ssrc in range(3):
+            rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rx.bind(('127.0.0.1', 0))
+            rx.settimeout(1)
+            self.receivers.append(rx)
+            self.protocol._connect_peer('peer', rx.getsockname(), ssrc)
+
+    def tearDown(self):
+        self.tx.close()
+        for rx in self.receivers:
+            rx.close()
+
+    def test_broadcast(self):
+        peers = list(self.protocol.peers_by_ssrc.values())
+        first_seqnums = [(p.sequence_number + 1) & 0xFFFF for p in peers]
+        events = [
+            packets.MIDIEvent(0x90, 60, 100),
+            packets.MIDIEvent(0x90, 64, 100, 10),
+        ]
+        self.protocol.broadcast(events, timestamp=1000)
+        self.protocol.broadcast(events[:1], timestamp=2000)
+        for rx, seqnum in zip(self.receivers, first_seqnums):
+            first = packets.decode_midi_packet(rx.recv(1024))
+            second = packets.decode_midi_packet(rx.recv(1024))
+            self.assertEqual(5678, first.header.ssrc)
+            self.assertEqual(1000, first.header.timestamp)
+            self.assertEqual(seqnum, first.header.rtp_header.sequence_number)
+            self.assertEqual((seqnum + 1) & 0xFFFF, second.header.rtp_header.sequence_number)
+            self.assertEqual([60, 64], [e.data1 for e in first.command.midi_list])
+            self.assertEqual([60], [e.data1 for e in second.command.midi_list])
+
+    def test_broadcast_splits_packets(self):
+        events = [packets.MIDIEvent(0xB0, 7, i % 128, 1) for i in range(1000)]
+        self.protocol.broadcast(events, timestamp=0)
+        rx = self.receivers[0]
+        total = 0
+        timestamps = []
+        while total < len(events):
+            packet = packets.decode_midi_packet(rx.recv(2048))
+            timestamps.append(packet.header.timestamp)
+            total += len(packet.command.midi_list)
+        self.assertEqual(len(events), total)
+        self.assertGreater(len(timestamps), 1)
+        self.assertEqual(0, timestamps[0])
+        self.assertLess(0, timestamps[1])
+
+    def test_server_broadcast(self):
+        server = Server([('127.0.0.1', 0)])
+        server.socket_map = {self.tx: self.protocol, mock.Mock(): mock.Mock()}
+        server.broadcast([packets.MIDIEvent(0x90, 60, 100)])
+        for rx in self.receivers:
+            self.assertEqual(
+                60, packets.decode_midi_packet(rx.recv(1024)).command.midi_list[0].data1
+            )
+
+
+class PeerSendTests(TestCase):
+    def setUp(self):
+        self.tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.tx.bind(('127.0.0.1', 0))
+        self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx.bind(('127.0.0.1', 0))
+        self.rx.settimeout(1)
+        self.protocol = DataProtocol(self.tx, ssrc=5678)
+        self.control = ControlProtocol(data_protocol=self.protocol, socket=mock.Mock())
+        self.peer = self.protocol._connect_peer('peer', self.rx.getsockname(), 1234)
+
+    def tearDown(self):
+        self.tx.close()
+        self.rx.close()
+
+    def receive(self):
+        return packets.decode_midi_packet(self.rx.recv(1024))
+
+    def test_send(self):
+        first = (self.peer.sequence_number + 1) & 0xFFFF
+        self.peer.send_note_on('C3', velocity=100, channel=2)
+        self.peer.send_control_change(7, 90)
+        self.peer.send_raw(b'\x93\x3c\x40')
+
+        pkt = self.receive()
+        self.assertEqual(5678, pkt.header.ssrc)
+        self.assertEqual(first, pkt.header.rtp_header.sequence_number)
+        self.assertEqual([packets.MIDIEvent(0x92, 48, 100)], pkt.command.midi_list)
+        self.assertIsNone(pkt.journal)
+
+        pkt = self.receive()
+        self.assertEqual((first + 1) & 0xFFFF, pkt.header.rtp_header.sequence_number)
+        self.assertEqual([packets.MIDIEvent(0xB1, 7, 90)], pkt.command.midi_list)
+        self.assertEqual(first, pkt.journal.checkpoint_seqnum)
+
+        pkt = self.receive()
+        self.assertEqual([packets.MIDIEvent(0x93, 60, 64)], pkt.command.midi_list)
+
+    def test_send_commands(self):
+        events = [packets.MIDIEvent(0x90, 60, 100), packets.MIDIEvent(0x80, 60, 0, 10)]
+        self.protocol.send_commands(self.peer, events, timestamp=1000)
+        pkt = self.receive()
+        self.assertEqual(1000, pkt.header.timestamp)
+        self.assertEqual([60, 60], [e.data1 for e in pkt.command.midi_list])
+
+    def test_feedback_trims_journal(self):
+        self.peer.send_note_on('C3')
+        self.assertIsNotNone(self.peer.journal.encode())
+        message = packets.AppleMIDIReceiverFeedbackPacket.build(
+            dict(command=b'RS', ssrc=1234, sequence_number=self.peer.sequence_number)
+        )
+        self.control.handle_message(message, ('127.0.0.1', 5005))
+        self.assertIsNone(self.peer.journal.encode())
+
+    def test_control_peer(self):
+        control_peer = self.control._connect_peer('peer', ('127.0.0.1', 5005), 1234)
+        control_peer.send_note_off('C3')
+        pkt = self.receive()
+        self.assertEqual([packets.MIDIEvent(0x81, 48, 80)], pkt.command.midi_list)
+        self.assertEqual(self.peer.sequence_number, pkt.header.rtp_header.sequence_number)
+
+    def test_server_send(self):
+        server = Server([('127.0.0.1', 0)])
+        server.socket_map = {self.tx: self.protocol}
+        self.assertIs(self.peer, server.get_peer(1234))
+        self.assertIsNone(server.get_peer(4321))
+        server.send_commands(1234, [packets.MIDIEvent(0x90, 62, 100)])
+        self.assertEqual(62, self.receive().command.midi_list[0].data1)
+        with self.assertRaises(ValueError):
+            server.send_commands(4321, [packets.MIDIEvent(0x90, 62, 100)])
+
+    def test_not_connected(self):
+        with self.assertRaises(ProtocolError):
+            Peer('peer', ('127.0.0.1', 5004), 1).send_note_on('C3')
+        with self.assertRaises(ProtocolError):
+            self.protocol.send_commands(Peer('peer', None, 1), [packets.MIDIEvent(0x90, 1, 1)])
+
+    def test_disabled_journal(self):
+        protocol = DataProtocol(mock.Mock(), recovery_journal=False)
+        self.assertIsNone(protocol._connect_peer('peer', None, 1).journal)
@@ -1,6 +1,12 @@
 from unittest import TestCase
+from pymidi import packets
+from pymidi.client import Client
 from pymidi.server import Server, Handler
+from pymidi.tests.packets_test import APPLEMIDI_INVITATION_PACKET
 import mock
+import socket
+import threading
+import time
 
 
 class FakeHandler(mock.Mock, Handler):
@@ -23,3 +29,90 @@ class ServerTests(TestCase):
         self.server._loop_once(timeout=0)
         self.assertFalse(self.handler.called)
         self.assertEqual(0, self.handler.call_count)
+
+    def test_shutdown(self):
+        """Confirms `shutdown()` from another thread stops `serve_forever()`."""
+        server = Server([('127.0.0.1', 0), ('127.0.0.1', 0)])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        while server.selector is None:
+            time.sleep(0.01)
+        # Two bind addresses, plus the wakeup socket.
+        self.assertEqual(5, len(server.selector.get_map()))
+        server.shutdown()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual({}, server.socket_map)
+
+    def test_shutdown_before_serving(self):
+        server = Server([('127.0.0.1', 0)])
+        server.shutdown()
+        server.serve_forever()
+        self.assertEqual({}, server.socket_map)
+
+    def test_serve_again_after_shutdown(self):
+        server = Server([('127.0.0.1', 0)])
+        server.shutdown()
+        server.serve_forever()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        while server.selector is None:
+            time.sleep(0.01)
+        self.assertTrue(thread.is_alive())
+        server.shutdown()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+    def test_data_protocol_options(self):
+        server = Server(
+            [('127.0.0.1', 0)],
+            data_protocol_options=dict(playout_delay=10, recover_lost_packets=False),
+        )
+        server._init_protocols()
+        handler = FakeHandler()
+        handler.on_midi_commands = mock.Mock()
+        server.add_handler(handler)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            ctrl_protocol, data_protocol = server.ipv4_protocols
+            self.assertEqual(10, data_protocol.playout_delay)
+            self.assertFalse(data_protocol.recover_lost_packets)
+            sock.sendto(APPLEMIDI_INVITATION_PACKET, ctrl_protocol.socket.getsockname())
+            sock.sendto(APPLEMIDI_INVITATION_PACKET, data_protocol.socket.getsockname())
+            while not data_protocol.peers_by_ssrc:
+                server._loop_once(timeout=1)
+            peer = list(data_protocol.peers_by_ssrc.values())[0]
+            writer = packets.MIDIPacketWriter(peer.ssrc)
+            sock.sendto(
+                writer.write_command(1, 0, 0x90, 60, 100), data_protocol.socket.getsockname()
+            )
+            while not len(peer.jitter):
+                server._loop_once(timeout=1)
+            # Held for the playout delay, rather than delivered.
+            handler.on_midi_commands.assert_not_called()
+        finally:
+            sock.close()
+            server.close()
+
+    def test_sync_interval(self):
+        """Confirms the server begins CK exchanges with a connected client."""
+        server = Server([('127.0.0.1', 0)], sync_interval=0.05)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        client = Client(sync_interval=None)
+        try:
+            while server.selector is None:
+                time.sleep(0.01)
+            ctrl_protocol, data_protocol = server.ipv4_protocols
+            self.assertEqual(0.05, data_protocol.sync_interval)
+            client.connect('127.0.0.1', ctrl_protocol.socket.getsockname()[1])
+            peer = data_protocol.peers_by_ssrc[client.ssrc]
+            deadline = time.monotonic() + 5
+            while min(peer.clock.exchanges, client.clock.exchanges) < 2:
+                self.assertLess(time.monotonic(), deadline)
+                client.poll()
+                time.sleep(0.01)
+        finally:
+            server.shutdown()
+            thread.join(timeout=5)
+            client.socket.close()
@@ -0,0 +1,105 @@
+import io
+import socket
+from unittest import TestCase
+
+from pymidi import packets, protocol
+from pymidi.server import Handler
+from pymidi.sharding import ShardedServer
+
+
+class RecordingHandler(Handler):
+    def __init__(self):
+        self.peers = []
+        self.commands = []
+        self.command_peers = []
+
+    def on_peer_connected(self, peer):
+        self.peers.append(peer)
+
+    def on_midi_commands(self, peer, command_list):
+        self.command_peers.append(peer)
+        for command in command_list:
+            self.commands.append((peer.ssrc, command.params.key))
+
+
+def invitation(ssrc):
+    return packets.AppleMIDIExchangePacket.create(
+        protocol_version=2,
+        command=protocol.APPLEMIDI_COMMAND_INVITATION,
+        initiator_token=ssrc,
+        ssrc=ssrc,
+        name='peer-{}'.format(ssrc),
+    )
+
+
+class ShardedServerTests(TestCase):
+    def setUp(self):
+        self.server = ShardedServer([('127.0.0.1', 0)], num_workers=2, forward_events=True)
+        self.handler = RecordingHandler()
+        self.server.add_handler(self.handler)
+        self.server._init_protocols()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        self.server.close()
+        self.sock.close()
+
+    def loop_until(self, predicate):
+        for _ in range(100):
+            if predicate():
+                return
+            self.server._loop_once(timeout=0.1)
+        self.fail('Timed out')
+
+    def test_packet_ssrc(self):
+        self.assertEqual(1205342358, protocol.packet_ssrc(invitation(1205342358)))
+        midi_packet = packets.MIDIPacketWriter(5).write_command(1, 1, 0x90, 1, 1)
+        self.assertEqual(5, protocol.packet_ssrc(midi_packet))
+        self.assertEqual(None, protocol.packet_ssrc(b'\xff\xffXX'))
+        self.assertEqual(0, self.server.worker_for_ssrc(None))
+
+    def test_sessions_are_sharded(self):
+        ctrl_addr, data_addr = [p.socket.getsockname() for p in self.server.ipv4_protocols]
+        ssrcs = [10, 11, 12, 13]
+        self.assertEqual([0, 1, 0, 1], [self.server.worker_for_ssrc(s) for s in ssrcs])
+
+        for ssrc in ssrcs:
+            self.sock.sendto(invitation(ssrc), ctrl_addr)
+            self.sock.sendto(invitation(ssrc), data_addr)
+        self.loop_until(lambda: len(self.handler.peers) == len(ssrcs))
+
+        # Workers answer on the inherited sockets.
+        replies = [packets.AppleMIDIExchangePacket.parse(self.sock.recv(1024)) for _ in range(8)]
+        self.assertEqual({b'OK'}, set(r.command for r in replies))
+
+        for ssrc in ssrcs:
+            writer = packets.MIDIPacketWriter(ssrc)
+            self.sock.sendto(writer.write_command(1, 1, 0x90, 60, 100), data_addr)
+        self.loop_until(lambda: len(self.handler.commands) == len(ssrcs))
+        self.assertEqual(set((s, 'C4') for s in ssrcs), set(self.handler.commands))
+        # Handlers see the same parent-side peer for each of its events.
+        peers_by_ssrc = dict((p.ssrc, p) for p in self.handler.peers)
+        for peer in self.handler.command_peers:
+            self.assertIs(peers_by_ssrc[peer.ssrc], peer)
+            self.assertEqual('peer-{}'.format(peer.ssrc), peer.name)
+
+    def test_broadcast(self):
+        ctrl_addr, data_addr = [p.socket.getsockname() for p in self.server.ipv4_protocols]
+        ssrcs = [10, 11]
+        for ssrc in ssrcs:
+            self.sock.sendto(invitation(ssrc), ctrl_addr)
+            self.sock.sendto(invitation(ssrc), data_addr)
+        self.loop_until(lambda: len(self.handler.peers) == len(ssrcs))
+        for _ in range(4):
+            self.sock.recv(1024)
+
+        self.server.broadcast([packets.MIDIEvent(0x90, 60, 100)])
+        # One copy from each worker, as each has one of the peers.
+        for _ in ssrcs:
+            midi_packet = packets.decode_midi_packet(self.sock.recv(1024))
+            self.assertEqual([packets.MIDIEvent(0x90, 60, 100)], midi_packet.command.midi_list)
+
+    def test_start_capture(self):
+        with self.assertRaises(RuntimeError):
+            self.server.start_capture(io.BytesIO())
@@ -0,0 +1,149 @@
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi import sysex
+from pymidi.client import Client
+from pymidi.protocol import DataProtocol
+from pymidi.sysex import SysExAssembler
+
+
+def event(status, data, delta_time=None):
+    return packets.MIDIEvent(status, delta_time=delta_time, unknown=data)
+
+
+class SegmentTests(TestCase):
+    def test_whole(self):
+        self.assertEqual([event(0xF0, b'\x01\x02\xf7')], sysex.segment(b'\xf0\x01\x02\xf7'))
+        self.assertEqual([event(0xF0, b'\xf7')], sysex.segment(b'\xf0\xf7'))
+
+    def test_segments(self):
+        self.assertEqual(
+            [
+                event(0xF0, b'\x01\x02\xf0'),
+                event(0xF7, b'\x03\x04\xf0'),
+                event(0xF7, b'\x05\xf7'),
+            ],
+            sysex.segment(b'\xf0\x01\x02\x03\x04\x05\xf7', segment_size=3),
+        )
+
+    def test_invalid(self):
+        for data in (b'\x90\x01\xf7', b'\xf0\x01', b'\xf0\x90\xf7'):
+            with self.assertRaises(ValueError):
+                sysex.segment(data)
+
+
+class SysExAssemblerTests(TestCase):
+    def setUp(self):
+        self.assembler = SysExAssembler(max_size=8, timeout=1)
+
+    def test_whole(self):
+        message = event(0xF0, b'\x01\xf7')
+        self.assertIs(message, self.assembler.feed(message, 0))
+        self.assertEqual(1, self.assembler.completed)
+
+    def test_segments(self):
+        self.assertIsNone(self.assembler.feed(event(0xF0, b'\x01\x02\xf0'), 0))
+        self.assertTrue(self.assembler.pending)
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x03\xf0'), 0.5))
+        message = self.assembler.feed(event(0xF7, b'\x04\xf7', delta_time=3), 1.0)
+        self.assertEqual(0xF0, message.status)
+        self.assertEqual(3, message.delta_time)
+        self.assertIsInstance(message.unknown, memoryview)
+        self.assertEqual(b'\x01\x02\x03\x04\xf7', bytes(message.unknown))
+        self.assertFalse(self.assembler.pending)
+
+    def test_cancel(self):
+        self.assembler.feed(event(0xF0, b'\x01\xf0'), 0)
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x02\xf4'), 0))
+        self.assertEqual(1, self.assembler.cancelled)
+        self.assertFalse(self.assembler.pending)
+
+    def test_missing_start(self):
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x03\xf0'), 0))
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x04\xf7'), 0))
+        self.assertEqual(0, self.assembler.completed)
+
+    def test_max_size(self):
+        self.assembler.feed(event(0xF0, b'\x01\x02\x03\x04\xf0'), 0)
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x05\x06\x07\x08\xf0'), 0))
+        self.assertEqual(1, self.assembler.dropped)
+        # The rest of the message is skipped; the next one is not.
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x09\xf7'), 0))
+        self.assertIsNotNone(self.assembler.feed(event(0xF0, b'\x01\xf7'), 0))
+
+    def test_timeout(self):
+        self.assembler.feed(event(0xF0, b'\x01\xf0'), 0)
+        self.assembler.expire(0.5)
+        self.assertTrue(self.assembler.pending)
+        self.assertIsNone(self.assembler.feed(event(0xF7, b'\x02\xf7'), 2))
+        self.assertEqual(1, self.assembler.dropped)
+
+    def test_new_message_interrupts(self):
+        self.assembler.feed(event(0xF0, b'\x01\xf0'), 0)
+        message = self.assembler.feed(event(0xF0, b'\x02\xf7'), 0)
+        self.assertEqual(b'\x02\xf7', message.unknown)
+        self.assertEqual(1, self.assembler.dropped)
+
+
+class ReassemblyTests(TestCase):
+    def setUp(self):
+        self.sent = []
+        self.client = Client(ssrc=1234)
+        self.client.socket = mock.Mock()
+        self.client.socket.sendto.side_effect = lambda data, addr: self.sent.append(bytes(data))
+        self.client.host, self.client.port = '127.0.0.1', 5004
+
+        self.received = []
+        self.protocol = DataProtocol(
+            mock.Mock(),
+            midi_command_cb=lambda peer, packet: self.received.extend(packet.command.midi_list),
+        )
+        self.peer = self.protocol._connect_peer('client', ('127.0.0.1', 5006), 1234)
+
+    def receive(self, packets):
+        for data in packets:
+            self.protocol.handle_message(data, ('127.0.0.1', 5006))
+
+    def test_send_sysex(self):
+        message = b'\xf0' + bytes(i % 128 for i in range(3000)) + b'\xf7'
+        self.client.send_note_on('C3')
+        self.client.send_sysex(message)
+        self.assertEqual(8, len(self.sent))
+        for data in self.sent:
+            self.assertLessEqual(len(data), 1024)
+
+        self.receive(self.sent)
+        self.assertEqual(2, len(self.received))
+        self.assertEqual(message[1:], bytes(self.received[1].unknown))
+        self.assertEqual(1, self.peer.sysex.completed)
+
+    def test_other_commands_pass_through(self):
+        self.client.send_commands(
+            [
+                event(0xF0, b'\x01\xf0'),
+                packets.MIDIEvent(0x90, 60, 100, delta_time=2),
+                event(0xF7, b'\x02\xf7', delta_time=3),
+                packets.MIDIEvent(0x80, 60, 0, delta_time=4),
+            ]
+        )
+        self.receive(self.sent)
+        self.assertEqual(
+            [
+                packets.MIDIEvent(0x90, 60, 100, delta_time=2),
+                event(0xF0, memoryview(b'\x01\x02\xf7'), delta_time=3),
+                packets.MIDIEvent(0x80, 60, 0, delta_time=4),
+            ],
+            self.received,
+        )
+
+    def test_packet_loss_drops_message(self):
+        self.client.send_sysex(b'\xf0' + bytes(30) + b'\xf7', segment_size=10)
+        self.receive(self.sent[:1] + self.sent[2:])
+        self.assertEqual([], self.received)
+        self.assertEqual(1, self.peer.sysex.dropped)
+
+    def test_disabled(self):
+        protocol = DataProtocol(mock.Mock(), reassemble_sysex=False)
+        self.assertIsNone(protocol._connect_peer('client', None, 1).sysex)
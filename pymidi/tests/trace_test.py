@@ -0,0 +1,82 @@
+import io
+import os
+import signal
+import unittest
+from unittest import TestCase
+
+import mock
+
+from pymidi import packets
+from pymidi import trace
+from pymidi.protocol import ControlProtocol, DataProtocol
+
+
+class TraceRingTests(TestCase):
+    def test_wraps(self):
+        ring = trace.TraceRing(size=3, snap_length=4)
+        for i in range(5):
+            ring.record(trace.DIRECTION_RX, i, bytes([i]) * (i + 1))
+        records = ring.records()
+        self.assertEqual([2, 3, 4], [r.ssrc for r in records])
+        self.assertEqual([b'\x02\x02\x02', b'\x03' * 4, b'\x04' * 4], [r.data for r in records])
+        self.assertEqual([3, 4, 5], [r.length for r in records])
+        ring.clear()
+        self.assertEqual([], ring.records())
+
+    def test_record_parts(self):
+        ring = trace.TraceRing(snap_length=5)
+        ring.record_parts(trace.DIRECTION_TX, 7, [b'abc', memoryview(b'defgh'), b'ij'])
+        record = ring.records()[0]
+        self.assertEqual(trace.DIRECTION_TX, record.direction)
+        self.assertEqual(b'abcde', record.data)
+        self.assertEqual(10, record.length)
+
+    def test_dump(self):
+        ring = trace.TraceRing(snap_length=2)
+        ring.record(trace.DIRECTION_RX, 0x1234, b'\xff\xff\x49')
+        ring.record(trace.DIRECTION_TX, 0x1234, b'\x80')
+        output = io.StringIO()
+        ring.dump(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].endswith(' rx ssrc=0x00001234 len=3 ffff...'), lines[0])
+        self.assertTrue(lines[1].endswith(' tx ssrc=0x00001234 len=1 80'), lines[1])
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), 'SIGUSR1 not available')
+    def test_dump_on_signal(self):
+        ring = trace.TraceRing()
+        ring.record(trace.DIRECTION_RX, 1, b'\x80')
+        output = io.StringIO()
+        previous = trace.dump_on_signal(ring, file=output)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        self.assertIn(' rx ssrc=0x00000001 len=1 80', output.getvalue())
+
+
+class ProtocolTraceTests(TestCase):
+    def test_rx_and_tx(self):
+        ring = trace.TraceRing()
+        data = DataProtocol(mock.Mock(), ssrc=5678, trace_ring=ring)
+        control = ControlProtocol(data_protocol=data, socket=mock.Mock(), trace_ring=ring)
+        invitation = packets.AppleMIDIExchangePacket.create(
+            protocol_version=2, command=b'IN', initiator_token=1, ssrc=1234, name='peer'
+        )
+        control.handle_message(invitation, ('127.0.0.1', 5004))
+        data.handle_message(invitation, ('127.0.0.1', 5005))
+        writer = packets.MIDIPacketWriter(1234)
+        data.handle_message(
+            memoryview(writer.write_command(1, 0, 0x90, 60, 100)), ('127.0.0.1', 5005)
+        )
+        data.send_commands(data.peers_by_ssrc[1234], [packets.MIDIEvent(0x90, 60, 100)])
+
+        records = ring.records()
+        directions = [trace.DIRECTION_NAMES[r.direction] for r in records]
+        self.assertEqual(['rx', 'tx', 'rx', 'tx', 'rx', 'tx'], directions)
+        self.assertEqual([1234] * 6, [r.ssrc for r in records])
+        self.assertEqual(invitation[:64], records[0].data)
+        self.assertEqual(b'\xff\xffOK', records[1].data[:4])
+        self.assertEqual(
+            0x90, packets.decode_midi_packet(records[5].data).command.midi_list[0].status
+        )
@@ -0,0 +1,125 @@
+"""A fixed-size ring of the most recent datagrams, for debugging live servers.
+
+Protocols record every datagram they receive and send in a `TraceRing`:
+its time, direction, the peer's SSRC, and its first bytes. Recording packs
+these into a preallocated `bytearray`, so tracing can stay on in
+production, where DEBUG logging would cost too much; the ring is read only
+when dumped, with `dump()` or, after `dump_on_signal()`, on a signal:
+
+    $ kill -USR1 <pid>
+
+Like `pymidi.metrics`, recording takes no lock: a record written by
+another thread at the same time as the serving one may, rarely, be lost.
+"""
+
+import collections
+import signal
+import struct
+import sys
+import time
+
+# Records kept by default.
+DEFAULT_SIZE = 1024
+
+# Bytes of each datagram kept by default.
+DEFAULT_SNAP_LENGTH = 64
+
+DIRECTION_RX = 0
+DIRECTION_TX = 1
+
+DIRECTION_NAMES = {DIRECTION_RX: 'rx', DIRECTION_TX: 'tx'}
+
+# Time (`time.time_ns()`), direction, bytes kept, datagram length, SSRC.
+_HEADER = struct.Struct('<QBxHHI')
+
+TraceRecord = collections.namedtuple('TraceRecord', 'time_ns direction ssrc length data')
+
+
+class TraceRing(object):
+    def __init__(self, size=DEFAULT_SIZE, snap_length=DEFAULT_SNAP_LENGTH):
+        """Creates a new TraceRing, keeping the last `size` datagrams.
+
+        Of each, the first `snap_length` bytes are kept.
+        """
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.size = size
+        self.snap_length = snap_length
+        self.record_size = _HEADER.size + snap_length
+        self.buffer = bytearray(size * self.record_size)
+        # Records written since creation, including those overwritten.
+        self.count = 0
+
+    def record(self, direction, ssrc, data):
+        """Records datagram `data`, any bytes-like object."""
+        offset = (self.count % self.size) * self.record_size
+        self.count += 1
+        kept = min(len(data), self.snap_length)
+        _HEADER.pack_into(self.buffer, offset, time.time_ns(), direction, kept, len(data), ssrc)
+        start = offset + _HEADER.size
+        self.buffer[start : start + kept] = data[:kept]
+
+    def record_parts(self, direction, ssrc, parts):
+        """Records a datagram given as a list of bytes-like `parts`, without joining them."""
+        offset = (self.count % self.size) * self.record_size
+        self.count += 1
+        start = offset + _HEADER.size
+        length = kept = 0
+        for part in parts:
+            length += len(part)
+            if kept < self.snap_length:
+                chunk = part[: self.snap_length - kept]
+                self.buffer[start + kept : start + kept + len(chunk)] = chunk
+                kept += len(chunk)
+        _HEADER.pack_into(self.buffer, offset, time.time_ns(), direction, kept, length, ssrc)
+
+    def clear(self):
+        self.count = 0
+
+    def records(self):
+        """Returns the `TraceRecord`s held, oldest first."""
+        result = []
+        first = max(0, self.count - self.size)
+        for i in range(first, self.count):
+            offset = (i % self.size) * self.record_size
+            time_ns, direction, kept, length, ssrc = _HEADER.unpack_from(self.buffer, offset)
+            start = offset + _HEADER.size
+            data = bytes(self.buffer[start : start + kept])
+            result.append(TraceRecord(time_ns, direction, ssrc, length, data))
+        return result
+
+    def dump(self, file=None):
+        """Writes the records held, oldest first, one per line, to `file` (default stderr)."""
+        file = file or sys.stderr
+        for record in self.records():
+            file.write(format_record(record) + '\n')
+        file.flush()
+
+
+def format_record(record):
+    """Returns a line such as `2020-01-12 10:00:00.000123 rx ssrc=0x0000162e len=36 ffff494e...`."""
+    seconds, nanoseconds = divmod(record.time_ns, 10 ** 9)
+    return '{}.{:06d} {} ssrc=0x{:08x} len={} {}{}'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds)),
+        nanoseconds // 1000,
+        DIRECTION_NAMES.get(record.direction, '?'),
+        record.ssrc,
+        record.length,
+        record.data.hex(),
+        '...' if len(record.data) < record.length else '',
+    )
+
+
+def dump_on_signal(ring, signum=None, file=None):
+    """Dumps `ring` to `file` (default stderr) whenever signal `signum` arrives.
+
+    `signum` defaults to SIGUSR1. Must be called from the main thread.
+    Returns the previous handler.
+    """
+    if signum is None:
+        signum = signal.SIGUSR1
+
+    def handler(signum, frame):
+        ring.dump(file)
+
+    return signal.signal(signum, handler)
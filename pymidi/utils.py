@@ -1,4 +1,3 @@
-import codecs
 import socket
 from six import string_types
 from builtins import bytes
@@ -13,10 +12,7 @@ def b2h(b):
     """Converts a `bytes` object to a hex string."""
     if not isinstance(b, bytes):
         raise ValueError('Argument must be a `bytes`')
-    result = codecs.getencoder('hex_codec')(b)[0]
-    if isinstance(result, bytes):
-        result = result.decode('ascii')
-    return result
+    return b.hex()
 
 
 def is_ipv4_address(ipstr):